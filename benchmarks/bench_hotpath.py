@@ -0,0 +1,76 @@
+"""
+Allocation and time per incoming message on the _triagemessage hot path for
+chats without enabled plugins, i.e. the messages that are dropped.
+
+    python benchmarks/bench_hotpath.py [--messages N]
+"""
+from argparse import ArgumentParser
+import gc
+import json
+from os import chdir, getcwd
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+import yaml
+
+from signalbot import Signalbot
+from signalbot.signalbot import Chats
+from signalbot.triggers import TriggerIndex
+
+
+def make_bot(data_dir):
+    Path.joinpath(data_dir, 'config.yaml').write_text(
+        yaml.dump({'master': ['+123']}))
+    bot = Signalbot(data_dir=data_dir)
+    # Only what _triagemessage needs, without connecting to a bus
+    bot._chats = Chats(bot=bot)
+    bot._triggers = TriggerIndex()
+    bot._fakecwd = TemporaryDirectory()
+    return bot
+
+
+def run(bot, messages):
+    # 32 byte group ids as delivered by D-Bus, i.e. as lists of ints
+    group_ids = [list(range(i, i + 32)) for i in range(16)]
+    signals = [(1, '+{}'.format(i), group_ids[i % 16], 'hello', [])
+               for i in range(messages)]
+
+    gc.collect()
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    tracemalloc.start()
+    start = perf_counter()
+    for signal in signals:
+        bot._triagemessage(*signal)
+    seconds = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - \
+        collections
+
+    return {
+        'messages': messages,
+        'seconds_per_message': seconds / messages,
+        'peak_traced_bytes': peak,
+        'gc_collections': collections,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    cwd = getcwd()
+    with TemporaryDirectory() as data_dir:
+        bot = make_bot(Path(data_dir))
+        chdir(bot._fakecwd.name)
+        try:
+            print(json.dumps(run(bot, args.messages), indent=2))
+        finally:
+            chdir(cwd)
+            bot._fakecwd.cleanup()
+
+
+if __name__ == '__main__':
+    main()
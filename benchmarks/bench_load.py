@@ -0,0 +1,187 @@
+"""
+Throughput/latency benchmark of a signal-bot process under generated load.
+
+Starts the D-Bus mock and `signal-bot --mocker`, enables the benchsleep and
+benchcpu testing plugins round-robin in M direct and group chats and sends N
+messages per second spread over those chats. Reports throughput, inbound
+message to reply latency percentiles, peak thread count and peak RSS of the
+bot process as JSON. Requires a D-Bus session bus, like the test suite.
+
+    python benchmarks/bench_load.py --rate 200 --duration 10 --output x.json
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import platform
+from signalclidbusmock import Mocker
+from subprocess import Popen
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+import time
+import yaml
+
+
+PLUGINS = ['benchsleep', 'benchcpu']
+
+
+def make_chats(direct, groups):
+    chats = [('+{:010d}'.format(i), []) for i in range(direct)]
+    chats += [('+0000000000', [1, i >> 8 & 255, i & 255])
+              for i in range(groups)]
+    return chats
+
+
+def write_config(data_dir, chats, args):
+    enabled = {}
+    for i, (sender, group_id) in enumerate(chats):
+        chat_id = tuple(group_id) if group_id else sender
+        enabled[chat_id] = [PLUGINS[i % len(PLUGINS)]]
+    config = {
+        'master': ['+123'],
+        'testing_plugins': PLUGINS,
+        'startup_notification': True,
+        # Imported once into the bot's state store
+        'enabled': enabled,
+    }
+    config.update(yaml.safe_load(args.config) if args.config else {})
+    Path.joinpath(data_dir, 'config.yaml').write_text(yaml.dump(config))
+
+
+def read_proc_status(pid):
+    status = {}
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()[0]
+    return status
+
+
+def sample_process(pid, peaks, stop, interval=.05):
+    while not stop.wait(interval):
+        try:
+            status = read_proc_status(pid)
+        except (FileNotFoundError, ProcessLookupError):
+            return
+        peaks['threads'] = max(peaks['threads'], int(status['Threads']))
+        # VmHWM is the peak resident set size, in kB
+        peaks['rss_kb'] = max(peaks['rss_kb'], int(status['VmHWM']))
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(args):
+    chats = make_chats(args.direct_chats, args.group_chats)
+    messages = int(args.rate * args.duration)
+
+    with TemporaryDirectory() as data_dir:
+        write_config(Path(data_dir), chats, args)
+
+        mocker = Mocker()
+        mocker.start()
+        bot = Popen(['signal-bot', '--data-dir', data_dir, '--mocker'])
+        peaks = {'threads': 0, 'rss_kb': 0}
+        stop = Event()
+        sampler = Thread(target=sample_process, daemon=True,
+                         args=[bot.pid, peaks, stop])
+        try:
+            # Wait for the startup notification
+            if not mocker.wait_for_n_messages(n=1, timeout=30):
+                raise RuntimeError('signal-bot did not start up')
+            sampler.start()
+            replies_before = len(mocker.fromsignalbot)
+
+            sent = {}
+            start = time.time()
+            for i in range(messages):
+                # Keep to the requested rate without drifting
+                delay = start + i / args.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                chat_index = i % len(chats)
+                sender, group_id = chats[chat_index]
+                if PLUGINS[chat_index % len(PLUGINS)] == 'benchsleep':
+                    param = args.sleep_ms
+                else:
+                    param = args.cpu_rounds
+                sent[str(i)] = time.time()
+                mocker.messageSignalbot(
+                    sender, group_id, 'bench {} {}'.format(i, param), [])
+            sending = time.time() - start
+
+            mocker.wait_for_n_messages(n=messages,
+                                       timeout=args.drain_timeout)
+        finally:
+            stop.set()
+            bot.terminate()
+            bot.wait()
+            mocker.stop()
+
+    latencies = []
+    last_reply = start
+    for reply_time, text, _, _ in mocker.fromsignalbot[replies_before:]:
+        message_id = text.split(' ')[1] if text.startswith('bench ') else None
+        if message_id in sent:
+            latencies.append(reply_time - sent.pop(message_id))
+            last_reply = max(last_reply, reply_time)
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': vars(args),
+        'messages_sent': messages,
+        'replies_received': len(latencies),
+        'replies_missing': len(sent),
+        'send_seconds': sending,
+        'throughput_per_second': len(latencies) / (last_reply - start)
+        if latencies else 0.,
+        'latency_seconds': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+        'peak_threads': peaks['threads'],
+        'peak_rss_kb': peaks['rss_kb'],
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rate', type=float, default=100,
+                        help='Messages per second')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds to generate load for')
+    parser.add_argument('--direct-chats', type=int, default=20)
+    parser.add_argument('--group-chats', type=int, default=20)
+    parser.add_argument('--sleep-ms', type=int, default=50,
+                        help='Sleep per message of the benchsleep plugin')
+    parser.add_argument('--cpu-rounds', type=int, default=20000,
+                        help='Hashing rounds per message of benchcpu')
+    parser.add_argument('--drain-timeout', type=float, default=60,
+                        help='Seconds to wait for outstanding replies')
+    parser.add_argument('--config', default=None,
+                        help='YAML mapping merged into the bot config, e.g. '
+                             '"{worker_threads: 32}"')
+    parser.add_argument('--output', default=None,
+                        help='Write the JSON results to this file')
+    args = parser.parse_args()
+
+    if args.direct_chats + args.group_chats < 1:
+        parser.error('At least one chat is needed')
+
+    results = json.dumps(run(args), indent=2)
+    if args.output is None:
+        print(results)
+    else:
+        Path(args.output).write_text(results + '\n')
+
+
+if __name__ == '__main__':
+    main()
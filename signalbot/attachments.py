@@ -0,0 +1,173 @@
+from collections import Counter as Multiset
+from hashlib import sha256
+import mmap
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+from .metrics import Counter
+
+
+STORED = Counter(
+    'signalbot_attachments_stored_total',
+    'Attachments put into the store, by whether they were already there',
+    ['outcome'])
+EVICTED = Counter(
+    'signalbot_attachments_evicted_total',
+    'Attachments removed from the store to stay within its quota')
+
+
+class AttachmentStore(object):
+    """
+    Content-addressed store for attachment files.
+
+    Files are stored under their SHA-256 (keeping the original suffix, from
+    which signal-cli guesses the content type), so putting the same content
+    twice returns the same path and only uses the disk space once. Once the
+    store grows beyond `quota` bytes (0 for no limit), the least recently
+    put files are removed, except for those queued for sending (see pin())
+    and those put within the last `grace` seconds.
+
+    Several processes may share a store: files are only ever created by
+    atomically renaming complete files into place.
+    """
+
+    def __init__(self, path, quota=0, grace=60):
+        self._path = Path(path)
+        self._quota = quota
+        self._grace = grace
+
+        # All of the following is protected by _lock
+        self._lock = Lock()
+        # Paths of queued outgoing attachments -> number of messages
+        self._pins = Multiset()
+        # Estimated size of the store; None until first scanned
+        self._size = None
+
+    def __reduce__(self):
+        # Sent to plugin worker processes, which share the files
+        return (AttachmentStore, (self._path, self._quota, self._grace))
+
+    @property
+    def path(self):
+        return self._path
+
+    def put(self, data, suffix=''):
+        """
+        Store `data` (bytes) and return the path of the stored file.
+        """
+        digest = sha256(data).hexdigest()
+        return self._put(digest + suffix, lambda f: f.write(data))
+
+    def put_file(self, path):
+        """
+        Store a copy of the file at `path` and return the path of the stored
+        file, which is `path` itself if it already is in the store.
+        """
+        path = Path(path)
+        if self.contains(path):
+            return path
+        digest = sha256()
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+
+        def write(target):
+            with path.open('rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    target.write(chunk)
+        return self._put(digest.hexdigest() + path.suffix, write)
+
+    def _put(self, name, write):
+        directory = Path.joinpath(self._path, name[:2])
+        path = Path.joinpath(directory, name)
+        try:
+            # Counts as a use for the least recently used eviction
+            os.utime(path)
+            STORED.inc(outcome='duplicate')
+            return path
+        except FileNotFoundError:
+            pass
+
+        Path.mkdir(directory, exist_ok=True, parents=True)
+        with NamedTemporaryFile(dir=directory, prefix='.', delete=False) as f:
+            try:
+                write(f)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+        STORED.inc(outcome='new')
+        self.added(path.stat().st_size)
+        return path
+
+    def added(self, size):
+        """
+        Account for a new file of `size` bytes, which may have been put by
+        another process sharing the store, evicting files if need be.
+        """
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+        if self._quota:
+            self.evict()
+
+    def contains(self, path):
+        return Path(path).parent.parent == self._path
+
+    def open(self, path):
+        """
+        Read-only, memory-mapped view of any (e.g. incoming) attachment
+        file; nothing is copied into memory up front.
+        """
+        with open(str(path), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def pin(self, paths):
+        """
+        Keep the stored files among `paths` until unpin()ned, e.g. while the
+        message they are attached to is queued.
+        """
+        paths = [Path(path) for path in paths if self.contains(path)]
+        with self._lock:
+            self._pins.update(paths)
+
+    def unpin(self, paths):
+        paths = [Path(path) for path in paths if self.contains(path)]
+        with self._lock:
+            self._pins.subtract(paths)
+            self._pins += Multiset()
+
+    def evict(self):
+        with self._lock:
+            if self._size is not None and self._size <= self._quota:
+                return
+
+            files = []
+            for directory in self._path.glob('??'):
+                for entry in os.scandir(str(directory)):
+                    if entry.is_file() and not entry.name.startswith('.'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size,
+                                      Path(entry.path)))
+            self._size = sum(size for _, size, _ in files)
+
+            # Least recently put first
+            files.sort()
+            cutoff = time() - self._grace
+            for mtime, size, path in files:
+                if self._size <= self._quota or mtime >= cutoff:
+                    break
+                if path in self._pins:
+                    continue
+                try:
+                    os.unlink(str(path))
+                except FileNotFoundError:
+                    # Evicted by another process
+                    pass
+                self._size -= size
+                EVICTED.inc()
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from .clock import Clock
+from .metrics import Counter
+from threading import Lock
+
+
+CACHE_HITS = Counter(
+    'signalbot_cache_hits_total',
+    'Lookups answered from a plugin cache, including those that waited '
+    'for the same computation in progress', ['plugin', 'cache'])
+CACHE_MISSES = Counter(
+    'signalbot_cache_misses_total',
+    'Lookups of a plugin cache that had to compute the value',
+    ['plugin', 'cache'])
+CACHE_EVICTIONS = Counter(
+    'signalbot_cache_evictions_total',
+    'Values dropped from a plugin cache because it was full or they had '
+    'expired', ['plugin', 'cache'])
+
+
+class Cache(object):
+    """
+    Memoizes computed values by key, keeping up to `maxsize` values (0 for
+    no limit) for up to `ttl` seconds each (None for no limit) and evicting
+    the least recently used one first.
+
+    Concurrent lookups of a key that is not cached yet only compute the
+    value once: the others wait for and share its result. Exceptions are
+    passed on to all of them but not cached.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=None, plugin=None,
+                 name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = Clock() if clock is None else clock
+        self._labels = {'plugin': plugin, 'cache': name}
+
+        # Protects _values and _pending
+        self._lock = Lock()
+        # Key -> (expiry time or None, value), least recently used first
+        self._values = OrderedDict()
+        # Key -> Future of the value being computed
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, compute):
+        """
+        The value cached for `key` or, if there is none, the result of
+        compute(), which is then cached.
+        """
+        with self._lock:
+            now = self._clock.monotonic()
+            if key in self._values:
+                expiry, value = self._values[key]
+                if expiry is None or expiry > now:
+                    self._values.move_to_end(key)
+                    self._hit()
+                    return value
+                del self._values[key]
+                self._evicted(1)
+
+            if key in self._pending:
+                future = self._pending[key]
+                computing = False
+                self._hit()
+            else:
+                future = self._pending[key] = Future()
+                computing = True
+                self._missed()
+
+        if not computing:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            expiry = None
+            if self.ttl is not None:
+                expiry = self._clock.monotonic() + self.ttl
+            self._values[key] = (expiry, value)
+            self._values.move_to_end(key)
+            if self.maxsize:
+                evicted = 0
+                while len(self._values) > self.maxsize:
+                    self._values.popitem(last=False)
+                    evicted += 1
+                self._evicted(evicted)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._values)}
+
+    def _hit(self):
+        self.hits += 1
+        CACHE_HITS.inc(**self._labels)
+
+    def _missed(self):
+        self.misses += 1
+        CACHE_MISSES.inc(**self._labels)
+
+    def _evicted(self, n):
+        if n:
+            self.evictions += n
+            CACHE_EVICTIONS.inc(n, **self._labels)
+
+
+# Separates positional from keyword arguments in keys
+_KWARGS = object()
+
+
+def _make_key(args, kwargs):
+    if kwargs:
+        return args + (_KWARGS,) + tuple(sorted(kwargs.items()))
+    return args
+
+
+def cached(maxsize=1024, ttl=None, per_chat=False, key=None):
+    """
+    Decorator for PluginChat methods whose result only depends on their
+    arguments, e.g. a lookup or conversion: calls with the same arguments
+    are answered from a Cache shared by all chats of the plugin, or only
+    by calls in the same chat with `per_chat`. The arguments have to be
+    hashable, unless `key` is given, which is called with them to compute
+    the cache key. Cached values are shared, so do not modify them.
+
+    The Cache is available as self.cache(<method name>), for instance to
+    invalidate values or look at its stats.
+    """
+    def decorator(method):
+        name = method.__name__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if key is None:
+                cache_key = _make_key(args, kwargs)
+            else:
+                cache_key = key(*args, **kwargs)
+            if per_chat:
+                cache_key = (self.chat.id, cache_key)
+            cache = self.cache(name, maxsize, ttl)
+            return cache.get(cache_key,
+                             lambda: method(self, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,129 @@
+import heapq
+from itertools import count
+from threading import Condition, get_ident
+import time
+
+
+class Clock(object):
+    """
+    The time as seen by the bot and its plugins, i.e. the real time. Tests
+    may replace it with a VirtualClock.
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, condition, timeout=None):
+        """
+        Like condition.wait(timeout); the condition has to be held.
+        """
+        return condition.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    Clock whose time only moves on when advanced, so that sleeping and
+    waiting for timeouts take no real time.
+
+    The time is only ever moved on by advance(), so that it does not depend
+    on how threads happen to be scheduled; wait_for_sleepers() tells when
+    the threads expected to sleep are about to be woken by it.
+    """
+
+    def __init__(self, start=0.):
+        # All of the following is protected by _cv
+        self._cv = Condition()
+        self._now = start
+        # Heap of (deadline, timer id, condition to notify)
+        self._timers = []
+        # Ids of the timers in _timers that have not been cancelled -> the
+        # ident of the thread sleeping or waiting
+        self._live = {}
+        self._ids = count()
+
+    def time(self):
+        with self._cv:
+            return self._now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        condition = Condition()
+        with condition:
+            deadline, timer = self._add_timer(seconds, condition)
+            try:
+                while self.time() < deadline:
+                    condition.wait()
+            finally:
+                self._cancel_timer(timer)
+
+    def wait(self, condition, timeout=None):
+        if timeout is None:
+            return condition.wait()
+        deadline, timer = self._add_timer(timeout, condition)
+        try:
+            # Woken either by whoever else notifies the condition or by
+            # the clock reaching the deadline
+            condition.wait()
+        finally:
+            self._cancel_timer(timer)
+        return self.time() < deadline
+
+    def advance(self, seconds):
+        with self._cv:
+            self._now += seconds
+            due = self._due()
+        self._notify(due)
+
+    def wait_for_sleepers(self, n, timeout=10):
+        """
+        Wait up to `timeout` real seconds until at least `n` threads sleep
+        or wait with a timeout on the clock. Returns whether they do.
+        """
+        with self._cv:
+            return self._cv.wait_for(
+                lambda: len(set(self._live.values())) >= n, timeout)
+
+    def _add_timer(self, seconds, condition):
+        with self._cv:
+            deadline = self._now + max(seconds, 0)
+            timer = next(self._ids)
+            heapq.heappush(self._timers, (deadline, timer, condition))
+            self._live[timer] = get_ident()
+            self._cv.notify_all()
+        return deadline, timer
+
+    def _cancel_timer(self, timer):
+        with self._cv:
+            self._live.pop(timer, None)
+
+    def _next_deadline(self):
+        # Drop cancelled timers on the way
+        while self._timers and self._timers[0][1] not in self._live:
+            heapq.heappop(self._timers)
+        return self._timers[0][0] if self._timers else None
+
+    def _due(self):
+        """
+        Remove the timers that are due and return their conditions.
+        """
+        conditions = []
+        while self._next_deadline() is not None and \
+                self._timers[0][0] <= self._now:
+            _, timer, condition = heapq.heappop(self._timers)
+            del self._live[timer]
+            conditions.append(condition)
+        return conditions
+
+    def _notify(self, conditions):
+        # Not holding _cv, since the waiting threads hold their condition
+        # while looking at the time
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
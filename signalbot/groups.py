@@ -0,0 +1,136 @@
+from concurrent.futures import Future
+from .clock import Clock
+from .metrics import Counter
+from threading import Lock
+from traceback import print_exc
+from .workers import WorkerPool
+
+
+GROUP_LOOKUPS = Counter(
+    'signalbot_group_lookups_total',
+    'Lookups of group names and members by whether they were cached',
+    ['outcome'])
+
+
+class GroupCache(object):
+    """
+    Names and members of groups as (name, members) tuples, looked up with
+    `fetch`, which is called with a list of group ids and returns
+    {group_id: (name, members)}.
+
+    Entries older than `ttl` seconds are still returned but refreshed in
+    the background, so only the very first lookup of a group waits for
+    signal-cli. warm_up() looks up many groups at once in the background,
+    e.g. at startup.
+    """
+
+    def __init__(self, fetch, ttl=300, clock=None, batch_size=100):
+        self._fetch = fetch
+        self._ttl = ttl
+        self._clock = Clock() if clock is None else clock
+        self._batch_size = batch_size
+
+        # Protects _entries and _pending
+        self._lock = Lock()
+        # Group id -> (time fetched, (name, members))
+        self._entries = {}
+        # Group id -> Future of the fetch in progress
+        self._pending = {}
+
+        self._refresher = WorkerPool(threads=1, queue_size=0)
+
+    def get(self, group_id):
+        group_id = bytes(group_id)
+        with self._lock:
+            entry = self._entries.get(group_id)
+            if entry is not None:
+                fetched, info = entry
+                if self._clock.monotonic() - fetched < self._ttl:
+                    GROUP_LOOKUPS.inc(outcome='hit')
+                elif group_id not in self._pending:
+                    GROUP_LOOKUPS.inc(outcome='stale')
+                    self._pending[group_id] = Future()
+                    self._refresher.submit(self._refresh, [group_id])
+                return info
+
+            GROUP_LOOKUPS.inc(outcome='miss')
+            future = self._pending.get(group_id)
+            if future is None:
+                future = self._pending[group_id] = Future()
+                fetching = True
+            else:
+                # Someone else is looking it up already
+                fetching = False
+
+        if fetching:
+            self._refresh([group_id], background=False)
+        return future.result()
+
+    def warm_up(self, group_ids):
+        """
+        Look up the groups that are not cached yet in the background, in
+        batches of batch_size. Returns a future resolved once done.
+        """
+        with self._lock:
+            group_ids = [bytes(group_id) for group_id in group_ids]
+            group_ids = [group_id for group_id in group_ids
+                         if group_id not in self._entries and
+                         group_id not in self._pending]
+            for group_id in group_ids:
+                self._pending[group_id] = Future()
+        futures = [self._refresher.submit(
+            self._refresh, group_ids[i:i + self._batch_size])
+            for i in range(0, len(group_ids), self._batch_size)]
+
+        done = Future()
+        if not futures:
+            done.set_result(None)
+            return done
+        remaining = [len(futures)]
+
+        def batch_done(future):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            done.set_result(None)
+        for future in futures:
+            future.add_done_callback(batch_done)
+        return done
+
+    def invalidate(self, group_id):
+        with self._lock:
+            self._entries.pop(bytes(group_id), None)
+
+    def _refresh(self, group_ids, background=True):
+        """
+        Fetch the groups, for each of which a future has been put into
+        _pending.
+        """
+        try:
+            infos = self._fetch(group_ids)
+        except Exception as e:
+            # Cached entries are kept and retried on their next lookup
+            with self._lock:
+                futures = [self._pending.pop(group_id)
+                           for group_id in group_ids]
+            if background:
+                # Nobody else is going to see the error
+                print_exc()
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        now = self._clock.monotonic()
+        with self._lock:
+            futures = []
+            for group_id in group_ids:
+                name, members = infos.get(group_id, ('', []))
+                info = (name, tuple(members))
+                self._entries[group_id] = (now, info)
+                futures.append((self._pending.pop(group_id), info))
+        for future, info in futures:
+            future.set_result(info)
+
+    def close(self):
+        self._refresher.shutdown(wait=True)
@@ -0,0 +1,145 @@
+from .metrics import Histogram
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic
+from traceback import print_exc
+from .tracing import TRACER
+
+
+WAIT_SECONDS = Histogram(
+    'signalbot_ingress_wait_seconds',
+    'Time incoming messages spent waiting for a dispatcher thread')
+
+
+class Ingress(object):
+    """
+    Decouples receiving signals from handling them.
+
+    put() only enqueues the raw arguments and returns, so it is cheap enough
+    to be called from a transport's receiving thread. Once started,
+    dispatcher threads drain the queues and call `handler`. With more than
+    one dispatcher, items are sharded by `key` so items with the same key
+    are still handled in order.
+
+    Each item is handled as a new trace of signalbot.tracing.TRACER, which
+    starts with the time the item waited in its queue.
+
+    Items for which `priority` returns True go through a priority lane, a
+    queue with a dispatcher of its own, so they do not wait behind other
+    items. Items of a key that has items pending in one lane follow them
+    into that lane, so items with the same key are still handled in order.
+    """
+
+    def __init__(self, handler, key, threads=1, priority=None):
+        if threads < 1:
+            raise ValueError("Ingress needs at least one dispatcher thread")
+
+        self._handler = handler
+        self._key = key
+        self._priority = priority
+        self._queues = [Queue() for _ in range(threads)]
+        self._threads = []
+
+        if priority is not None:
+            self._priority_queue = Queue()
+            # Key -> [queue, number of its items pending there], protected
+            # by _lanes_lock
+            self._lanes = {}
+            self._lanes_lock = Lock()
+
+    def start(self):
+        """
+        Start handling items; items put before are buffered until then.
+        """
+        queues = list(self._queues)
+        if self._priority is not None:
+            queues.append(self._priority_queue)
+        for queue in queues:
+            t = Thread(args=[queue], daemon=True, target=self._dispatch)
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def depth(self):
+        depth = sum(queue.qsize() for queue in self._queues)
+        if self._priority is not None:
+            depth += self._priority_queue.qsize()
+        return depth
+
+    @property
+    def idle(self):
+        """
+        Whether all items put so far have been handled.
+        """
+        queues = list(self._queues)
+        if self._priority is not None:
+            queues.append(self._priority_queue)
+        return not any(queue.unfinished_tasks for queue in queues)
+
+    def _shard(self, key):
+        if len(self._queues) == 1:
+            return self._queues[0]
+        return self._queues[hash(key) % len(self._queues)]
+
+    def put(self, *args):
+        if self._priority is None:
+            if len(self._queues) == 1:
+                queue = self._queues[0]
+            else:
+                queue = self._shard(self._key(*args))
+            queue.put((monotonic(), args))
+            return
+
+        key = self._key(*args)
+        with self._lanes_lock:
+            if key in self._lanes:
+                lane = self._lanes[key]
+            else:
+                if self._priority(*args):
+                    lane = [self._priority_queue, 0]
+                else:
+                    lane = [self._shard(key), 0]
+                self._lanes[key] = lane
+            lane[1] += 1
+            lane[0].put((monotonic(), args))
+
+    def _handled(self, args):
+        key = self._key(*args)
+        with self._lanes_lock:
+            lane = self._lanes[key]
+            lane[1] -= 1
+            if lane[1] == 0:
+                del self._lanes[key]
+
+    def _dispatch(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            enqueued, args = item
+
+            dispatched = monotonic()
+            WAIT_SECONDS.observe(dispatched - enqueued)
+            trace_id = TRACER.new_trace()
+            TRACER.add('ingress wait', enqueued, dispatched, trace_id)
+
+            # Keep the dispatcher alive no matter what the handler does
+            try:
+                with TRACER.trace(trace_id):
+                    self._handler(*args)
+            except Exception:
+                print_exc()
+            finally:
+                if self._priority is not None:
+                    self._handled(args)
+                queue.task_done()
+
+    def shutdown(self, wait=False):
+        # Items queued before the sentinels are still handled
+        for queue in self._queues:
+            queue.put(None)
+        if self._priority is not None:
+            self._priority_queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
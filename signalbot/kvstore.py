@@ -0,0 +1,311 @@
+from ast import literal_eval
+from collections import OrderedDict
+from contextlib import contextmanager
+from .metrics import Histogram
+from pathlib import Path
+import pickle
+import shutil
+import sqlite3
+from .state import _encode_chat_id
+from threading import Event, Lock, Thread
+from traceback import print_exc
+
+
+FLUSH_SECONDS = Histogram(
+    'signalbot_store_flush_seconds',
+    'Time spent committing buffered writes of a plugin store', ['plugin'])
+
+# Marks deleted keys among buffered writes
+_DELETED = object()
+
+
+class KVStore(object):
+    """
+    Key-value store shared by all chats of a plugin, kept in a single SQLite
+    file instead of a directory per chat.
+
+    Values can be any picklable object and are copied (pickled) when set.
+    Writes are buffered in memory and committed by a background thread every
+    `flush_interval` seconds, or once `max_pending` writes have piled up, in
+    a single transaction. Recently read values are cached. Use chat() to get
+    the view of a single chat.
+    """
+
+    def __init__(self, path, plugin=None, flush_interval=1.,
+                 max_pending=1000, cache_size=10000):
+        self._plugin = plugin
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._cache_size = cache_size
+
+        # Protects _pending and _cache; the connection has its own lock so
+        # that buffering writes does not wait for a commit in progress. When
+        # holding both, _db_lock is acquired first.
+        self._lock = Lock()
+        self._db_lock = Lock()
+        # Other processes (see signalbot.processes) may write concurrently
+        self._db = sqlite3.connect(str(path), check_same_thread=False,
+                                   timeout=30)
+        with self._db_lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS kv ('
+                'chat TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, '
+                'PRIMARY KEY (chat, key))')
+
+        # (chat, key) -> pickled value or _DELETED, not committed yet
+        self._pending = {}
+        # (chat, key) -> pickled value or _DELETED, least recently used
+        # first
+        self._cache = OrderedDict()
+
+        self._flush_requested = Event()
+        self._closed = False
+        self._flusher = Thread(daemon=True, target=self._run)
+        self._flusher.start()
+
+    def chat(self, chat_id, lock=None):
+        """
+        The store of a single chat; its transactions hold `lock`.
+        """
+        return ChatStore(self, _encode_chat_id(chat_id), lock)
+
+    def _get(self, chat, key):
+        with self._lock:
+            if (chat, key) in self._pending:
+                return self._pending[(chat, key)]
+            if (chat, key) in self._cache:
+                self._cache.move_to_end((chat, key))
+                return self._cache[(chat, key)]
+
+        # Holding _db_lock until the value is cached, so no flush of a newer
+        # value can happen in between
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT value FROM kv WHERE chat = ? AND key = ?',
+                (chat, key)).fetchone()
+            value = _DELETED if row is None else row[0]
+
+            with self._lock:
+                if (chat, key) in self._pending:
+                    # Overwritten in the meantime
+                    return self._pending[(chat, key)]
+                self._cache[(chat, key)] = value
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return value
+
+    def _keys(self, chat):
+        with self._db_lock:
+            keys = [key for key, in self._db.execute(
+                'SELECT key FROM kv WHERE chat = ? ORDER BY key', (chat,))]
+        with self._lock:
+            keys = set(keys)
+            for (pending_chat, key), value in self._pending.items():
+                if pending_chat == chat:
+                    if value is _DELETED:
+                        keys.discard(key)
+                    else:
+                        keys.add(key)
+        return sorted(keys)
+
+    def _write(self, chat, writes):
+        """
+        Buffer a dict of key -> pickled value or _DELETED, all at once.
+        """
+        with self._lock:
+            for key, value in writes.items():
+                self._pending[(chat, key)] = value
+                self._cache.pop((chat, key), None)
+            if len(self._pending) >= self._max_pending:
+                self._flush_requested.set()
+
+    def flush(self):
+        """
+        Commit all buffered writes now.
+        """
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with FLUSH_SECONDS.time(plugin=self._plugin), self._db:
+                    self._db.executemany(
+                        'DELETE FROM kv WHERE chat = ? AND key = ?',
+                        [key for key, value in pending.items()
+                         if value is _DELETED])
+                    self._db.executemany(
+                        'INSERT OR REPLACE INTO kv (chat, key, value) '
+                        'VALUES (?, ?, ?)',
+                        [key + (value,) for key, value in pending.items()
+                         if value is not _DELETED])
+            except BaseException:
+                # Try again next time, unless overwritten in the meantime
+                with self._lock:
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                raise
+            with self._lock:
+                # Keep what has just been written around for reading
+                for key, value in pending.items():
+                    if key not in self._pending:
+                        self._cache[key] = value
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+    def _run(self):
+        while not self._closed:
+            self._flush_requested.wait(self._flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception:
+                print_exc()
+
+    def close(self):
+        self._closed = True
+        self._flush_requested.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+
+class ChatStore(object):
+    """
+    Dict-like view of a chat's keys in a KVStore. Writes become visible to
+    reads right away and are committed in the background.
+    """
+
+    def __init__(self, kvstore, chat, lock=None):
+        self._kvstore = kvstore
+        self._chat = chat
+        self._lock = lock
+
+    def get(self, key, default=None):
+        value = self._kvstore._get(self._chat, key)
+        return default if value is _DELETED else pickle.loads(value)
+
+    def __getitem__(self, key):
+        value = self._kvstore._get(self._chat, key)
+        if value is _DELETED:
+            raise KeyError(key)
+        return pickle.loads(value)
+
+    def __setitem__(self, key, value):
+        self._kvstore._write(self._chat, {key: pickle.dumps(value)})
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._kvstore._write(self._chat, {key: _DELETED})
+
+    def __contains__(self, key):
+        return self._kvstore._get(self._chat, key) is not _DELETED
+
+    def keys(self):
+        return self._kvstore._keys(self._chat)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group changes so that they are applied (and later committed) all at
+        once, or not at all if the block raises. The chat's lock, i.e. the
+        PluginChat's resource_lock, is held meanwhile.
+        """
+        transaction = _Transaction(self)
+        if self._lock is not None:
+            self._lock.acquire()
+        try:
+            yield transaction
+            self._kvstore._write(self._chat, transaction._writes)
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+
+
+class _Transaction(ChatStore):
+
+    def __init__(self, chat_store):
+        super().__init__(chat_store._kvstore, chat_store._chat)
+        self._writes = {}
+
+    def get(self, key, default=None):
+        if key in self._writes:
+            value = self._writes[key]
+            return default if value is _DELETED else pickle.loads(value)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        if key in self._writes:
+            if self._writes[key] is _DELETED:
+                raise KeyError(key)
+            return pickle.loads(self._writes[key])
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._writes[key] = pickle.dumps(value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._writes[key] = _DELETED
+
+    def __contains__(self, key):
+        if key in self._writes:
+            return self._writes[key] is not _DELETED
+        return super().__contains__(key)
+
+    def keys(self):
+        keys = set(super().keys())
+        for key, value in self._writes.items():
+            if value is _DELETED:
+                keys.discard(key)
+            else:
+                keys.add(key)
+        return sorted(keys)
+
+    def transaction(self):
+        raise RuntimeError("Transactions cannot be nested")
+
+
+def migrate_chat_dirs(kvstore, chats_dir, remove=False):
+    """
+    Import the files of per-chat data directories, i.e. the data_dir of
+    PluginChats as created in <plugin data dir>/chats/<chat>, into the
+    chats' stores: each file becomes a bytes value under its path relative
+    to the chat's directory. With `remove`, the directories are deleted
+    once everything has been committed. Returns the number of chats.
+    """
+    chats_dir = Path(chats_dir)
+    if not chats_dir.is_dir():
+        return 0
+
+    migrated = []
+    for chat_dir in sorted(chats_dir.iterdir()):
+        if not chat_dir.is_dir():
+            continue
+        # Group chats are named after their id's tuple of ints
+        if chat_dir.name.startswith('('):
+            chat_id = bytes(literal_eval(chat_dir.name))
+        else:
+            chat_id = chat_dir.name
+        with kvstore.chat(chat_id).transaction() as store:
+            for path in sorted(chat_dir.rglob('*')):
+                if path.is_file():
+                    store[path.relative_to(chat_dir).as_posix()] = \
+                        path.read_bytes()
+        migrated.append(chat_dir)
+
+    kvstore.flush()
+    if remove:
+        for chat_dir in migrated:
+            shutil.rmtree(str(chat_dir))
+    return len(migrated)
@@ -0,0 +1,243 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import socketserver
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+
+class Registry(object):
+    """
+    A collection of metrics that can be rendered in the Prometheus text
+    exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+class _Metric(object):
+
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self._labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self._labelnames):
+            raise ValueError("{} expects the labels {}".format(
+                self.name, ', '.join(self._labelnames)))
+        return tuple(labels[name] for name in self._labelnames)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return ['{}{} {}'.format(self.name,
+                                 _format_labels(self._labelnames, key), value)
+                for key, value in sorted(values.items(), key=str)]
+
+
+class Counter(_Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    Either set explicitly or, if `function` is given, read from it whenever
+    the metric is rendered.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY,
+                 function=None):
+        super().__init__(name, help, labelnames, registry)
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return ['{} {}'.format(self.name, self._function())]
+        return super().samples()
+
+
+class Histogram(_Metric):
+
+    type = 'histogram'
+
+    DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.,
+                       2.5, 5., 10.)
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY,
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames, registry)
+        self._buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # Per bucket counts (non-cumulative), then count and sum
+                self._values[key] = [[0] * (len(self._buckets) + 1), 0, 0.]
+            counts, _, _ = entry = self._values[key]
+            counts[bisect_left(self._buckets, value)] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def summary(self, **labels):
+        """
+        Returns (count, sum) of the observations with the given labels.
+        """
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return (0, 0.) if entry is None else (entry[1], entry[2])
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), count, total)
+                      for key, (counts, count, total) in self._values.items()}
+        lines = []
+        for key, (counts, count, total) in sorted(values.items(), key=str):
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets + ('+Inf',),
+                                           counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(self._labelnames, key, [('le', bound)]),
+                    cumulative))
+            labels = _format_labels(self._labelnames, key)
+            lines.append('{}_count{} {}'.format(self.name, labels, count))
+            lines.append('{}_sum{} {}'.format(self.name, labels, total))
+        return lines
+
+
+class _MetricsHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.wfile.write(self.server.registry.render().encode())
+
+
+class _MetricsServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsExporter(object):
+    """
+    Periodically writes the rendered registry to `file` and/or serves it to
+    every client connecting to the Unix socket at `socket`.
+    """
+
+    def __init__(self, registry=REGISTRY, file=None, socket=None,
+                 interval=10):
+        self._registry = registry
+        self._file = None if file is None else Path(file)
+        self._socket = None if socket is None else Path(socket)
+        self._interval = interval
+        self._stop = Event()
+        self._threads = []
+        self._server = None
+
+        if self._file is not None:
+            t = Thread(daemon=True, target=self._write_periodically)
+            t.start()
+            self._threads.append(t)
+
+        if self._socket is not None:
+            if self._socket.is_socket():
+                self._socket.unlink()
+            self._server = _MetricsServer(str(self._socket), _MetricsHandler)
+            self._server.registry = self._registry
+            t = Thread(daemon=True, target=self._server.serve_forever)
+            t.start()
+            self._threads.append(t)
+
+    def _write(self):
+        # Write atomically so readers never see a partial file
+        tmp = self._file.with_name(self._file.name + '.tmp')
+        tmp.write_text(self._registry.render())
+        os.replace(str(tmp), str(self._file))
+
+    def _write_periodically(self):
+        while not self._stop.wait(self._interval):
+            self._write()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._socket.unlink()
+        if self._file is not None:
+            self._write()
@@ -0,0 +1,138 @@
+from .clock import Clock
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Thread
+from traceback import print_exception
+
+
+class Outbox(object):
+    """
+    Per-chat queues of outgoing messages drained by background senders.
+
+    Messages of the same chat are sent in order and never concurrently,
+    different chats are served by up to `threads` senders in parallel. With
+    a positive `coalesce_window` (in seconds), a chat's messages are held
+    back for that long after the first one was queued and then sent as one
+    message, with the texts joined by newlines. The window is measured by
+    `clock`, a signalbot.clock.Clock.
+    """
+
+    def __init__(self, send, threads=1, coalesce_window=0., clock=None):
+        if threads < 1:
+            raise ValueError("An outbox needs at least one sender thread")
+
+        self._send = send
+        self._coalesce_window = coalesce_window
+        self._clock = Clock() if clock is None else clock
+
+        # All of the following is protected by _cv
+        self._cv = Condition()
+        # chat id -> deque of (enqueued, chat, text, attachments, future)
+        self._pending = {}
+        # Chats with pending messages, in the order they became pending
+        self._ready = deque()
+        # Chats currently being sent to by some sender thread
+        self._busy = set()
+        self._stopping = False
+
+        self._threads = []
+        for _ in range(threads):
+            t = Thread(daemon=True, target=self._run)
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def pending(self):
+        with self._cv:
+            return sum(len(items) for items in self._pending.values())
+
+    @property
+    def idle(self):
+        """
+        Whether all messages queued so far have been sent.
+        """
+        with self._cv:
+            return not self._pending and not self._busy
+
+    def put(self, chat, text, attachments):
+        future = Future()
+        with self._cv:
+            if self._stopping:
+                future.set_exception(
+                    RuntimeError("Outbox has been shut down"))
+                return future
+            item = (self._clock.monotonic(), chat, text, attachments, future)
+            if chat.id in self._pending:
+                self._pending[chat.id].append(item)
+            else:
+                self._pending[chat.id] = deque([item])
+                # A busy chat is put back into _ready once its sender is done
+                if chat.id not in self._busy:
+                    self._ready.append(chat.id)
+                    self._cv.notify()
+        return future
+
+    def _next_batch(self):
+        """
+        Wait for a chat whose messages are due and claim them. Returns None
+        once the outbox has been shut down and everything has been sent.
+        """
+        with self._cv:
+            while True:
+                if self._ready:
+                    chat_id = self._ready[0]
+                    due = self._pending[chat_id][0][0] + self._coalesce_window
+                    wait = due - self._clock.monotonic()
+                    if wait <= 0 or self._stopping:
+                        self._ready.popleft()
+                        self._busy.add(chat_id)
+                        return chat_id, self._pending.pop(chat_id)
+                    self._clock.wait(self._cv, wait)
+                elif self._stopping and not self._busy:
+                    return None
+                else:
+                    self._cv.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            chat_id, items = batch
+
+            if self._coalesce_window > 0 and len(items) > 1:
+                chat = items[0][1]
+                text = '\n'.join(item[2] for item in items)
+                attachments = [a for item in items for a in item[3]]
+                self._deliver(text, attachments, chat,
+                              [item[4] for item in items])
+            else:
+                for _, chat, text, attachments, future in items:
+                    self._deliver(text, attachments, chat, [future])
+
+            with self._cv:
+                self._busy.discard(chat_id)
+                if chat_id in self._pending:
+                    self._ready.append(chat_id)
+                # Wake up senders waiting for new messages or for shutdown
+                self._cv.notify_all()
+
+    def _deliver(self, text, attachments, chat, futures):
+        try:
+            result = self._send(text, attachments, chat)
+        except Exception as e:
+            print_exception(type(e), e, e.__traceback__)
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future in futures:
+                future.set_result(result)
+
+    def shutdown(self, wait=False):
+        # Messages queued so far are still sent, ignoring coalesce_window
+        with self._cv:
+            self._stopping = True
+            self._cv.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
@@ -1,6 +1,42 @@
 from abc import ABC, abstractmethod
+from ..cache import Cache
+from collections import deque
+from concurrent.futures import Future
+from ..kvstore import KVStore, migrate_chat_dirs
+from ..metrics import Counter, Gauge, Histogram
 from pathlib import Path
-from threading import Condition, Lock, Thread
+import re
+import shelve
+from threading import Condition, get_ident, Lock, RLock
+from time import monotonic
+from ..tracing import TRACER
+
+
+HANDLER_SECONDS = Histogram(
+    'signalbot_handler_seconds',
+    'Time spent processing a message or event per plugin', ['plugin'])
+HANDLER_ERRORS = Counter(
+    'signalbot_handler_errors_total',
+    'Exceptions raised by plugins while processing', ['plugin'])
+PLUGIN_TASKS = Gauge(
+    'signalbot_plugin_tasks',
+    'Queued or running tasks per plugin', ['plugin'])
+ISOLATION_FAILURES = Counter(
+    'signalbot_isolation_failures_total',
+    'Times an IsolationLock could not be acquired', ['plugin'])
+ISOLATION_WAIT_SECONDS = Histogram(
+    'signalbot_isolation_wait_seconds',
+    'Time spent waiting for a FairIsolationLock', ['plugin'])
+SHED = Counter(
+    'signalbot_shed_total',
+    'Messages and jobs dropped because a chat had too much work queued',
+    ['plugin', 'policy'])
+
+OVERFLOW_POLICIES = ['drop_oldest', 'drop_newest', 'latest_only']
+
+# Returned by tasks that did not start since the chat's isolation lock was
+# taken, see PluginChat._thread_start()
+_HELD_BACK = object()
 
 
 class ChatThreadcounter(object):
@@ -37,6 +73,18 @@ class ChatThreadcounter(object):
 
         return self
 
+    def try_enter(self):
+        """
+        Like __enter__() but returns False rather than waiting if an
+        isolated thread is running.
+        """
+        with self.entry_lock:
+            if self._isolated_lock.blocked:
+                return False
+            with self._condition:
+                self._count += 1
+        return True
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         with self._condition:
             # Decrease thread count
@@ -59,12 +107,23 @@ class IsolationException(Exception):
 
 class IsolationLock(object):
 
-    def __init__(self):
+    def __init__(self, plugin=None, released=None):
         self._lock = Lock()
         self._entry_lock = Lock()
         self.threadcounter = ChatThreadcounter(self)
+        self._plugin = plugin
+        # Called once the lock is released, see PluginChat
+        self._released = released
+
+    @property
+    def blocked(self):
+        """
+        Whether new tasks would have to wait for an isolated thread.
+        """
+        return self._lock.locked()
 
     def _fail_exception(self):
+        ISOLATION_FAILURES.inc(plugin=self._plugin)
         # For now, we force the plugin to properly deal with denied isolated
         # threads (as well as allow plugins to clean up and send an error
         # message to the chat) by throwing an exception; there ought to be a
@@ -114,7 +173,8 @@ class IsolationLock(object):
                     self._fail_exception()
 
             # Ensure all other threads have finished processing.
-            self.threadcounter.wait_until_only_one()
+            with TRACER.span('isolation wait', plugin=self._plugin):
+                self.threadcounter.wait_until_only_one()
 
         finally:
             # Release entry lock
@@ -122,24 +182,305 @@ class IsolationLock(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._lock.release()
+        if self._released is not None:
+            self._released()
 
     def wait_until_unblocked(self):
         with self._lock:
             pass
 
 
+class FairThreadcounter(object):
+
+    def __init__(self, isolated_lock):
+        self._isolated_lock = isolated_lock
+
+    def __enter__(self):
+        self._isolated_lock._enter_task()
+        return self
+
+    def try_enter(self):
+        return self._isolated_lock._enter_task(blocking=False)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._isolated_lock._exit_task()
+
+
+class FairIsolationLock(object):
+    """
+    Blocking variant of IsolationLock: instead of failing right away, threads
+    wanting exclusive access queue up in FIFO order and wait up to `timeout`
+    seconds (None meaning forever) before IsolationException is raised.
+
+    It works like a writer-preferring reader-writer lock where every running
+    task of the chat is a reader: while a thread waits for exclusive access,
+    no new tasks start, and it gets the lock once all other tasks are done.
+    A waiting thread does not count as running, so two threads waiting for
+    exclusive access at the same time cannot wait for each other, which is
+    what IsolationLock avoids by failing.
+    """
+
+    def __init__(self, plugin=None, timeout=None, released=None):
+        self._plugin = plugin
+        self._timeout = timeout
+        self.threadcounter = FairThreadcounter(self)
+        # Called once the lock is released or no longer wanted, see
+        # PluginChat
+        self._released = released
+
+        # All of the following is protected by _condition
+        self._condition = Condition()
+        # Running tasks, not counting those waiting for exclusive access
+        self._running = 0
+        # Ident of the thread having exclusive access
+        self._owner = None
+        # Tickets of threads waiting for exclusive access, first come first
+        # served
+        self._waiting = deque()
+
+    @property
+    def blocked(self):
+        """
+        Whether new tasks would have to wait for exclusive access.
+        """
+        with self._condition:
+            return self._owner is not None or bool(self._waiting)
+
+    def _enter_task(self, blocking=True):
+        with self._condition:
+            if not blocking and (self._owner is not None or self._waiting):
+                return False
+            self._condition.wait_for(
+                lambda: self._owner is None and not self._waiting)
+            self._running += 1
+        return True
+
+    def _exit_task(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def __enter__(self):
+        ticket = object()
+        start = monotonic()
+        with self._condition:
+            if self._owner == get_ident():
+                ISOLATION_FAILURES.inc(plugin=self._plugin)
+                raise IsolationException(
+                    'Isolation lock is already held by this thread.')
+
+            self._waiting.append(ticket)
+            # Stop counting as running while waiting, see above
+            self._running -= 1
+            self._condition.notify_all()
+            acquired = self._condition.wait_for(
+                lambda: self._waiting[0] is ticket and
+                self._owner is None and self._running == 0,
+                self._timeout)
+            if acquired:
+                self._waiting.popleft()
+                self._owner = get_ident()
+            else:
+                self._waiting.remove(ticket)
+                # Whoever got exclusive access has to finish before we may
+                # continue running
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._owner is None)
+                self._running += 1
+
+        if not acquired and self._released is not None:
+            # Held back tasks may start unless others want the lock still
+            self._released()
+        end = monotonic()
+        ISOLATION_WAIT_SECONDS.observe(end - start, plugin=self._plugin)
+        TRACER.add('isolation wait', start, end, plugin=self._plugin)
+        if not acquired:
+            ISOLATION_FAILURES.inc(plugin=self._plugin)
+            raise IsolationException(
+                'Isolation lock could not be acquired within {}s.'.format(
+                    self._timeout))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._condition:
+            self._owner = None
+            # The thread continues running its task
+            self._running += 1
+            self._condition.notify_all()
+        if self._released is not None:
+            self._released()
+
+
+class TaskLimiter(object):
+    """
+    Limits how many tasks the chats of a plugin have in the worker pool at a
+    time: each PluginChat up to its max_in_flight and all of them together
+    up to `max_in_flight` (0 for no limit). Further tasks are held back per
+    chat, subject to the chat's max_queued and overflow policy, and handed
+    out to the chats in turn as tasks finish, so that a busy chat cannot
+    starve the others. While a chat's isolation lock is taken or wanted,
+    its tasks are held back as well rather than waiting in worker threads,
+    which would keep the other chats' tasks from running.
+
+    Tasks are (plugin_chat, future, args, target, trace) tuples; start() and
+    done() return the tasks to submit to the worker pool right away.
+    """
+
+    def __init__(self, max_in_flight=0):
+        self.max_in_flight = max_in_flight
+
+        # Protects the following as well as the PluginChats' _busy,
+        # _in_flight, _held and _waiting
+        self._lock = Lock()
+        self._in_flight = 0
+        # PluginChats with held back tasks, in turn
+        self._waiting = deque()
+
+    def start(self, task):
+        plugin_chat = task[0]
+        with self._lock:
+            plugin_chat._busy += 1
+            plugin_chat._held.append(task)
+            shed = plugin_chat._overflow()
+            plugin_chat._busy -= len(shed)
+            if plugin_chat._held and not plugin_chat._waiting:
+                plugin_chat._waiting = True
+                self._waiting.append(plugin_chat)
+            runnable = self._dispatch()
+
+        for _, future, _, _, _ in shed:
+            future.cancel()
+            SHED.inc(plugin=plugin_chat.plugin, policy=plugin_chat.overflow)
+            PLUGIN_TASKS.dec(plugin=plugin_chat.plugin)
+        return runnable
+
+    def done(self, plugin_chat):
+        with self._lock:
+            plugin_chat._busy -= 1
+            plugin_chat._in_flight -= 1
+            self._in_flight -= 1
+            if plugin_chat._waiting:
+                # Had its turn, so the other chats in line go first
+                self._waiting.remove(plugin_chat)
+                self._waiting.append(plugin_chat)
+            elif plugin_chat._held:
+                plugin_chat._waiting = True
+                self._waiting.append(plugin_chat)
+            return self._dispatch()
+
+    def resume(self, plugin_chat):
+        """
+        Hand out the chat's held back tasks again once its isolation lock
+        has been released.
+        """
+        with self._lock:
+            if plugin_chat._held and not plugin_chat._waiting:
+                plugin_chat._waiting = True
+                self._waiting.append(plugin_chat)
+            return self._dispatch()
+
+    def requeue(self, task):
+        """
+        Hold a task that has been handed out back again, since the chat's
+        isolation lock was taken before it started.
+        """
+        plugin_chat = task[0]
+        with self._lock:
+            plugin_chat._in_flight -= 1
+            self._in_flight -= 1
+            plugin_chat._held.appendleft(task)
+            if not plugin_chat._waiting:
+                plugin_chat._waiting = True
+                self._waiting.append(plugin_chat)
+            return self._dispatch()
+
+    def _full(self):
+        return self.max_in_flight and self._in_flight >= self.max_in_flight
+
+    def _dispatch(self):
+        runnable = []
+        progress = True
+        while progress and self._waiting and not self._full():
+            progress = False
+            for _ in range(len(self._waiting)):
+                if self._full():
+                    break
+                plugin_chat = self._waiting.popleft()
+                if plugin_chat._full() or \
+                        plugin_chat.isolated_thread.blocked:
+                    # Back in line once one of its tasks is done or the
+                    # isolation lock is released
+                    plugin_chat._waiting = False
+                    continue
+                runnable.append(plugin_chat._held.popleft())
+                plugin_chat._in_flight += 1
+                self._in_flight += 1
+                progress = True
+                if plugin_chat._held:
+                    self._waiting.append(plugin_chat)
+                else:
+                    plugin_chat._waiting = False
+        return runnable
+
+
 class PluginChat(ABC):
 
-    def __init__(self, chat, data_dir):
+    # List of signalbot.triggers.Trigger instances; messages matching none of
+    # them are not handed to triagemessage at all. None means every message
+    # is processed.
+    triggers = None
+
+    # Seconds isolated_thread waits for exclusive access; 0 makes it fail
+    # immediately if it is not available and None waits indefinitely. See
+    # IsolationLock and FairIsolationLock.
+    isolation_timeout = 0
+
+    # Tasks (messages and scheduled jobs) of the chat in the worker pool at
+    # a time and tasks held back beyond that, 0 for no limit. Once
+    # max_queued tasks are held back, `overflow` decides what is dropped:
+    # 'drop_oldest' or 'drop_newest' task, or with 'latest_only', only the
+    # latest task is ever held back. See also TaskLimiter.
+    max_in_flight = 0
+    max_queued = 0
+    overflow = 'drop_oldest'
+
+    # Lightweight plugins, i.e. those whose handlers return quickly, run in
+    # the bot's priority lane rather than behind other plugins' tasks
+    lightweight = False
+
+    def __init__(self, chat, data_dir, router=None):
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {}".format(
+                self.overflow))
 
         self._data_dir_checked = False
         self._data_dir = data_dir
 
         self.chat = chat
+        self.router = router
+        self.plugin = None if router is None else router.name
         # Init locks; needs to be done in the main thread to avoid race
         # conditions
-        self.isolated_thread = IsolationLock()
-        self.resource_lock = Lock()
+        if self.isolation_timeout == 0:
+            self.isolated_thread = IsolationLock(
+                plugin=self.plugin, released=self._released)
+        else:
+            self.isolated_thread = FairIsolationLock(
+                plugin=self.plugin, timeout=self.isolation_timeout,
+                released=self._released)
+        # Reentrant, so that store transactions can be used while holding
+        # it
+        self.resource_lock = RLock()
+        self._store = None
+
+        # Shared by all chats of the plugin
+        self._limiter = TaskLimiter() if router is None else router.limiter
+        # Number of started but not yet finished tasks, those in the worker
+        # pool and the held back ones; protected by the limiter
+        self._busy = 0
+        self._in_flight = 0
+        self._held = deque()
+        # Whether the chat is in line for the limiter
+        self._waiting = False
 
     @property
     def data_dir(self):
@@ -148,47 +489,223 @@ class PluginChat(ABC):
             self._data_dir_checked = True
         return self._data_dir
 
+    @property
+    def store(self):
+        """
+        Dict-like, persistent store of the chat, see
+        signalbot.kvstore.ChatStore. Prefer it over files in data_dir.
+        """
+        if self._store is None:
+            self._store = self.router.store.chat(self.chat.id,
+                                                 self.resource_lock)
+        return self._store
+
+    @property
+    def busy(self):
+        return self._busy > 0
+
+    @property
+    def attachments(self):
+        """
+        The bot's signalbot.attachments.AttachmentStore, e.g. to send the
+        same generated file to many chats without storing it many times.
+        """
+        return self.chat.attachments
+
+    @property
+    def clock(self):
+        """
+        The bot's signalbot.clock.Clock; see sleep().
+        """
+        return self.chat.clock
+
+    def cache(self, name, maxsize=1024, ttl=None):
+        """
+        The plugin's signalbot.cache.Cache called `name`, created with
+        `maxsize` and `ttl` on first use. See also signalbot.cache.cached.
+        """
+        return self.router.cache(name, maxsize, ttl, self.clock)
+
+    def sleep(self, seconds):
+        """
+        Use this rather than time.sleep(), so that tests can run the bot
+        with a virtual clock.
+        """
+        self.chat.clock.sleep(seconds)
+
+    def save_state(self):
+        """
+        Called before the instance is dropped because the chat has been idle.
+        May return any picklable object, which is then passed to
+        restore_state() of the instance created on the chat's next message.
+        Also called when the plugin is reloaded (see //reload), to hand the
+        state over to the instance of the reloaded class.
+        """
+        return None
+
+    def restore_state(self, state):
+        """
+        Counterpart of save_state(); called right after initialization.
+        """
+        pass
+
     def reply(self, text, attachments=[]):
-        self.chat.reply(text, attachments)
+        return self.chat.reply(text, attachments)
 
     def error(self, text, attachments=[]):
-        self.chat.error(text, attachments)
+        return self.chat.error(text, attachments)
 
     def success(self, text, attachments=[]):
-        self.chat.success(text, attachments)
+        return self.chat.success(text, attachments)
+
+    def broadcast(self, text, attachments, chats):
+        """
+        Send the same message to many chats (Chat instances or ids), see
+        Signalbot.broadcast().
+        """
+        return self.chat.broadcast(text, attachments, chats)
+
+    def schedule(self, method, delay=0, every=None, args=(), name=None):
+        """
+        Call one of this class' methods with `args` after `delay` seconds
+        and, if `every` is given, every `every` seconds from then on. The
+        method runs in the worker pool just like triagemessage().
+        Jobs are kept across restarts, so `method` is referred to by name
+        and `args` need to be picklable. A job replaces the chat's job of
+        the same name; the job's name is returned.
+        """
+        if callable(method):
+            method = method.__name__
+        return self.chat.schedule(self.plugin, method, delay, every, args,
+                                  name)
+
+    def cancel(self, name):
+        self.chat.cancel(self.plugin, name)
 
     def start_processing(self, message):
         """
         Starts processing of a message.
-        This will start a separate thread in which the actual processing is
-        done and return that thread.
+        This will hand the message to the bot's worker pool in which the
+        actual processing is done and return a future for its result.
         """
         return self._start(args=[message],
-                           target=self.triagemessage)
-
-    def _start(self, args, target):
-        """
-        Start a new thread in which `target` is called with `args` as
-        arguments. In the created thread, isolated_thread can be used to
-        ensure exclusive access to per-chat resources.
-        This method is used for incoming messages and is planned to be used
-        for scheduled events as well.
-        """
-        t = Thread(
-            args=[args, target],
-            daemon=True,
-            target=self._thread_start)
-        t.start()
-        return t
-
-    def _thread_start(self, args, target):
-        # Enter threadcounter context to make isolated_thread work correctly
-        with self.isolated_thread.threadcounter:
+                           target=self.triagemessage,
+                           trace_id=message.trace_id)
+
+    def _start(self, args, target, trace_id=None):
+        """
+        Submit a task to the bot's worker pool in which `target` is called
+        with `args` as arguments. In the worker thread, isolated_thread can be
+        used to ensure exclusive access to per-chat resources.
+        This method is used for incoming messages and scheduled jobs.
+        The task may be held back or, if too many are, dropped (in which
+        case the returned future is cancelled), see max_in_flight.
+        Without `trace_id`, e.g. for scheduled jobs, the task is a trace of
+        its own.
+        """
+        future = Future()
+        if trace_id is None:
+            trace_id = TRACER.new_trace()
+        trace = (trace_id, monotonic())
+        PLUGIN_TASKS.inc(plugin=self.plugin)
+        for task in self._limiter.start((self, future, args, target, trace)):
+            task[0]._submit(*task[1:])
+        return future
+
+    def _submit(self, future, args, target, trace):
+        if self.lightweight:
+            submit = self.chat.submit_priority
+        else:
+            submit = self.chat.submit
+        try:
+            pool_future = submit(self._thread_start, args, target, trace)
+        except BaseException as e:
+            future.set_exception(e)
+            self._done()
+            return
+        pool_future.add_done_callback(
+            lambda pool_future: self._done(future, pool_future,
+                                           (args, target, trace)))
+
+    def _done(self, future=None, pool_future=None, task=None):
+        if pool_future is not None and not pool_future.cancelled() and \
+                pool_future.exception() is None and \
+                pool_future.result() is _HELD_BACK:
+            runnable = self._limiter.requeue((self, future) + task)
+        else:
+            self._finish(future, pool_future)
+            runnable = self._limiter.done(self)
+        for task in runnable:
+            task[0]._submit(*task[1:])
+
+    def _released(self):
+        for task in self._limiter.resume(self):
+            task[0]._submit(*task[1:])
+
+    def _finish(self, future, pool_future):
+        if pool_future is not None:
+            if pool_future.cancelled():
+                future.cancel()
+            elif pool_future.exception() is not None:
+                future.set_exception(pool_future.exception())
+            else:
+                future.set_result(pool_future.result())
+        PLUGIN_TASKS.dec(plugin=self.plugin)
+
+    def _full(self):
+        return self.max_in_flight and self._in_flight >= self.max_in_flight
+
+    def _overflow(self):
+        """
+        Drop held back tasks according to the overflow policy and return
+        them; called by the limiter, holding its lock.
+        """
+        if self.overflow == 'latest_only':
+            limit = 1
+        elif self.max_queued:
+            limit = self.max_queued
+        else:
+            return []
+        shed = []
+        while len(self._held) > limit:
+            if self.overflow == 'drop_newest':
+                shed.append(self._held.pop())
+            else:
+                shed.append(self._held.popleft())
+        return shed
+
+    def _thread_start(self, args, target, trace):
+        trace_id, queued = trace
+        started = monotonic()
+        # Held back by the limiter and waiting for a worker thread
+        TRACER.add('queued', queued, started, trace_id, plugin=self.plugin)
+        # Enter the threadcounter to make isolated_thread work correctly,
+        # without keeping the worker thread from other chats' tasks if an
+        # isolated thread has taken the lock since the task was handed out
+        threadcounter = self.isolated_thread.threadcounter
+        if not threadcounter.try_enter():
+            return _HELD_BACK
+        with TRACER.trace(trace_id):
+            TRACER.add('threadcounter', started, monotonic(),
+                       plugin=self.plugin)
             # Do actual stuff
+            # Only look up the profiler once; it may be switched off
+            # concurrently
+            profiler = None if self.router is None else self.router.profiler
             try:
-                target(*args)
+                with HANDLER_SECONDS.time(plugin=self.plugin), \
+                        TRACER.span(target.__name__, plugin=self.plugin):
+                    if profiler is None:
+                        target(*args)
+                    else:
+                        profiler.run(target, args, label=str(self.chat))
             except IsolationException as e:
                 self.error('{}'.format(e))
+            except Exception:
+                HANDLER_ERRORS.inc(plugin=self.plugin)
+                raise
+            finally:
+                threadcounter.__exit__(None, None, None)
 
     @abstractmethod
     def triagemessage(self, message):
@@ -200,8 +717,12 @@ class PluginChat(ABC):
 
 class PluginRouter(object):
 
-    def __init__(self, data_dir, chat_class):
+    def __init__(self, data_dir, chat_class, name=None):
+        self.name = name
         self._data_dir_checked = False
+
+        # signalbot.profiling.Profiler while profiling is switched on
+        self.profiler = None
         self._data_dir = data_dir
 
         self._chat_class = chat_class
@@ -209,6 +730,24 @@ class PluginRouter(object):
             raise Exception("chat_class must be a a subclass of PluginChat")
 
         self._chats = {}
+        # Set limiter.max_in_flight to limit the tasks of all chats
+        self.limiter = TaskLimiter()
+
+        # States of evicted chats, opened on first use. States evicted into
+        # other files, e.g. while the plugin ran in worker processes, are
+        # moved into it first, unless _move_evicted is unset.
+        self._evicted = None
+        self._evicted_name = 'evicted'
+        self._move_evicted = True
+        self._evicted_lock = Lock()
+
+        # KVStore of all chats, opened on first use
+        self._store = None
+        self._store_lock = Lock()
+
+        # Name -> Cache, see cache()
+        self._caches = {}
+        self._caches_lock = Lock()
 
     @property
     def data_dir(self):
@@ -217,16 +756,144 @@ class PluginRouter(object):
             self._data_dir_checked = True
         return self._data_dir
 
+    @property
+    def store(self):
+        with self._store_lock:
+            if self._store is None:
+                self._store = KVStore(
+                    Path.joinpath(self.data_dir, 'store.db'),
+                    plugin=self.name)
+        return self._store
+
+    def cache(self, name, maxsize=1024, ttl=None, clock=None):
+        """
+        The Cache called `name` shared by all chats, created on first use.
+        """
+        with self._caches_lock:
+            if name not in self._caches:
+                self._caches[name] = Cache(maxsize, ttl, clock,
+                                           plugin=self.name, name=name)
+            return self._caches[name]
+
+    def migrate_chat_dirs(self, remove=False):
+        """
+        Move the files in the chats' data directories into their stores,
+        see signalbot.kvstore.migrate_chat_dirs().
+        """
+        return migrate_chat_dirs(
+            self.store, Path.joinpath(self.data_dir, 'chats'), remove)
+
+    def _keeps_state(self):
+        return self._chat_class.save_state is not PluginChat.save_state
+
+    def _evicted_states(self):
+        if self._evicted is None:
+            if self._move_evicted:
+                move_evicted_states(self.data_dir,
+                                    lambda chat: self._evicted_name)
+            self._evicted = shelve.open(
+                str(Path.joinpath(self.data_dir, self._evicted_name)))
+        return self._evicted
+
     def enable(self, chat):
         if chat.id not in self._chats:
             chat_dir = Path.joinpath(self._data_dir, 'chats', str(chat))
-            self._chats[chat.id] = self._chat_class(chat, chat_dir)
+            plugin_chat = self._chat_class(chat, chat_dir, router=self)
+            if self._keeps_state():
+                with self._evicted_lock:
+                    state = self._evicted_states().pop(str(chat), None)
+                if state is not None:
+                    plugin_chat.restore_state(state)
+            self._chats[chat.id] = plugin_chat
 
     def disable(self, chat):
         if chat.id in self._chats:
             del self._chats[chat.id]
+        if self._keeps_state():
+            with self._evicted_lock:
+                self._evicted_states().pop(str(chat), None)
+
+    def is_idle(self, chat):
+        return chat.id not in self._chats or not self._chats[chat.id].busy
+
+    def evict(self, chat):
+        """
+        Drop the chat's PluginChat, keeping the state it returns from
+        save_state() on disk until the chat is enabled again.
+        """
+        plugin_chat = self._chats.pop(chat.id, None)
+        if plugin_chat is None:
+            return
+        state = plugin_chat.save_state()
+        if state is not None:
+            with self._evicted_lock:
+                self._evicted_states()[str(chat)] = state
+                self._evicted.sync()
+
+    def hand_over(self, chat):
+        """
+        Drop the chat's PluginChat for the router of the reloaded plugin and
+        return what its save_state() returns, see take_over().
+        """
+        plugin_chat = self._chats.pop(chat.id, None)
+        if plugin_chat is not None:
+            return plugin_chat.save_state()
+
+    def take_over(self, chat, state):
+        """
+        Enable the chat with the state handed over by the router of the
+        plugin before it was reloaded. Unlike for evicted chats, the state
+        is passed on as is rather than pickled.
+        """
+        self.enable(chat)
+        if state is not None:
+            self._chats[chat.id].restore_state(state)
 
     def triagemessage(self, message):
         chat_id = message.chat.id
         if chat_id in self._chats:
             self._chats[chat_id].start_processing(message)
+
+    def run(self, chat, method, args):
+        if chat.id in self._chats:
+            plugin_chat = self._chats[chat.id]
+            plugin_chat._start(args=list(args),
+                               target=getattr(plugin_chat, method))
+
+    def close(self):
+        with self._evicted_lock:
+            if self._evicted is not None:
+                self._evicted.close()
+                self._evicted = None
+        with self._store_lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+
+
+def move_evicted_states(data_dir, name):
+    """
+    Move the states of evicted chats in data_dir into the file of evicted
+    states called name(chat), where chat is str() of the chat, e.g. after a
+    plugin's number of worker processes changed. None of the files may be
+    open.
+    """
+    names = set()
+    for path in data_dir.glob('evicted*'):
+        # Some dbm modules add suffixes
+        names.add(path.name.split('.')[0])
+    for old in sorted(names):
+        if not re.fullmatch(r'evicted(-\d+)?', old):
+            continue
+        with shelve.open(str(Path.joinpath(data_dir, old))) as states:
+            moved = {}
+            for chat in list(states.keys()):
+                if name(chat) != old:
+                    moved.setdefault(name(chat), []).append(chat)
+            for new, chats in moved.items():
+                with shelve.open(str(Path.joinpath(data_dir, new))) as target:
+                    for chat in chats:
+                        target[chat] = states[chat]
+                # Only once the states are safely in the new file
+                for chat in chats:
+                    del states[chat]
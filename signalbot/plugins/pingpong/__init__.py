@@ -1,8 +1,11 @@
 from signalbot.plugins import PluginChat
+from signalbot.triggers import Exact
 
 
 class PingPongChat(PluginChat):
 
+    triggers = [Exact('ping')]
+
     def triagemessage(self, message):
         if message.text != 'ping':
             return
@@ -0,0 +1,498 @@
+from ast import literal_eval
+from .attachments import AttachmentStore
+from .clock import Clock
+from concurrent.futures import Future
+from importlib import import_module
+from itertools import count
+import multiprocessing
+from pathlib import Path
+from .plugins import move_evicted_states
+from queue import Queue
+import signal
+from threading import Lock, Thread
+from traceback import print_exc
+from uuid import uuid4
+from .workers import WorkerPool
+from zlib import crc32
+
+
+class ProcessPluginRouter(object):
+    """
+    Runs a plugin in worker processes instead of the bot's process, so that
+    CPU-heavy plugins do not hold the bot's GIL.
+
+    Chats are sharded over the processes by a hash of their id, so all
+    messages of a chat are handled by the same process, in order, and the
+    chat's PluginChat (including its IsolationLock) lives in that process
+    only. Replies are sent back to the bot over a pipe. Enabling, disabling
+    and evicting chats are synchronous calls to the worker process.
+
+    Metrics and traces recorded in a worker process, e.g. the handler times
+    of the plugin, stay in that process: //stats, the metrics exporter and
+    //trace only cover the bot's process.
+    """
+
+    def __init__(self, module_name, data_dir, name, call_bot, attachments,
+                 processes=1, threads=16, queue_size=1000, max_in_flight=0):
+        if processes < 1:
+            raise ValueError("A process plugin needs at least one process")
+
+        self.name = name
+        self._data_dir = data_dir
+        self._data_dir_checked = False
+        self._profiler = None
+        self._attachments = attachments
+        # Calls a method of the bot by name, e.g. send_message, for the
+        # worker processes
+        self._call_bot = call_bot
+
+        # Enabled chats by id, so replies can be routed back to them
+        self._chats = {}
+
+        # Whether the states of evicted chats have been moved into the files
+        # of the processes now handling the chats, see _move_evicted_states()
+        self._evicted_moved = False
+        self._evicted_lock = Lock()
+
+        # spawn rather than fork, since the bot is multi-threaded
+        context = multiprocessing.get_context('spawn')
+        self._shards = []
+        for shard in range(processes):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                daemon=True, target=_worker_main,
+                args=[module_name, child_connection, data_dir, name, shard,
+                      attachments, threads, queue_size, max_in_flight],
+                name='signalbot-{}-{}'.format(name, shard))
+            process.start()
+            child_connection.close()
+            self._shards.append(_Shard(self, process, connection))
+
+    @property
+    def data_dir(self):
+        if not self._data_dir_checked:
+            Path.mkdir(self._data_dir, exist_ok=True)
+            self._data_dir_checked = True
+        return self._data_dir
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        # Every worker process profiles with its own copy
+        self._profiler = profiler
+        for shard in self._shards:
+            shard.call('profile', profiler)
+
+    def _shard_number(self, chat_id):
+        if isinstance(chat_id, str):
+            chat_id = chat_id.encode()
+        return crc32(chat_id) % len(self._shards)
+
+    def _shard(self, chat_id):
+        return self._shards[self._shard_number(chat_id)]
+
+    def _move_evicted_states(self):
+        """
+        Move the states of evicted chats into the files of the worker
+        processes now handling the chats, before the workers open them: the
+        plugin may have run in a different number of processes, or in the
+        bot's process, when the chats were evicted.
+        """
+        def name(chat):
+            # Group chats are named after their id's tuple of ints
+            if chat.startswith('('):
+                chat = bytes(literal_eval(chat))
+            return 'evicted-{}'.format(self._shard_number(chat))
+
+        with self._evicted_lock:
+            if not self._evicted_moved:
+                move_evicted_states(self.data_dir, name)
+                self._evicted_moved = True
+
+    def enable(self, chat):
+        self._move_evicted_states()
+        if chat.id not in self._chats:
+            self._shard(chat.id).call('enable', chat.id)
+            self._chats[chat.id] = chat
+
+    def disable(self, chat):
+        self._move_evicted_states()
+        self._chats.pop(chat.id, None)
+        self._shard(chat.id).call('disable', chat.id)
+
+    def is_idle(self, chat):
+        return chat.id not in self._chats or \
+            self._shard(chat.id).call('is_idle', chat.id)
+
+    def evict(self, chat):
+        self._move_evicted_states()
+        if self._chats.pop(chat.id, None) is not None:
+            self._shard(chat.id).call('evict', chat.id)
+
+    def hand_over(self, chat):
+        # The state goes through the worker's file of evicted states, which
+        # the new router moves and its workers read once the old ones are
+        # closed
+        self.evict(chat)
+
+    def take_over(self, chat, state):
+        self.enable(chat)
+
+    def triagemessage(self, message):
+        chat_id = message.chat.id
+        if chat_id in self._chats:
+            self._shard(chat_id).send(
+                'message', message.timestamp, chat_id, message.sender,
+                message.text, message.attachmentfiles)
+
+    def run(self, chat, method, args):
+        if chat.id in self._chats:
+            self._shard(chat.id).send('job', chat.id, method, args)
+
+    def _request(self, shard, request_id, method, args):
+        if method in ['send_message', 'send_error', 'send_success']:
+            text, attachments, chat_id = args
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                # Disabled or evicted in the meantime; the reply still goes
+                # out just like for an in-process plugin
+                from .signalbot import Chat
+                chat = Chat(None, chat_id)
+            args = [text, attachments, chat]
+        try:
+            if method in _ATTACHMENT_REQUESTS:
+                future = getattr(self._attachments,
+                                 _ATTACHMENT_REQUESTS[method])(*args)
+            else:
+                future = self._call_bot(method, *args)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        if not isinstance(future, Future):
+            result, future = future, Future()
+            future.set_result(result)
+
+        def done(future):
+            error = future.exception()
+            result = None if error is not None else future.result()
+            if method == 'broadcast' and result:
+                # Exceptions are not necessarily picklable
+                result = {chat_id: RuntimeError(repr(failure))
+                          for chat_id, failure in result.items()}
+            try:
+                shard.send('response', request_id, result,
+                           None if error is None else repr(error))
+            except OSError:
+                pass
+        future.add_done_callback(done)
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+
+# Requests of worker processes handled by the bot's attachment store, see
+# _AttachmentStore
+_ATTACHMENT_REQUESTS = {
+    'pin_attachments': 'pin',
+    'unpin_attachments': 'unpin',
+    'attachment_added': 'added',
+}
+
+
+class _Shard(object):
+    """
+    The parent's end of the connection to one worker process.
+    """
+
+    def __init__(self, router, process, connection):
+        self._router = router
+        self._process = process
+        self._connection = connection
+        self._send_lock = Lock()
+
+        # Call id -> Future for the result, protected by _lock
+        self._ids = count()
+        self._calls = {}
+        self._lock = Lock()
+
+        self._reader = Thread(daemon=True, target=self._read)
+        self._reader.start()
+
+    def send(self, *item):
+        with self._send_lock:
+            self._connection.send(item)
+
+    def call(self, method, *args):
+        call_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._calls[call_id] = future
+        try:
+            self.send('call', call_id, method, args)
+        except BaseException:
+            with self._lock:
+                self._calls.pop(call_id, None)
+            raise
+        return future.result()
+
+    def _read(self):
+        while True:
+            try:
+                item = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                if item[0] == 'result':
+                    _, call_id, result, error = item
+                    with self._lock:
+                        future = self._calls.pop(call_id)
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(RuntimeError(error))
+                elif item[0] == 'request':
+                    self._router._request(self, *item[1:])
+            except Exception:
+                print_exc()
+
+        # The worker process is gone; nobody is going to answer
+        with self._lock:
+            calls, self._calls = self._calls, {}
+        for future in calls.values():
+            future.set_exception(
+                ConnectionError("Plugin worker process exited"))
+
+    def close(self):
+        try:
+            self.send('stop')
+        except OSError:
+            pass
+        self._process.join(10)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        # The reader stops once the worker's end of the pipe is closed
+        self._reader.join()
+        self._connection.close()
+
+
+def _worker_main(module_name, connection, data_dir, name, shard, attachments,
+                 threads, queue_size, max_in_flight):
+    # The bot decides when its worker processes stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _Worker(module_name, connection, data_dir, name, shard, attachments,
+            threads, queue_size, max_in_flight).run()
+
+
+class _Worker(object):
+    """
+    Runs in a worker process and stands in for the bot towards the plugin's
+    router and chats.
+    """
+
+    def __init__(self, module_name, connection, data_dir, name, shard,
+                 attachments, threads, queue_size, max_in_flight):
+        # Not at module level since signalbot.signalbot imports this module
+        from .plugins import PluginRouter
+        from .signalbot import Chat, Message
+        self._chat_class = Chat
+        self._message_class = Message
+
+        self._connection = connection
+        self._send_lock = Lock()
+
+        # Request id -> Future resolved with the bot's response, e.g. once a
+        # reply has been sent, protected by _lock
+        self._ids = count()
+        self._requests = {}
+        self._lock = Lock()
+
+        self.attachments = _AttachmentStore(attachments, self._request)
+        # Virtual clocks of tests do not reach into worker processes
+        self.clock = Clock()
+
+        module = import_module(module_name, package='signalbot')
+        plugin_router_class = getattr(module, '__plugin_router__',
+                                      PluginRouter)
+        self._router = plugin_router_class(
+            data_dir=data_dir, chat_class=module.__plugin_chat__, name=name)
+        # Worker processes must not share the file of evicted states; the
+        # bot's process moves the states into the right one
+        self._router._evicted_name = 'evicted-{}'.format(shard)
+        self._router._move_evicted = False
+        # Applies to each worker process on its own
+        self._router.limiter.max_in_flight = max_in_flight
+
+        self._workers = WorkerPool(threads=threads, queue_size=queue_size)
+        self._chats = {}
+
+    def _send(self, *item):
+        with self._send_lock:
+            self._connection.send(item)
+
+    def run(self):
+        # Responses are read by a thread of their own, since handling the
+        # other items may wait for handlers, e.g. for room in the worker
+        # pool, which in turn may wait for responses, e.g. in group_info()
+        items = Queue()
+        reader = Thread(daemon=True, target=self._read, args=[items])
+        reader.start()
+        while True:
+            item = items.get()
+            if item[0] == 'stop':
+                break
+            try:
+                getattr(self, '_handle_' + item[0])(*item[1:])
+            except Exception:
+                print_exc()
+
+        # Let running handlers finish, like the bot does on exit
+        self._workers.shutdown(wait=True)
+        if self._router.profiler is not None:
+            self._router.profiler.stop()
+        self._router.close()
+
+    def _read(self, items):
+        while True:
+            try:
+                item = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            if item[0] != 'response':
+                items.put(item)
+                continue
+            try:
+                self._handle_response(*item[1:])
+            except Exception:
+                print_exc()
+
+        # The bot is gone; nobody is going to respond
+        items.put(('stop',))
+        with self._lock:
+            requests, self._requests = self._requests, {}
+        for future in requests.values():
+            future.set_exception(ConnectionError("Bot process exited"))
+
+    def _chat(self, chat_id):
+        if chat_id not in self._chats:
+            self._chats[chat_id] = self._chat_class(self, chat_id)
+        return self._chats[chat_id]
+
+    def _handle_call(self, call_id, method, args):
+        try:
+            result = getattr(self, '_call_' + method)(*args)
+        except Exception as e:
+            print_exc()
+            self._send('result', call_id, None, repr(e))
+        else:
+            self._send('result', call_id, result, None)
+
+    def _handle_message(self, timestamp, chat_id, sender, text,
+                        attachmentfiles):
+        message = self._message_class(
+            timestamp, self._chat(chat_id), sender, text, attachmentfiles)
+        self._router.triagemessage(message)
+
+    def _handle_job(self, chat_id, method, args):
+        self._router.run(self._chat(chat_id), method, args)
+
+    def _handle_response(self, request_id, result, error):
+        with self._lock:
+            future = self._requests.pop(request_id)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(error))
+
+    def _call_enable(self, chat_id):
+        self._router.enable(self._chat(chat_id))
+
+    def _call_disable(self, chat_id):
+        self._router.disable(self._chat(chat_id))
+        del self._chats[chat_id]
+
+    def _call_is_idle(self, chat_id):
+        return self._router.is_idle(self._chat(chat_id))
+
+    def _call_evict(self, chat_id):
+        self._router.evict(self._chat(chat_id))
+        del self._chats[chat_id]
+
+    def _call_profile(self, profiler):
+        previous = self._router.profiler
+        self._router.profiler = profiler
+        if previous is not None:
+            previous.stop()
+
+    # The bot's interface towards Chat
+
+    def submit(self, fn, *args):
+        return self._workers.submit(fn, *args)
+
+    # The worker's pool only runs the one plugin anyway
+    submit_priority = submit
+
+    def _request(self, method, *args):
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._requests[request_id] = future
+        self._send('request', request_id, method, args)
+        return future
+
+    def group_info(self, group_id):
+        return self._request('group_info', group_id).result()
+
+    def broadcast(self, text, attachments, chats):
+        chat_ids = [chat.id if isinstance(chat, self._chat_class) else chat
+                    for chat in chats]
+        return self._request('broadcast', text, list(attachments), chat_ids)
+
+    def send_message(self, text, attachments, chat):
+        return self._request(
+            'send_message', text, list(attachments), chat.id)
+
+    def send_error(self, text, attachments, chat):
+        return self._request('send_error', text, list(attachments), chat.id)
+
+    def send_success(self, text, attachments, chat):
+        return self._request(
+            'send_success', text, list(attachments), chat.id)
+
+    # Not waiting for the bot here, since this may be called while handling
+    # a call from the bot, e.g. when a PluginChat schedules jobs right away
+
+    def schedule(self, plugin, chat_id, method, delay, every, args, name):
+        if name is None:
+            name = uuid4().hex
+        self._request('schedule', plugin, chat_id, method, delay, every,
+                      args, name)
+        return name
+
+    def cancel(self, plugin, chat_id, name):
+        self._request('cancel', plugin, chat_id, name)
+
+
+class _AttachmentStore(AttachmentStore):
+    """
+    A worker process's view of the bot's attachment store: files are put
+    into it directly, while pins, the size of the store and evicting files
+    are left to the bot's store, which knows about those of all processes.
+    """
+
+    def __init__(self, store, request):
+        super().__init__(store.path)
+        self._request = request
+
+    def pin(self, paths):
+        self._request('pin_attachments', [Path(path) for path in paths])
+
+    def unpin(self, paths):
+        self._request('unpin_attachments', [Path(path) for path in paths])
+
+    def added(self, size):
+        self._request('attachment_added', size)
@@ -0,0 +1,104 @@
+from cProfile import Profile
+from datetime import datetime
+from pathlib import Path
+from random import random
+import sys
+from threading import Event, get_ident, Lock, Thread
+from time import perf_counter
+import traceback
+
+
+class Profiler(object):
+    """
+    Profiles a fraction of a plugin's handler calls and records handlers that
+    run longer than a threshold.
+
+    Sampled calls are run under cProfile and their stats are written to
+    `output_dir` as <time>-<label>.prof files. For calls exceeding
+    `slow_threshold` seconds, a watchdog thread captures the handler's stack
+    while it is still running, which is written together with the total
+    duration to a <time>-<label>-slow.txt file.
+    """
+
+    def __init__(self, output_dir, sample_rate=.01, slow_threshold=1.):
+        self._output_dir = Path(output_dir)
+        self._sample_rate = sample_rate
+        self._slow_threshold = slow_threshold
+
+        # Running calls: thread ident -> [start, label, captured stack]
+        self._running = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._watchdog = Thread(daemon=True, target=self._watch)
+        self._watchdog.start()
+
+    def __reduce__(self):
+        # Sent to plugin worker processes, which run their own watchdog
+        return (Profiler,
+                (self._output_dir, self._sample_rate, self._slow_threshold))
+
+    def _path(self, label, suffix):
+        Path.mkdir(self._output_dir, exist_ok=True, parents=True)
+        name = '{}-{}{}'.format(
+            datetime.now().strftime('%Y%m%dT%H%M%S.%f'),
+            ''.join(c if c.isalnum() or c in '+-' else '_' for c in label),
+            suffix)
+        return Path.joinpath(self._output_dir, name)
+
+    def run(self, target, args, label):
+        ident = get_ident()
+        start = perf_counter()
+        with self._lock:
+            self._running[ident] = [start, label, None]
+        try:
+            if random() < self._sample_rate:
+                profile = Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Newer Pythons allow only one active profiler at a time;
+                    # just skip this sample then
+                    return target(*args)
+                try:
+                    return target(*args)
+                finally:
+                    profile.disable()
+                    profile.dump_stats(str(self._path(label, '.prof')))
+            return target(*args)
+        finally:
+            duration = perf_counter() - start
+            with self._lock:
+                _, _, stack = self._running.pop(ident)
+            if duration >= self._slow_threshold:
+                self._write_slow(label, duration, stack)
+
+    def _write_slow(self, label, duration, stack):
+        report = 'Handler took {:.3f}s (threshold {:.3f}s)\n'.format(
+            duration, self._slow_threshold)
+        if stack is None:
+            report += 'No stack captured before the handler finished.\n'
+        else:
+            report += 'Stack after {:.3f}s:\n{}'.format(
+                self._slow_threshold, ''.join(stack))
+        self._path(label, '-slow.txt').write_text(report)
+
+    def _watch(self):
+        # Check often enough to catch handlers shortly after the threshold
+        interval = max(self._slow_threshold / 4, .01)
+        while not self._stop.wait(interval):
+            now = perf_counter()
+            with self._lock:
+                late = [ident for ident, (start, _, stack)
+                        in self._running.items()
+                        if stack is None and
+                        now - start >= self._slow_threshold]
+                if not late:
+                    continue
+                frames = sys._current_frames()
+                for ident in late:
+                    if ident in frames:
+                        self._running[ident][2] = \
+                            traceback.format_stack(frames[ident])
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,257 @@
+from .clock import Clock
+from math import ceil
+from .metrics import Counter
+import pickle
+import sqlite3
+from .state import _decode_chat_id, _encode_chat_id
+from threading import Condition, Lock, Thread
+from traceback import print_exc
+from uuid import uuid4
+
+
+JOBS_FIRED = Counter(
+    'signalbot_scheduled_jobs_fired_total',
+    'Scheduled jobs handed to their plugin', ['plugin'])
+
+
+class Job(object):
+
+    __slots__ = ['plugin', 'chat_id', 'name', 'method', 'due', 'every',
+                 'args']
+
+    def __init__(self, plugin, chat_id, name, method, due, every, args):
+        self.plugin = plugin
+        self.chat_id = chat_id
+        self.name = name
+        self.method = method
+        # Seconds since the epoch
+        self.due = due
+        # Seconds between runs of recurring jobs, None for one-shot jobs
+        self.every = every
+        self.args = args
+
+    @property
+    def key(self):
+        return (self.plugin, self.chat_id, self.name)
+
+
+class TimingWheel(object):
+    """
+    Hierarchical timing wheel: `levels` wheels of `slots` slots each, where
+    a slot of level L covers slots**L ticks.
+
+    Adding and removing items is O(1), and so is advancing by a tick, apart
+    from moving the items of a higher level's slot down a level once that
+    slot is reached, which happens at most `levels` times per item. Items
+    due further ahead than the wheels reach wait in the top level and are
+    put back into it until they are due within reach.
+    """
+
+    def __init__(self, now, slots=64, levels=4):
+        self._slots = slots
+        self._levels = levels
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # Item key -> the slot (dict) it is in
+        self._where = {}
+        # The last tick advanced to
+        self.now = now
+
+    def __len__(self):
+        return len(self._where)
+
+    def add(self, key, due, item):
+        """
+        Add `item` (replacing any item with the same key) to be returned by
+        advance() at tick `due`, or at the next tick if that has passed.
+        """
+        self.remove(key)
+        self._place(key, max(due, self.now + 1), item)
+
+    def _place(self, key, due, item):
+        at = min(due, self.now + self._slots ** self._levels - 1)
+        for level in range(self._levels):
+            if at - self.now < self._slots ** (level + 1):
+                break
+        span = self._slots ** level
+        slot = self._wheels[level][at // span % self._slots]
+        slot[key] = (due, item)
+        self._where[key] = slot
+
+    def remove(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def advance(self):
+        """
+        Advance by one tick and return the items due at that tick.
+        """
+        self.now += 1
+        # Move items down from the highest level first, so those landing in
+        # a lower level's current slot are moved further down right away
+        for level in range(self._levels - 1, 0, -1):
+            span = self._slots ** level
+            if self.now % span == 0:
+                slot = self._wheels[level][self.now // span % self._slots]
+                items = list(slot.items())
+                slot.clear()
+                for key, (due, item) in items:
+                    # Items due right now go to the slot handled below
+                    self._place(key, max(due, self.now), item)
+
+        slot = self._wheels[0][self.now % self._slots]
+        items = [item for due, item in slot.values()]
+        for key in slot:
+            del self._where[key]
+        slot.clear()
+        return items
+
+
+class Scheduler(object):
+    """
+    Runs the jobs plugins schedule for their chats, see
+    PluginChat.schedule().
+
+    Jobs are kept in a TimingWheel with a resolution of `tick` seconds and
+    in an SQLite database, so they survive restarts; jobs that became due
+    while the bot was not running are run right after start(). Due jobs are
+    handed to `fire(job)`. Time is measured by `clock`, a
+    signalbot.clock.Clock.
+    """
+
+    def __init__(self, path, fire, tick=1., clock=None):
+        self._fire = fire
+        self._tick = tick
+        self._clock = Clock() if clock is None else clock
+
+        # The connection and the wheel are shared between threads and
+        # protected by _lock
+        self._lock = Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'plugin TEXT NOT NULL, chat TEXT NOT NULL, '
+                'name TEXT NOT NULL, method TEXT NOT NULL, '
+                'due REAL NOT NULL, every REAL, args BLOB NOT NULL, '
+                'UNIQUE (plugin, chat, name))')
+            rows = self._db.execute(
+                'SELECT plugin, chat, name, method, due, every, args '
+                'FROM jobs').fetchall()
+
+        self._wheel = TimingWheel(now=self._ticks(self._clock.time()))
+        for plugin, chat, name, method, due, every, args in rows:
+            job = Job(plugin, _decode_chat_id(chat), name, method, due,
+                      every, pickle.loads(args))
+            self._wheel.add(job.key, ceil(due / tick), job)
+
+        self._stopping = False
+        self._stop = Condition()
+        self._thread = Thread(daemon=True, target=self._run)
+
+    def __len__(self):
+        return len(self._wheel)
+
+    def _ticks(self, t):
+        return int(t // self._tick)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop running jobs; they can still be added until close().
+        """
+        with self._stop:
+            self._stopping = True
+            self._stop.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add(self, plugin, chat_id, method, delay=0, every=None, args=(),
+            name=None):
+        """
+        Schedule a job and return its name. A job of the same plugin and
+        chat with the same name is replaced.
+        """
+        if name is None:
+            name = uuid4().hex
+        job = Job(plugin, chat_id, name, method, self._clock.time() + delay,
+                  every, tuple(args))
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO jobs '
+                '(plugin, chat, name, method, due, every, args) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (plugin, _encode_chat_id(chat_id), name, method, job.due,
+                 every, pickle.dumps(job.args)))
+            self._wheel.add(job.key, ceil(job.due / self._tick), job)
+        return name
+
+    def cancel(self, plugin, chat_id, name=None):
+        """
+        Cancel the named job or, without a name, all jobs of the plugin in
+        the chat. Returns the number of cancelled jobs.
+        """
+        with self._lock, self._db:
+            if name is None:
+                names = [name for name, in self._db.execute(
+                    'SELECT name FROM jobs WHERE plugin = ? AND chat = ?',
+                    (plugin, _encode_chat_id(chat_id)))]
+            else:
+                names = [name]
+            cursor = self._db.executemany(
+                'DELETE FROM jobs WHERE plugin = ? AND chat = ? AND name = ?',
+                [(plugin, _encode_chat_id(chat_id), name) for name in names])
+            for name in names:
+                self._wheel.remove((plugin, chat_id, name))
+        return cursor.rowcount
+
+    def _run(self):
+        while True:
+            with self._lock:
+                wait = (self._wheel.now + 1) * self._tick - self._clock.time()
+            with self._stop:
+                if not self._stopping:
+                    self._clock.wait(self._stop, max(wait, 0))
+                if self._stopping:
+                    return
+
+            with self._lock, self._db:
+                jobs = []
+                # Catch up if the thread has been late
+                while self._wheel.now < self._ticks(self._clock.time()):
+                    jobs += self._wheel.advance()
+                self._reschedule(jobs)
+
+            for job in jobs:
+                JOBS_FIRED.inc(plugin=job.plugin)
+                try:
+                    self._fire(job)
+                except Exception:
+                    print_exc()
+
+    def _reschedule(self, jobs):
+        now = self._clock.time()
+        for job in jobs:
+            chat = _encode_chat_id(job.chat_id)
+            if job.every is None:
+                self._db.execute(
+                    'DELETE FROM jobs WHERE plugin = ? AND chat = ? AND '
+                    'name = ?', (job.plugin, chat, job.name))
+                continue
+            # Skip runs that have been missed
+            due = job.due + job.every
+            if due <= now:
+                due = now + job.every
+            next_job = Job(job.plugin, job.chat_id, job.name, job.method,
+                           due, job.every, job.args)
+            self._db.execute(
+                'UPDATE jobs SET due = ? WHERE plugin = ? AND chat = ? AND '
+                'name = ?', (due, job.plugin, chat, job.name))
+            self._wheel.add(next_job.key, ceil(due / self._tick), next_job)
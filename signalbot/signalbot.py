@@ -1,88 +1,511 @@
 from .plugins import PluginRouter
-from gi.repository import GLib
-from importlib import import_module
-from os import chdir
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from importlib import import_module, reload
+from os import chdir, getcwd
 from pathlib import Path
-from pydbus import connect, SessionBus, SystemBus
 import signal
 from stat import S_IEXEC, S_IREAD
 from sys import exit
 from tempfile import TemporaryDirectory
-from textwrap import dedent
-from threading import Thread
+from threading import Lock, RLock, Thread
+from time import monotonic, perf_counter, sleep
+from traceback import print_exc
+from .attachments import AttachmentStore
+from .clock import Clock
+from .groups import GroupCache
+from .ingress import Ingress
+from .metrics import Counter, Gauge, Histogram, MetricsExporter, REGISTRY
+from .outbox import Outbox
+from .processes import ProcessPluginRouter
+from .profiling import Profiler
+from .scheduler import Scheduler
+from .state import EnabledStore
+from .tracing import TRACER
+from .transports import DBusTransport, JsonRpcTransport
+from .triggers import TriggerIndex
+from .workers import WorkerPool
 import yaml
 
 
+MESSAGES = Counter(
+    'signalbot_messages_total',
+    'Incoming messages by what happened to them', ['outcome'])
+TRIAGE_SECONDS = Histogram(
+    'signalbot_triage_seconds',
+    'Time spent routing an incoming message to the plugins')
+MASTER_SECONDS = Histogram(
+    'signalbot_master_command_seconds',
+    'Time spent handling master commands', ['command'])
+TRANSPORT_SECONDS = Histogram(
+    'signalbot_transport_seconds',
+    'Duration of calls to signal-cli', ['method'])
+TRANSPORT_ERRORS = Counter(
+    'signalbot_transport_errors_total',
+    'Failed calls to signal-cli', ['method'])
+INGRESS_DEPTH = Gauge(
+    'signalbot_ingress_queue_depth',
+    'Incoming messages waiting for a dispatcher thread')
+WORKERS_BUSY = Gauge(
+    'signalbot_workers_busy', 'Worker threads running a task')
+WORKER_QUEUE_DEPTH = Gauge(
+    'signalbot_worker_queue_depth', 'Tasks waiting for a worker thread')
+OUTBOX_PENDING = Gauge(
+    'signalbot_outbox_pending', 'Outgoing messages waiting to be sent')
+SCHEDULED_JOBS = Gauge(
+    'signalbot_scheduled_jobs', 'Jobs scheduled by plugins')
+
+
 class Chats(dict):
 
     def __init__(self, *args, **kwargs):
-        self._bot = kwargs['bot']
-        super().__init__(self, *args, **kwargs)
+        self._bot = kwargs.pop('bot')
+
+        # Idle chats are evicted once there are more than max_resident chats
+        # or once they have not been used for idle_timeout seconds (as
+        # measured by `clock`); 0 disables the respective policy. Evicted
+        # chats are rebuilt by restore(chat_id), which returns None for
+        # chats without plugins.
+        self._max_resident = kwargs.pop('max_resident', 0)
+        self._idle_timeout = kwargs.pop('idle_timeout', 0)
+        self._restore = kwargs.pop('restore', None)
+        self._clock = kwargs.pop('clock', None) or Clock()
+
+        super().__init__(*args, **kwargs)
+
+        # Protects the dict itself as well as _last_used and _pending
+        self._lock = RLock()
+        # Chat ids, least recently used first, with their last use
+        self._last_used = OrderedDict()
+        self._next_sweep = 0
+        # Chat id -> Future resolved once the chat has been restored or
+        # evicted; both happen without holding _lock since they read the
+        # state database and call plugins
+        self._pending = {}
+
+    @property
+    def evicting(self):
+        return bool(self._max_resident or self._idle_timeout)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self._last_used[key] = self._clock.monotonic()
+            self._last_used.move_to_end(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+            del self._last_used[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._last_used.pop(key, None)
+            return super().pop(key, default)
 
     def get(self, key, default=None, store=False):
-        if store and key not in self:
-            self[key] = Chat(self._bot, id=key)
-        return super().get(key, default)
+        if not store and not self.evicting:
+            # Nothing to keep track of; spare the lock on the hot path
+            return super().get(key, default)
+
+        chat = None
+        while chat is None:
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    chat = super().get(key)
+                    if chat is not None:
+                        self._last_used[key] = self._clock.monotonic()
+                        self._last_used.move_to_end(key)
+                        break
+                    pending = self._pending[key] = Future()
+                    building = True
+                else:
+                    building = False
+
+            if not building:
+                # Being restored or evicted by another thread; look again
+                # once it is done
+                pending.result()
+                continue
+
+            try:
+                if self.evicting:
+                    chat = self._restore(key)
+                if chat is None and store:
+                    chat = Chat(self._bot, id=key)
+            finally:
+                with self._lock:
+                    if chat is not None:
+                        self[key] = chat
+                    del self._pending[key]
+                pending.set_result(None)
+            if chat is None:
+                return default
+
+        if self.evicting:
+            self.evict()
+        return chat
+
+    def evict(self):
+        now = self._clock.monotonic()
+        with self._lock:
+            excess = len(self) - self._max_resident \
+                if self._max_resident else 0
+            cutoff = None
+            if self._idle_timeout and now >= self._next_sweep:
+                cutoff = now - self._idle_timeout
+                # No need to look for idle chats more than once a second
+                self._next_sweep = now + min(self._idle_timeout, 1)
+
+            candidates = []
+            for chat_id, last_used in self._last_used.items():
+                if len(candidates) >= excess and \
+                        (cutoff is None or last_used >= cutoff):
+                    break
+                if chat_id not in self._pending:
+                    candidates.append((chat_id, super().get(chat_id)))
+            for chat_id, _ in candidates:
+                self._pending[chat_id] = Future()
+
+        # The plugins save their state meanwhile
+        for chat_id, chat in candidates:
+            evicted = False
+            try:
+                evicted = chat.evict()
+            except Exception:
+                print_exc()
+            with self._lock:
+                if evicted:
+                    del self[chat_id]
+                else:
+                    # Busy; try the next least recently used chat next time
+                    self._last_used.move_to_end(chat_id)
+                pending = self._pending.pop(chat_id)
+            pending.set_result(None)
 
     @staticmethod
     def get_id_from_sender_and_group_id(sender, group_id=[]):
-        if group_id != []:
-            # Ensure we have a hashable id
-            return tuple(group_id)
+        if group_id:
+            # Ensure we have a hashable and compact id; D-Bus hands over
+            # byte arrays as lists of ints
+            return bytes(group_id)
         else:
             return sender
 
 
+def _chat_name(chat_id):
+    # Phone numbers and group ids as signal-cli shows them
+    if isinstance(chat_id, bytes):
+        return b64encode(chat_id).decode()
+    return chat_id
+
+
 class Chat(object):
 
+    __slots__ = ['_bot', 'is_group', 'id', '_plugin_routers', '_lock',
+                 '_evicted']
+
     def __init__(self, bot, id):
         self._bot = bot
-        self.is_group = isinstance(id, tuple) and id != ()
+        self.is_group = isinstance(id, bytes)
         self.id = id
 
         self._plugin_routers = {}
 
+        # Protects _plugin_routers and _evicted
+        self._lock = Lock()
+        self._evicted = False
+
     def __str__(self):
+        # Group chats are still named after the tuple of ints they used to be
+        # identified with, e.g. for their data directories
+        if self.is_group:
+            return str(tuple(self.id))
         return str(self.id)
 
-    def enable_plugin(self, plugin, plugin_router):
-        if plugin not in self._plugin_routers:
-            self._plugin_routers[plugin] = plugin_router
-            self._plugin_routers[plugin].enable(self)
+    def enable_plugin(self, plugin, plugin_router, **kwargs):
+        with self._lock:
+            if plugin not in self._plugin_routers:
+                self._plugin_routers[plugin] = plugin_router
+                self._plugin_routers[plugin].enable(self, **kwargs)
 
     def disable_plugin(self, plugin):
-        if plugin in self._plugin_routers:
-            self._plugin_routers[plugin].disable(self)
-            del self._plugin_routers[plugin]
+        with self._lock:
+            if plugin in self._plugin_routers:
+                self._plugin_routers[plugin].disable(self)
+                del self._plugin_routers[plugin]
+
+    def replace_plugin_router(self, plugin, plugin_router):
+        """
+        Swap the router of an enabled plugin, e.g. when it is reloaded.
+        Returns False if the plugin is not enabled or the chat has been
+        evicted.
+        """
+        with self._lock:
+            if self._evicted or plugin not in self._plugin_routers:
+                return False
+            self._plugin_routers[plugin] = plugin_router
+            return True
+
+    def run(self, plugin, method, args):
+        """
+        Run a scheduled job of the plugin, see PluginChat.schedule(). Like
+        triagemessage(), returns False if the chat has been evicted.
+        """
+        with self._lock:
+            if self._evicted:
+                return False
+            if plugin in self._plugin_routers:
+                self._plugin_routers[plugin].run(self, method, args)
+        return True
+
+    def schedule(self, plugin, method, delay, every, args, name):
+        return self._bot.schedule(
+            plugin, self.id, method, delay, every, args, name)
+
+    def cancel(self, plugin, name):
+        return self._bot.cancel(plugin, self.id, name)
 
     def triagemessage(self, message):
-        for plugin_router in self._plugin_routers.values():
-            plugin_router.triagemessage(message)
+        """
+        Returns False if the chat has been evicted in the meantime, in which
+        case the message has to be handed to the chat's new instance.
+        """
+        # Only schedule plugins whose triggers match the message
+        plugins = self._bot.match_plugins(message)
+        with self._lock:
+            if self._evicted:
+                return False
+            for plugin, plugin_router in self._plugin_routers.items():
+                if plugin in plugins:
+                    plugin_router.triagemessage(message)
+        return True
+
+    def evict(self):
+        """
+        Drop the plugins' per-chat instances unless some of them are busy.
+        Returns whether the chat has been evicted.
+        """
+        # Never wait here; a chat that is being used is not idle anyway
+        if not self._lock.acquire(False):
+            return False
+        try:
+            if not all(plugin_router.is_idle(self)
+                       for plugin_router in self._plugin_routers.values()):
+                return False
+            for plugin_router in self._plugin_routers.values():
+                plugin_router.evict(self)
+            self._evicted = True
+            return True
+        finally:
+            self._lock.release()
+
+    @property
+    def attachments(self):
+        return self._bot.attachments
+
+    @property
+    def clock(self):
+        return self._bot.clock
+
+    @property
+    def name(self):
+        """
+        The group's name or, for direct chats, the phone number. Cached, see
+        Signalbot.group_info().
+        """
+        if self.is_group:
+            return self._bot.group_info(self.id)[0]
+        return self.id
+
+    @property
+    def members(self):
+        """
+        The phone numbers of the group's members or, for direct chats, of
+        the other party.
+        """
+        if self.is_group:
+            return list(self._bot.group_info(self.id)[1])
+        return [self.id]
+
+    def submit(self, fn, *args):
+        return self._bot.submit(fn, *args)
+
+    def submit_priority(self, fn, *args):
+        return self._bot.submit_priority(fn, *args)
 
     def reply(self, text, attachments=[]):
-        self._bot.send_message(text, attachments, self)
+        return self._bot.send_message(text, attachments, self)
 
     def error(self, text, attachments=[]):
-        self._bot.send_error(text, attachments, self)
+        return self._bot.send_error(text, attachments, self)
 
     def success(self, text, attachments=[]):
-        self._bot.send_success(text, attachments, self)
+        return self._bot.send_success(text, attachments, self)
+
+    def broadcast(self, text, attachments, chats):
+        return self._bot.broadcast(text, attachments, chats)
+
+
+class LazyPluginRouter(object):
+    """
+    Stands in for the router of a plugin that has not been imported yet.
+    The plugin is loaded when it is enabled in a chat or when the first
+    message for one of its chats arrives.
+    """
+
+    def __init__(self, plugin, load, triggers):
+        self._plugin = plugin
+        self._load = load
+        self._triggers = triggers
+
+        # Chats the plugin has been enabled in while not loaded yet
+        self._pending_chats = {}
+        self._lock = Lock()
+        self._router = None
+
+    @property
+    def loaded(self):
+        """
+        The actual router or None if the plugin has not been loaded yet.
+        """
+        return self._router
+
+    def load(self):
+        with self._lock:
+            if self._router is None:
+                router = self._load()
+                for chat in self._pending_chats.values():
+                    router.enable(chat)
+                self._pending_chats = None
+                self._router = router
+        return self._router
+
+    def enable(self, chat, load=True):
+        with self._lock:
+            if self._router is None and not load:
+                self._pending_chats[chat.id] = chat
+                return
+        self.load().enable(chat)
+
+    def disable(self, chat):
+        with self._lock:
+            if self._router is None:
+                self._pending_chats.pop(chat.id, None)
+                return
+        self._router.disable(chat)
+
+    def is_idle(self, chat):
+        return self._router is None or self._router.is_idle(chat)
+
+    def evict(self, chat):
+        with self._lock:
+            if self._router is None:
+                self._pending_chats.pop(chat.id, None)
+                return
+        self._router.evict(chat)
+
+    def run(self, chat, method, args):
+        self.load().run(chat, method, args)
+
+    def triagemessage(self, message):
+        router = self._router
+        if router is None:
+            router = self.load()
+            # The message got here because the plugin's triggers were not
+            # known before loading it
+            if self._plugin not in self._triggers.match(message):
+                return
+        router.triagemessage(message)
+
+
+class ReloadingPluginRouter(object):
+    """
+    Stands in for the router of a plugin while it is being reloaded, see
+    //reload. Messages, jobs and chats being enabled or disabled are held
+    back until the new router is ready and then handed to it in order.
+    Meanwhile the chats are never idle, so that they are not evicted.
+    """
+
+    def __init__(self, plugin_router):
+        # The router being replaced
+        self.old = plugin_router
+
+        # Calls held back as (method, args), protected by _lock
+        self._held = []
+        self._lock = Lock()
+        self._router = None
+
+    def release(self, plugin_router):
+        """
+        Hand everything held back to `plugin_router` (the new router or,
+        if reloading failed, the old one) and forward to it from now on.
+        """
+        with self._lock:
+            for method, args in self._held:
+                try:
+                    getattr(plugin_router, method)(*args)
+                except Exception:
+                    print_exc()
+            self._held = None
+            self._router = plugin_router
+
+    def _forward(self, method, *args):
+        with self._lock:
+            if self._router is None:
+                self._held.append((method, args))
+                return
+        getattr(self._router, method)(*args)
+
+    def enable(self, chat):
+        self._forward('enable', chat)
+
+    def disable(self, chat):
+        self._forward('disable', chat)
+
+    def is_idle(self, chat):
+        return self._router is not None and self._router.is_idle(chat)
+
+    def evict(self, chat):
+        self._forward('evict', chat)
+
+    def run(self, chat, method, args):
+        self._forward('run', chat, method, args)
+
+    def triagemessage(self, message):
+        self._forward('triagemessage', message)
 
 
 class Message(object):
 
-    def __init__(self, timestamp, chat, sender, text, attachmentfiles):
+    __slots__ = ['timestamp', 'chat', 'sender', 'text', 'attachmentfiles',
+                 'trace_id']
+
+    def __init__(self, timestamp, chat, sender, text, attachmentfiles,
+                 trace_id=None):
         self.timestamp = timestamp
         self.chat = chat
         self.sender = sender
         self.text = text
         self.attachmentfiles = attachmentfiles
+        # See signalbot.tracing
+        self.trace_id = trace_id
 
 
 class Signalbot(object):
 
-    def __init__(self, data_dir=None, mocker=False):
+    def __init__(self, data_dir=None, mocker=False, transport=None,
+                 clock=None):
         self._mocker = mocker
+        # A signalbot.transports.Transport overriding the configured one
+        self._transport = transport
+        # The time as seen by plugins, scheduled jobs and the outbox, see
+        # signalbot.clock
+        self.clock = Clock() if clock is None else clock
 
         if data_dir is None:
             self._data_dir = Path.joinpath(Path.home(), '.config', 'signalbot')
@@ -90,97 +513,371 @@ class Signalbot(object):
             self._data_dir = Path(data_dir)
         else:
             self._data_dir = data_dir
+        # Files are opened after changing into the fake working directory
+        self._data_dir = self._data_dir.absolute()
 
         # defaults
         self._config = {
+            # How to talk to signal-cli: 'dbus' or 'jsonrpc'
+            'transport': 'dbus',
+            # D-Bus: 'session', 'system' or a bus address
             'bus': None,
-            'enabled': {},
+            # JSON-RPC: the socket of signal-cli's daemon mode and where it
+            # stores attachments (None for its default location)
+            'jsonrpc_socket': '/run/signal-cli/socket',
+            'jsonrpc_attachment_dir': None,
             'master': None,
             'plugins': [],
             'testing_plugins': [],
             'startup_notification': False,
+            # Shared pool running the plugins' message processing
+            'worker_threads': 16,
+            # Maximum number of queued tasks, 0 for no limit
+            'worker_queue_size': 1000,
+            # Threads handling incoming messages off the transport's thread
+            'dispatcher_threads': 1,
+            # Threads of the priority lane, which runs the handlers of
+            # lightweight plugins (see PluginChat.lightweight); master
+            # commands also get a dispatcher thread of their own
+            'priority_threads': 2,
+            # Limit on the tasks of a plugin over all of its chats (per
+            # process for plugin_processes) in the worker pool at a time, 0
+            # for no limit; see PluginChat.max_in_flight for the limit per
+            # chat
+            'plugin_max_in_flight': 0,
+            # Threads sending outgoing messages
+            'sender_threads': 1,
+            # Direct recipients per signal-cli call and parallel calls when
+            # sending the same message to many chats, see broadcast()
+            'broadcast_batch_size': 50,
+            'broadcast_threads': 4,
+            # Seconds to hold back replies to a chat in order to merge them
+            # into one message, 0 to send each reply on its own
+            'reply_coalesce_window': 0,
+            # Seconds after which groups' names and members (see Chat.name
+            # and Chat.members) are looked up again, in the background
+            'group_info_ttl': 300,
+            # Resolution in seconds of the scheduler running plugins' jobs
+            'scheduler_tick': 1.,
+            # Import plugins only once they are actually needed
+            'lazy_plugins': False,
+            # Plugins to run in worker processes rather than in the bot's
+            # process, with the number of processes for each, e.g.
+            # {plugin: 4}; chats are spread over a plugin's processes
+            'plugin_processes': {},
+            # Limit on the number of chats kept in memory, 0 for no limit
+            'max_resident_chats': 0,
+            # Seconds after which an unused chat is dropped from memory, 0
+            # to keep chats forever
+            'chat_idle_timeout': 0,
+            # Bytes of disk space for attachments plugins put into the
+            # bot's attachment store, 0 for no limit
+            'attachment_quota': 512 * 1024 ** 2,
+            # Where to export metrics in the Prometheus text format: a file
+            # rewritten every metrics_interval seconds and/or a Unix socket
+            'metrics_file': None,
+            'metrics_socket': None,
+            'metrics_interval': 10,
+            # Fraction of handler calls run under cProfile and the duration
+            # in seconds from which on handlers are reported as slow while
+            # profiling a plugin, see //profile
+            'profile_sample_rate': .01,
+            'profile_slow_threshold': 1.,
+            # Number of the most recent spans kept for //trace, i.e. the
+            # timings of the steps of handling messages, 0 to switch tracing
+            # off
+            'trace_buffer': 10000,
         }
 
         self._configfile = Path.joinpath(self._data_dir, 'config.yaml')
         with self._configfile.open('r') as yamlfile:
-            self._config.update(yaml.load(yamlfile))
+            config = yaml.load(yamlfile, Loader=yaml.FullLoader)
+        self._config.update(config)
+        # Only these are written back, so that defaults are not frozen
+        self._config_keys = list(config)
+
+        # Serializes master commands across dispatcher threads
+        self._master_lock = Lock()
+        # Protects _master_commands on its own: plugins register theirs when
+        # loaded, which may happen while a chat's lock is held, so no other
+        # lock may be taken while holding it
+        self._commands_lock = Lock()
+        # Command -> (handler, usage, plugin or None), see
+        # register_master_command()
+        self._master_commands = OrderedDict()
+        for command, handler, usage in [
+                ('help', self._master_print_help, None),
+                ('enable', self._master_enable,
+                 '//enable plugin [plugin ...] [--chats chats]'),
+                ('disable', self._master_disable,
+                 '//disable plugin [plugin ...] [--chats chats]'),
+                ('list-enabled', self._master_list_enabled, None),
+                ('list-available', self._master_list_available, None),
+                ('startup', self._master_startup, None),
+                ('stats', self._master_stats, None),
+                ('profile', self._master_profile,
+                 '//profile plugin on|off'),
+                ('reload', self._master_reload,
+                 '//reload plugin [plugin ...]'),
+                ('trace', self._master_trace, '//trace [clear]')]:
+            self.register_master_command(command, handler, usage)
+
+        # Lists of (phase, seconds) pairs, see //startup; phases after
+        # startup, e.g. plugins loaded lazily, are reported separately
+        self._startup_report = []
+        self._later_report = []
+        self._started = False
 
     def _save_config(self):
+        config = {key: self._config[key] for key in self._config_keys
+                  if key in self._config}
         with self._configfile.open('w') as yamlfile:
-            yaml.dump(self._config, yamlfile)
+            yaml.dump(config, yamlfile)
 
-    def _init_plugin(self, plugin, test=False):
-        # Load module
-        if test:
-            module_name = '.tests.plugin_{}'.format(plugin)
-        else:
-            module_name = '.plugins.{}'.format(plugin)
-        module = import_module(module_name, package='signalbot')
+    def _open_state(self):
+        self._state = EnabledStore(Path.joinpath(self._data_dir, 'state.db'))
 
-        # Initialize plugin router
+        # One-time migration of the plugins enabled per chat, which used to
+        # be stored in config.yaml
+        if 'enabled' in self._config:
+            self._state.migrate(self._config['enabled'])
+            del self._config['enabled']
+            self._save_config()
+
+    @contextmanager
+    def _timed(self, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            report = self._later_report if self._started else \
+                self._startup_report
+            report.append((phase, perf_counter() - start))
+
+    def _plugin_module_name(self, plugin, test=False):
+        if test:
+            return '.tests.plugin_{}'.format(plugin)
+        return '.plugins.{}'.format(plugin)
+
+    def _load_plugin(self, plugin, test=False):
+        module_name = self._plugin_module_name(plugin, test)
+        with self._timed('import {}'.format(plugin)):
+            module = import_module(module_name, package='signalbot')
+
+        with self._timed('router {}'.format(plugin)):
+            plugin_router = self._make_plugin_router(
+                plugin, module, module_name)
+        self._triggers.add(plugin, module.__plugin_chat__.triggers)
+        self._register_plugin_commands(plugin, module)
+        return plugin_router
+
+    def _make_plugin_router(self, plugin, module, module_name):
         if hasattr(module, '__plugin_router__'):
             plugin_router_class = module.__plugin_router__
         else:
             plugin_router_class = PluginRouter
         data_dir = Path.joinpath(self._data_dir, 'plugin-'+plugin)
+        if plugin in self._config['plugin_processes']:
+            # The worker processes import the plugin themselves; it is only
+            # imported here for its triggers
+            return ProcessPluginRouter(
+                module_name=module_name,
+                data_dir=data_dir,
+                name=plugin,
+                call_bot=lambda method, *args: getattr(self, method)(*args),
+                attachments=self.attachments,
+                processes=self._config['plugin_processes'][plugin],
+                threads=self._config['worker_threads'],
+                queue_size=self._config['worker_queue_size'],
+                max_in_flight=self._config['plugin_max_in_flight'])
         plugin_router = plugin_router_class(
             data_dir=data_dir,
-            chat_class=module.__plugin_chat__)
+            chat_class=module.__plugin_chat__,
+            name=plugin)
+        plugin_router.limiter.max_in_flight = \
+            self._config['plugin_max_in_flight']
+        return plugin_router
+
+    def _init_plugin(self, plugin, test=False):
+        lazy = self._config['lazy_plugins']
+        if lazy:
+            plugin_router = LazyPluginRouter(
+                plugin, lambda: self._load_plugin(plugin, test),
+                self._triggers)
+            # Without its triggers, every message may be for the plugin
+            self._triggers.add(plugin)
+        else:
+            plugin_router = self._load_plugin(plugin, test)
         self._plugin_routers[plugin] = plugin_router
 
+        # With eviction, chats are only built once they are used
+        if self._chats.evicting:
+            return
+
         # Enable in configured chats
-        for chat_id in self._config['enabled']:
-            if plugin in self._config['enabled'][chat_id]:
-                self._chats.get(chat_id, store=True).enable_plugin(
-                    plugin, plugin_router)
+        with self._timed('enable {}'.format(plugin)):
+            for chat_id in self._state.chats(plugin):
+                chat = self._chats.get(chat_id, store=True)
+                if lazy:
+                    chat.enable_plugin(plugin, plugin_router, load=False)
+                else:
+                    chat.enable_plugin(plugin, plugin_router)
+
+    def _make_transport(self):
+        if self._config['transport'] == 'dbus':
+            return DBusTransport(bus=self._config['bus'], mocker=self._mocker)
+        elif self._config['transport'] == 'jsonrpc':
+            return JsonRpcTransport(
+                path=self._config['jsonrpc_socket'],
+                attachment_dir=self._config['jsonrpc_attachment_dir'])
+        raise ValueError("Unknown transport {}".format(
+            self._config['transport']))
+
+    def _get_plugin_router(self, plugin):
+        """
+        The plugin's router, loading the plugin first if needed.
+        """
+        plugin_router = self._plugin_routers[plugin]
+        if isinstance(plugin_router, LazyPluginRouter):
+            return plugin_router.load()
+        return plugin_router
+
+    def _restore_chat(self, chat_id):
+        plugins = [plugin for plugin in self._state.plugins(chat_id)
+                   if plugin in self._plugin_routers]
+        if not plugins:
+            return None
+        chat = Chat(self, chat_id)
+        for plugin in plugins:
+            chat.enable_plugin(plugin, self._plugin_routers[plugin])
+        return chat
 
     def __enter__(self):
 
-        # SIGTERMs should also lead to __exit__() being called. Note that
-        # SIGINTs/KeyboardInterrupts are already handled by GLib.MainLoop
+        # SIGTERMs should also lead to __exit__() being called; SIGINTs
+        # raise KeyboardInterrupt anyway
         signal.signal(signal.SIGTERM, self._sigterm_handler)
 
-        if self._config['bus'] == 'session' or self._config['bus'] is None:
-            self._bus = SessionBus()
-        elif self.args.bus == 'system':
-            self._bus = SystemBus()
-        else:
-            self._bus = connect(self._config['bus'])
+        TRACER.capacity = self._config['trace_buffer']
 
-        if self._mocker:
-            self._signal = self._bus.get('org.signalbot.signalclidbusmock')
-        else:
-            self._signal = self._bus.get('org.asamk.Signal')
-        self._signal.onMessageReceived = self._triagemessage
+        startup = perf_counter()
+        self._startup_report = []
+        self._later_report = []
+        self._started = False
+
+        if self._transport is None:
+            self._transport = self._make_transport()
+
+        # The transport only enqueues incoming messages; they are handled by
+        # the ingress' dispatcher threads once everything is set up
+        self._ingress = Ingress(
+            handler=self._triagemessage,
+            key=lambda timestamp, sender, group_id, *args:
+                Chats.get_id_from_sender_and_group_id(sender, group_id),
+            threads=self._config['dispatcher_threads'],
+            # Master commands
+            priority=lambda timestamp, sender, group_id, text, *args:
+                text.startswith('//'))
+        self._transport.on_message = self._ingress.put
+
+        with self._timed('bus connection'):
+            self._transport.connect()
 
         # Actively discourage chdir in plugins, see _triagemessage
         self._fakecwd = TemporaryDirectory()
         Path(self._fakecwd.name).chmod(S_IEXEC)
         chdir(self._fakecwd.name)
 
+        self._workers = WorkerPool(
+            threads=self._config['worker_threads'],
+            queue_size=self._config['worker_queue_size'])
+        self._priority_workers = WorkerPool(
+            threads=self._config['priority_threads'], queue_size=0)
+        self._outbox = Outbox(
+            send=self._send_message,
+            threads=self._config['sender_threads'],
+            coalesce_window=self._config['reply_coalesce_window'],
+            clock=self.clock)
+        self._broadcaster = WorkerPool(
+            threads=self._config['broadcast_threads'], queue_size=0)
+        self._groups = GroupCache(
+            fetch=lambda group_ids:
+                self._call_transport('get_groups', group_ids),
+            ttl=self._config['group_info_ttl'],
+            clock=self.clock)
+
+        self.attachments = AttachmentStore(
+            Path.joinpath(self._data_dir, 'attachments'),
+            quota=self._config['attachment_quota'])
+
+        INGRESS_DEPTH.set_function(lambda: self._ingress.depth)
+        WORKERS_BUSY.set_function(lambda: self._workers.busy)
+        WORKER_QUEUE_DEPTH.set_function(lambda: self._workers.queued)
+        OUTBOX_PENDING.set_function(lambda: self._outbox.pending)
+        self._metrics_exporter = MetricsExporter(
+            file=self._config['metrics_file'],
+            socket=self._config['metrics_socket'],
+            interval=self._config['metrics_interval'])
+
         try:
+            self._open_state()
+            # Started once plugins are ready, but they may schedule jobs
+            # while being set up
+            self._scheduler = Scheduler(
+                Path.joinpath(self._data_dir, 'schedule.db'),
+                fire=self._fire_job,
+                tick=self._config['scheduler_tick'],
+                clock=self.clock)
+            SCHEDULED_JOBS.set_function(lambda: len(self._scheduler))
             self._plugin_routers = {}
-            self._chats = Chats(bot=self)
+            # Threads of //reload commands in progress
+            self._reloads = []
+            self._triggers = TriggerIndex()
+            self._chats = Chats(
+                bot=self,
+                max_resident=self._config['max_resident_chats'],
+                idle_timeout=self._config['chat_idle_timeout'],
+                restore=self._restore_chat,
+                clock=self.clock)
             for plugin in self._config['plugins']:
                 self._init_plugin(plugin)
             for plugin in self._config['testing_plugins']:
                 self._init_plugin(plugin, test=True)
 
-            self._loop = GLib.MainLoop()
-            self._thread = Thread(daemon=True, target=self._loop.run)
-            self._thread.start()
+            self._ingress.start()
+            self._scheduler.start()
+            # Plugins are likely to ask for the groups they are enabled in;
+            # not waiting for this
+            self._groups.warm_up([chat_id
+                                  for chat_id in self._state.all_chats()
+                                  if isinstance(chat_id, bytes)])
 
             if self._config['startup_notification']:
-                for master in self._config['master']:
-                    master_chat_id = Chats.get_id_from_sender_and_group_id(
-                        master)
-                    master_chat = self._chats.get(master_chat_id, store=True)
-                    self.send_success('Always at your service!', [],
-                                      master_chat)
+                with self._timed('startup notification'):
+                    self.broadcast('Always at your service! ✔', [],
+                                   self._config['master']).result()
+
+            self._startup_report.append(('total', perf_counter() - startup))
+            self._started = True
 
         except Exception as e:
             # Try not to leave empty temporary directories behind when e.g. a
             # plugin fails to load
+            self._transport.close()
+            self._ingress.shutdown()
+            self._workers.shutdown()
+            self._priority_workers.shutdown()
+            self._outbox.shutdown()
+            self._broadcaster.shutdown()
+            self._groups.close()
+            self._metrics_exporter.shutdown()
+            if hasattr(self, '_state'):
+                self._state.close()
+            if hasattr(self, '_scheduler'):
+                self._scheduler.stop()
+                self._scheduler.close()
+            if hasattr(self, '_plugin_routers'):
+                self._close_plugin_routers()
             Path(self._fakecwd.name).chmod(S_IREAD)
             self._fakecwd.cleanup()
             raise e
@@ -188,70 +885,340 @@ class Signalbot(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._loop.quit()
-        self._thread.join()
-        self._signal.onMessageReceived = None
-
-        self._plugin_routers = {}
+        self._transport.on_message = None
+        self._ingress.shutdown(wait=True)
+        self._scheduler.stop()
+        # Handlers still running may use their plugin's stores, which are
+        # closed below
+        self._workers.shutdown(wait=True)
+        self._priority_workers.shutdown(wait=True)
+        for thread in self._reloads:
+            thread.join()
+        # Plugin worker processes finish their tasks first, which may still
+        # reply or schedule jobs
+        self._close_plugin_routers()
+        # Make sure replies queued so far still go out
+        self._outbox.shutdown(wait=True)
+        self._broadcaster.shutdown(wait=True)
+        self._groups.close()
+        self._transport.close()
+        self._metrics_exporter.shutdown()
+        self._state.close()
+        self._scheduler.close()
         self._chats = None
 
         Path(self._fakecwd.name).chmod(S_IREAD)
         self._fakecwd.cleanup()
 
+    def _close_plugin_routers(self):
+        for plugin_router in self._plugin_routers.values():
+            if isinstance(plugin_router, LazyPluginRouter):
+                plugin_router = plugin_router.loaded
+            if plugin_router is None:
+                continue
+            if plugin_router.profiler is not None:
+                plugin_router.profiler.stop()
+            plugin_router.close()
+        self._plugin_routers = {}
+
     def _sigterm_handler(self, signum, frame):
         # Raises SystemExit exception which then calls __exit__
         exit(0)
 
     def wait(self):
-        self._thread.join()
+        self._transport.wait()
+
+    def submit(self, fn, *args):
+        return self._workers.submit(fn, *args)
+
+    def submit_priority(self, fn, *args):
+        return self._priority_workers.submit(fn, *args)
+
+    def group_info(self, group_id):
+        """
+        The group's (name, members), from the cache if possible.
+        """
+        return self._groups.get(group_id)
+
+    def match_plugins(self, message):
+        return self._triggers.match(message)
 
     def send_message(self, text, attachments, chat):
+        """
+        Queue a message for the chat and return a future that is resolved
+        once it has been handed to signal-cli.
+        """
+        # Stored attachments must not be evicted before they have been sent
+        self.attachments.pin(attachments)
+        queued = monotonic()
+        # Attributed to the message being handled, if any
+        trace_id = TRACER.current()
+        future = self._outbox.put(chat, text, attachments)
+
+        def done(future):
+            self.attachments.unpin(attachments)
+            TRACER.add('reply', queued, monotonic(), trace_id,
+                       chat=_chat_name(chat.id))
+        future.add_done_callback(done)
+        return future
+
+    def _send_message(self, text, attachments, chat):
         if chat.is_group:
-            self._signal.sendGroupMessage(text, attachments, list(chat.id))
+            self._call_transport(
+                'send_group_message', text, attachments, chat.id)
         else:
-            self._signal.sendMessage(text, attachments, [chat.id])
+            self._call_transport('send_message', text, attachments, [chat.id])
+
+    def _call_transport(self, method, *args):
+        try:
+            with TRANSPORT_SECONDS.time(method=method):
+                return getattr(self._transport, method)(*args)
+        except Exception:
+            TRANSPORT_ERRORS.inc(method=method)
+            raise
 
     def send_error(self, text, attachments, chat):
-        self.send_message(text + ' ❌', attachments, chat)
+        return self.send_message(text + ' ❌', attachments, chat)
 
     def send_success(self, text, attachments, chat):
-        self.send_message(text + ' ✔', attachments, chat)
+        return self.send_message(text + ' ✔', attachments, chat)
+
+    def broadcast(self, text, attachments, chats):
+        """
+        Send the same message to many chats, given as Chat instances or chat
+        ids. Direct recipients are sent to in batches of
+        broadcast_batch_size per signal-cli call, and calls, including those
+        for groups, run concurrently.
+
+        Returns a future resolved once everything has been sent, with a
+        dict of the chat ids that failed mapped to their exception. Unlike
+        send_message(), the message is not ordered with replies queued for
+        the same chats.
+        """
+        direct, groups = [], []
+        for chat in chats:
+            chat_id = chat.id if isinstance(chat, Chat) else chat
+            if isinstance(chat_id, bytes):
+                groups.append(chat_id)
+            else:
+                direct.append(chat_id)
+        # Without duplicates, in order
+        direct = list(OrderedDict.fromkeys(direct))
+        groups = list(OrderedDict.fromkeys(groups))
+
+        batch_size = self._config['broadcast_batch_size']
+        calls = []
+        for i in range(0, len(direct), batch_size):
+            batch = direct[i:i + batch_size]
+            calls.append(('send_message', batch, batch))
+        for group_id in groups:
+            calls.append(('send_group_message', group_id, [group_id]))
+
+        result = Future()
+        if not calls:
+            result.set_result({})
+            return result
+
+        failures = {}
+        remaining = [len(calls)]
+        lock = Lock()
+
+        def done(chat_ids, future):
+            error = future.exception()
+            with lock:
+                if error is not None:
+                    failures.update((chat_id, error) for chat_id in chat_ids)
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            self.attachments.unpin(attachments)
+            result.set_result(failures)
+
+        self.attachments.pin(attachments)
+        for method, recipients, chat_ids in calls:
+            future = self._broadcaster.submit(
+                self._call_transport, method, text, attachments, recipients)
+            future.add_done_callback(
+                lambda future, chat_ids=chat_ids: done(chat_ids, future))
+        return result
+
+    def schedule(self, plugin, chat_id, method, delay=0, every=None, args=(),
+                 name=None):
+        return self._scheduler.add(
+            plugin, chat_id, method, delay, every, args, name)
+
+    def cancel(self, plugin, chat_id, name=None):
+        return self._scheduler.cancel(plugin, chat_id, name)
+
+    def _fire_job(self, job):
+        if job.plugin not in self._plugin_routers or \
+                not self._state.is_enabled(job.chat_id, job.plugin):
+            # Left over from a plugin that has been removed from the config
+            self._scheduler.cancel(job.plugin, job.chat_id)
+            return
+
+        chat = self._chats.get(job.chat_id)
+        if chat is not None and not chat.run(job.plugin, job.method,
+                                             job.args):
+            # The chat has just been evicted; rebuild it
+            chat = self._chats.get(job.chat_id)
+            if chat is not None:
+                chat.run(job.plugin, job.method, job.args)
 
     def _triagemessage(self,
                        timestamp, sender, group_id, text, attachmentfiles):
 
         # Do not accumulate Chat instances for chats with no active plugins
         chat_id = Chats.get_id_from_sender_and_group_id(sender, group_id)
-        # Use short-circuit "or" to avoid instantiation of an obsolete Chat
-        # class object; this works since a Chat class object always is truthy
-        chat = self._chats.get(chat_id) or Chat(self, chat_id)
-
-        message = Message(timestamp, chat, sender, text, attachmentfiles)
-
-        # Master messages are handled internally and in main thread
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Drop messages no plugin will see without allocating anything;
+            # only master messages need a (throwaway) Chat to reply to
+            if not text.startswith('//'):
+                MESSAGES.inc(outcome='dropped')
+                return
+            chat = Chat(self, chat_id)
+
+        message = Message(timestamp, chat, sender, text, attachmentfiles,
+                          trace_id=TRACER.current())
+
+        # Master messages are handled internally and in the dispatcher
+        # thread; one at a time since they modify the configuration
         if message.text.startswith('//'):
-            self._master_message(message)
+            MESSAGES.inc(outcome='master')
+            with self._master_lock, TRACER.span('master'):
+                self._master_message(message)
             return
 
-        # Other messages are handled by plugins and in separate threads
-        chat.triagemessage(message)
+        # Other messages are handled by plugins in the worker pool
+        MESSAGES.inc(outcome='routed')
+        with TRIAGE_SECONDS.time(), TRACER.span('triage'):
+            if not chat.triagemessage(message):
+                # The chat has just been evicted; rebuild it
+                chat = self._chats.get(chat_id)
+                if chat is not None:
+                    message.chat = chat
+                    chat.triagemessage(message)
 
         # Check whether we are still in fakecwd
-        if Path.cwd() != Path(self._fakecwd.name):
+        if getcwd() != self._fakecwd.name:
             raise Exception("Do not change the working directory. Use absolute"
-                            "paths instead.")
-
-    def _master_print_help(self, message):
-        message.chat.reply(dedent("""\
-            Available commands:
-            //help
-            //enable plugin [plugin ...]
-            //disable plugin  [plugin ...]
-            //list-enabled
-            //list-available
-            """))
+                            " paths instead.")
+
+    def register_master_command(self, command, handler, usage=None,
+                                plugin=None):
+        """
+        Make `handler(message, params)` handle //command, where params are
+        the words following the command. `usage` is listed by //help.
+        Commands registered for a plugin may be replaced by the same plugin,
+        e.g. when it is reloaded.
+        """
+        with self._commands_lock:
+            if command in self._master_commands and \
+                    self._master_commands[command][2] != plugin:
+                raise ValueError(
+                    "Master command {} is already registered".format(
+                        command))
+            self._master_commands[command] = (
+                handler, usage or '//' + command, plugin)
+
+    def _register_plugin_commands(self, plugin, module):
+        # A plugin's commands are handled in the bot's process, even for
+        # plugins running in worker processes; they are passed the plugin's
+        # router
+        commands = getattr(module, '__plugin_master_commands__', {})
+        for command, (handler, usage) in commands.items():
+            self.register_master_command(
+                command,
+                lambda message, params, handler=handler:
+                    self._run_plugin_command(plugin, handler, message,
+                                             params),
+                usage, plugin)
+
+    def _run_plugin_command(self, plugin, handler, message, params):
+        if isinstance(self._plugin_routers[plugin], ReloadingPluginRouter):
+            message.chat.error(
+                "Plugin {} is being reloaded.".format(plugin))
+            return
+        handler(self._get_plugin_router(plugin), message, params)
+
+    def _master_print_help(self, message, params):
+        reply = "Available commands:\n"
+        with self._commands_lock:
+            commands = list(self._master_commands.values())
+        for handler, usage, plugin in commands:
+            reply += "{}\n".format(usage)
+        message.chat.reply(reply)
+
+    def _split_chats(self, message, params):
+        """
+        Split the --chats option off a command's parameters. Returns the
+        remaining parameters and the ids of the chats it selects, see
+        _select_chats(), or None if the command is for the chat it came
+        from. Replies with an error and returns None, None if the option is
+        incomplete or names chats that are not known.
+        """
+        if '--chats' not in params:
+            return params, None
+        index = params.index('--chats')
+        if index + 1 >= len(params):
+            message.chat.error("--chats needs a value")
+            return None, None
+        chat_ids, rejected = self._select_chats(params[index + 1])
+        if rejected:
+            message.chat.error("Unknown chats in --chats: {}".format(
+                ', '.join(rejected)))
+            return None, None
+        return params[:index] + params[index + 2:], chat_ids
+
+    def _select_chats(self, selection):
+        """
+        The ids of the chats selected by a comma-separated list of phone
+        numbers, group ids (base64, as signal-cli shows them), 'all-groups',
+        'all' and glob patterns matching either. Only chats some plugin is
+        enabled in are known to match 'all', 'all-groups' and patterns, and
+        group ids have to be known as well.
+
+        Returns the chat ids and the group ids that are not valid base64 or
+        not known.
+        """
+        known = set(self._state.all_chats()) | set(list(self._chats))
+        known = sorted(known, key=_chat_name)
+        known_groups = set(chat_id for chat_id in known
+                           if isinstance(chat_id, bytes))
+
+        chat_ids = []
+        rejected = []
+        for item in selection.split(','):
+            if item == 'all':
+                matches = known
+            elif item == 'all-groups':
+                matches = [chat_id for chat_id in known
+                           if isinstance(chat_id, bytes)]
+            elif any(c in item for c in '*?['):
+                matches = [chat_id for chat_id in known
+                           if fnmatchcase(_chat_name(chat_id), item)]
+            elif item.startswith('+'):
+                matches = [item]
+            else:
+                try:
+                    group_id = b64decode(item, validate=True)
+                except ValueError:
+                    group_id = None
+                if group_id not in known_groups:
+                    rejected.append(item)
+                    continue
+                matches = [group_id]
+            for chat_id in matches:
+                if chat_id not in chat_ids:
+                    chat_ids.append(chat_id)
+        return chat_ids, rejected
 
     def _master_enable(self, message, params):
+        params, chat_ids = self._split_chats(message, params)
+        if params is None:
+            return
+        plugins = []
         for plugin in params:
 
             if plugin not in self._config['plugins'] + \
@@ -259,55 +1226,258 @@ class Signalbot(object):
                 message.chat.error("Plugin {} not loaded".format(plugin))
                 continue
 
-            chat_id = message.chat.id
-            if chat_id not in self._config['enabled']:
-                self._config['enabled'][chat_id] = []
-
-            if plugin in self._config['enabled'][chat_id]:
-                message.chat.reply(
-                    "Plugin {} is already enabled.".format(plugin))
-                continue
-
-            self._config['enabled'][chat_id].append(plugin)
-            self._save_config()
-            # Use store=True to automatically store the chat in
-            # self._chats if it has not been so far
+            if chat_ids is None:
+                chat_id = message.chat.id
+                if not self._state.enable(chat_id, plugin):
+                    message.chat.reply(
+                        "Plugin {} is already enabled.".format(plugin))
+                    continue
+
+                # Use store=True to automatically store the chat in
+                # self._chats if it has not been so far
+                chat = self._chats.get(chat_id, store=True)
+                chat.enable_plugin(plugin, self._plugin_routers[plugin])
+                message.chat.success("Plugin {} enabled.".format(plugin))
+            else:
+                plugins.append(plugin)
+
+        if not plugins:
+            return
+        # All chats are written to the store at once
+        enabled = self._state.enable_many(
+            [(chat_id, plugin) for plugin in plugins for chat_id in chat_ids])
+        for chat_id, plugin in enabled:
             chat = self._chats.get(chat_id, store=True)
             chat.enable_plugin(plugin, self._plugin_routers[plugin])
-            message.chat.success("Plugin {} enabled.".format(plugin))
+        for plugin in plugins:
+            message.chat.success("Plugin {} enabled in {} of {} chats.".format(
+                plugin, sum(1 for _, p in enabled if p == plugin),
+                len(chat_ids)))
 
     def _master_disable(self, message, params):
-        for plugin in params:
-            chat_id = message.chat.id
-
-            if chat_id not in self._config['enabled'] or \
-                    plugin not in self._config['enabled'][chat_id]:
-                message.chat.reply(
-                    "Plugin {} is already disabled.".format(plugin))
-                continue
+        params, chat_ids = self._split_chats(message, params)
+        if params is None:
+            return
+        if chat_ids is None:
+            for plugin in params:
+                chat_id = message.chat.id
+
+                if not self._state.disable(chat_id, plugin):
+                    message.chat.reply(
+                        "Plugin {} is already disabled.".format(plugin))
+                    continue
+
+                message.chat.disable_plugin(plugin)
+                self._scheduler.cancel(plugin, chat_id)
+                if not self._state.plugins(chat_id):
+                    self._chats.pop(chat_id)
+                message.chat.success("Plugin {} disabled.".format(plugin))
+            return
 
-            message.chat.disable_plugin(plugin)
-            self._config['enabled'][chat_id].remove(plugin)
-            if not len(self._config['enabled'][chat_id]):
-                del self._config['enabled'][chat_id]
-                del self._chats[chat_id]
-            self._save_config()
-            message.chat.success("Plugin {} disabled.".format(plugin))
+        disabled = self._state.disable_many(
+            [(chat_id, plugin) for plugin in params for chat_id in chat_ids])
+        for chat_id, plugin in disabled:
+            # Evicted chats are rebuilt without the plugin anyway
+            chat = self._chats.get(chat_id)
+            if chat is not None:
+                chat.disable_plugin(plugin)
+            self._scheduler.cancel(plugin, chat_id)
+            if not self._state.plugins(chat_id):
+                self._chats.pop(chat_id)
+        for plugin in params:
+            message.chat.success(
+                "Plugin {} disabled in {} of {} chats.".format(
+                    plugin, sum(1 for _, p in disabled if p == plugin),
+                    len(chat_ids)))
 
-    def _master_list_enabled(self, message):
+    def _master_list_enabled(self, message, params):
         reply = "Enabled plugins:\n"
-        chat_id = message.chat.id
-        if chat_id in self._config['enabled']:
-            for plugin in self._config['enabled'][chat_id]:
-                reply += "{}\n".format(plugin)
+        for plugin in self._state.plugins(message.chat.id):
+            reply += "{}\n".format(plugin)
         message.chat.reply(reply)
 
-    def _master_list_available(self, message):
+    def _master_list_available(self, message, params):
         reply = "Available plugins:\n"
         for plugin in self._plugin_routers:
             reply += "{}\n".format(plugin)
         message.chat.reply(reply)
 
+    def _master_startup(self, message, params):
+        reply = "Startup report:\n"
+        for phase, seconds in self._startup_report:
+            reply += "{}: {:.3f}s\n".format(phase, seconds)
+        if self._later_report:
+            reply += "After startup:\n"
+            for phase, seconds in self._later_report:
+                reply += "{}: {:.3f}s\n".format(phase, seconds)
+        message.chat.reply(reply)
+
+    def _master_profile(self, message, params):
+        if len(params) != 2 or params[1] not in ['on', 'off']:
+            message.chat.error("Usage: //profile plugin on|off")
+            return
+        plugin, switch = params
+        if plugin not in self._plugin_routers:
+            message.chat.error("Plugin {} not loaded".format(plugin))
+            return
+
+        if isinstance(self._plugin_routers[plugin], ReloadingPluginRouter):
+            message.chat.error(
+                "Plugin {} is being reloaded.".format(plugin))
+            return
+
+        plugin_router = self._get_plugin_router(plugin)
+        if switch == 'on':
+            if plugin_router.profiler is None:
+                plugin_router.profiler = Profiler(
+                    output_dir=Path.joinpath(plugin_router.data_dir,
+                                             'profiles'),
+                    sample_rate=self._config['profile_sample_rate'],
+                    slow_threshold=self._config['profile_slow_threshold'])
+            message.chat.success(
+                "Profiling plugin {}; output goes to {}.".format(
+                    plugin, Path.joinpath(plugin_router.data_dir,
+                                          'profiles')))
+        else:
+            profiler = plugin_router.profiler
+            plugin_router.profiler = None
+            if profiler is not None:
+                profiler.stop()
+            message.chat.success(
+                "Stopped profiling plugin {}.".format(plugin))
+
+    def _master_trace(self, message, params):
+        if params == ['clear']:
+            TRACER.clear()
+            message.chat.success("Trace cleared.")
+            return
+        if params:
+            message.chat.error("Usage: //trace [clear]")
+            return
+
+        trace_dir = Path.joinpath(self._data_dir, 'traces')
+        Path.mkdir(trace_dir, exist_ok=True)
+        path = Path.joinpath(trace_dir, 'trace-{}.json'.format(
+            int(self.clock.time())))
+        spans = TRACER.export(path)
+        message.chat.success("Wrote {} spans to {}.".format(spans, path))
+
+    def _master_reload(self, message, params):
+        for plugin in params:
+            if plugin not in self._plugin_routers:
+                message.chat.error("Plugin {} not loaded".format(plugin))
+                continue
+
+            plugin_router = self._plugin_routers[plugin]
+            if isinstance(plugin_router, ReloadingPluginRouter):
+                message.chat.error(
+                    "Plugin {} is already being reloaded.".format(plugin))
+                continue
+            if isinstance(plugin_router, LazyPluginRouter) and \
+                    plugin_router.loaded is None:
+                # Not imported yet, so it is going to be loaded from the
+                # current code anyway
+                message.chat.success("Plugin {} reloaded.".format(plugin))
+                continue
+
+            # Waiting for the plugin's handlers to finish happens in the
+            # background, so that other messages keep being handled
+            reloading = ReloadingPluginRouter(
+                plugin_router.loaded
+                if isinstance(plugin_router, LazyPluginRouter)
+                else plugin_router)
+            chats = self._replace_plugin_router(plugin, reloading)
+            thread = Thread(
+                target=self._reload_plugin,
+                args=[plugin, plugin_router, reloading, chats, message.chat],
+                name='signalbot-reload-{}'.format(plugin))
+            self._reloads.append(thread)
+            thread.start()
+
+    def _replace_plugin_router(self, plugin, plugin_router):
+        """
+        Make `plugin_router` the plugin's router and return the resident
+        chats the plugin is enabled in.
+        """
+        # Chats restored from now on get the new router right away
+        self._plugin_routers[plugin] = plugin_router
+        return [chat for chat in list(self._chats.values())
+                if chat.replace_plugin_router(plugin, plugin_router)]
+
+    def _reload_plugin(self, plugin, previous, reloading, chats, reply_to):
+        old = reloading.old
+        try:
+            module_name = self._plugin_module_name(
+                plugin, test=plugin not in self._config['plugins'])
+            module = reload(import_module(module_name, package='signalbot'))
+            plugin_router = self._make_plugin_router(
+                plugin, module, module_name)
+        except Exception as e:
+            print_exc()
+            reloading.release(old)
+            self._replace_plugin_router(plugin, previous)
+            reply_to.error("Reloading plugin {} failed: {}".format(plugin, e))
+            return
+
+        # (chat, state) of the chats handed over by the old router and the
+        # chats taken over by the new one so far
+        states = []
+        taken = []
+        try:
+            # Nothing new reaches the old router; let what it runs finish
+            while not all(old.is_idle(chat) for chat in chats):
+                sleep(.05)
+
+            # The old router's files have to be closed before the new one
+            # opens them
+            for chat in chats:
+                states.append((chat, old.hand_over(chat)))
+            old.close()
+            for chat, state in states:
+                plugin_router.take_over(chat, state)
+                taken.append(chat)
+        except Exception as e:
+            print_exc()
+            self._roll_back_reload(old, plugin_router, states, taken)
+            reloading.release(old)
+            self._replace_plugin_router(plugin, previous)
+            reply_to.error(
+                "Handing plugin {}'s chats over failed, keeping the old "
+                "version: {}".format(plugin, e))
+            return
+
+        plugin_router.profiler = old.profiler
+        self._register_plugin_commands(plugin, module)
+        self._triggers.add(plugin, module.__plugin_chat__.triggers)
+        reloading.release(plugin_router)
+        self._replace_plugin_router(plugin, plugin_router)
+        reply_to.success("Plugin {} reloaded.".format(plugin))
+
+    def _roll_back_reload(self, old, plugin_router, states, taken):
+        """
+        Hand the chats back to the old router after the new one failed to
+        take them over, with the state the new router has for those it did
+        take over.
+        """
+        states = dict(states)
+        for chat in taken:
+            try:
+                states[chat] = plugin_router.hand_over(chat)
+            except Exception:
+                print_exc()
+        try:
+            plugin_router.close()
+        except Exception:
+            print_exc()
+        for chat, state in states.items():
+            try:
+                old.take_over(chat, state)
+            except Exception:
+                print_exc()
+
+    def _master_stats(self, message, params):
+        message.chat.reply(REGISTRY.render())
+
     def _master_message(self, message):
         if message.sender not in self._config['master']:
             message.chat.error("You are not my master.")
@@ -316,15 +1486,10 @@ class Signalbot(object):
         params = message.text[2:].split(' ')
         command = params[0]
         params = params[1:]
-        if command == "help":
-            self._master_print_help(message)
-        elif command == "enable":
-            self._master_enable(message, params)
-        elif command == "disable":
-            self._master_disable(message, params)
-        elif command == "list-enabled":
-            self._master_list_enabled(message)
-        elif command == "list-available":
-            self._master_list_available(message)
-        else:
+        with self._commands_lock:
+            handler = self._master_commands.get(command, (None,))[0]
+        if handler is None:
             message.chat.error("Invalid command.")
+            return
+        with MASTER_SECONDS.time(command=command):
+            handler(message, params)
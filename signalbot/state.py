@@ -0,0 +1,134 @@
+import sqlite3
+from threading import Lock
+
+
+def _encode_chat_id(chat_id):
+    # Group ids are bytes (or, in old configurations, tuples of ints),
+    # direct chats are phone numbers; prefix group ids so the two can never
+    # collide
+    if isinstance(chat_id, str):
+        return chat_id
+    return 'group:' + bytes(chat_id).hex()
+
+
+def _decode_chat_id(key):
+    if key.startswith('group:'):
+        return bytes.fromhex(key[len('group:'):])
+    return key
+
+
+class EnabledStore(object):
+    """
+    Which plugins are enabled in which chats, kept in an SQLite database so
+    that changes are written incrementally and the chats of a single plugin
+    can be looked up via an index.
+    """
+
+    def __init__(self, path):
+        # The connection is shared between threads and protected by _lock
+        self._lock = Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS enabled ('
+                'chat TEXT NOT NULL, plugin TEXT NOT NULL, '
+                'UNIQUE (chat, plugin))')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS enabled_plugin '
+                'ON enabled (plugin)')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def migrate(self, enabled):
+        """
+        Import a {chat_id: [plugin, ...]} map as formerly stored in the
+        'enabled' section of config.yaml, in a single transaction.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO enabled (chat, plugin) VALUES (?, ?)',
+                [(_encode_chat_id(chat_id), plugin)
+                 for chat_id, plugins in enabled.items()
+                 for plugin in plugins])
+
+    def chats(self, plugin):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT chat FROM enabled WHERE plugin = ? ORDER BY rowid',
+                (plugin,)).fetchall()
+        return [_decode_chat_id(chat) for chat, in rows]
+
+    def plugins(self, chat_id):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT plugin FROM enabled WHERE chat = ? ORDER BY rowid',
+                (_encode_chat_id(chat_id),)).fetchall()
+        return [plugin for plugin, in rows]
+
+    def all_chats(self):
+        """
+        The chats with at least one plugin enabled.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT DISTINCT chat FROM enabled ORDER BY chat').fetchall()
+        return [_decode_chat_id(chat) for chat, in rows]
+
+    def is_enabled(self, chat_id, plugin):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT 1 FROM enabled WHERE chat = ? AND plugin = ?',
+                (_encode_chat_id(chat_id), plugin)).fetchone()
+        return row is not None
+
+    def enable(self, chat_id, plugin):
+        """
+        Returns False if the plugin was already enabled in the chat.
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO enabled (chat, plugin) VALUES (?, ?)',
+                (_encode_chat_id(chat_id), plugin))
+        return cursor.rowcount > 0
+
+    def disable(self, chat_id, plugin):
+        """
+        Returns False if the plugin was not enabled in the chat.
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'DELETE FROM enabled WHERE chat = ? AND plugin = ?',
+                (_encode_chat_id(chat_id), plugin))
+        return cursor.rowcount > 0
+
+    def enable_many(self, pairs):
+        """
+        Enable plugins in chats given as (chat_id, plugin) pairs, in a
+        single transaction. Returns the pairs that were not enabled before.
+        """
+        changed = []
+        with self._lock, self._db:
+            for chat_id, plugin in pairs:
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO enabled (chat, plugin) '
+                    'VALUES (?, ?)', (_encode_chat_id(chat_id), plugin))
+                if cursor.rowcount > 0:
+                    changed.append((chat_id, plugin))
+        return changed
+
+    def disable_many(self, pairs):
+        """
+        Counterpart of enable_many(); returns the pairs that were enabled.
+        """
+        changed = []
+        with self._lock, self._db:
+            for chat_id, plugin in pairs:
+                cursor = self._db.execute(
+                    'DELETE FROM enabled WHERE chat = ? AND plugin = ?',
+                    (_encode_chat_id(chat_id), plugin))
+                if cursor.rowcount > 0:
+                    changed.append((chat_id, plugin))
+        return changed
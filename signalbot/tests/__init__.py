@@ -1,51 +1,66 @@
-from pathlib import Path
-from signalclidbusmock import Mocker
-from subprocess import Popen
-from tempfile import TemporaryDirectory
+from .harness import BotHarness
 import unittest
-import yaml
 
+try:
+    from gi.repository import Gio
+    # Needs dbus-daemon as well
+    Gio.TestDBus
+except (ImportError, AttributeError):
+    Gio = None
 
-class HelloWorldTest(unittest.TestCase):
+
+class BotTestCase(unittest.TestCase):
+    """
+    Runs a bot for each test, after its startup notification has been sent.
+    """
+
+    config = {
+        'master': ['+123'],
+        'plugins': ['pingpong'],
+        'testing_plugins': ['pingponglocktest'],
+        'startup_notification': True,
+    }
+    private_bus = False
 
     def setUp(self):
-        self.tempdir = TemporaryDirectory()
-
-        config = {
-            'master': ['+123'],
-            'plugins': ['pingpong'],
-            'testing_plugins': ['pingponglocktest'],
-            'startup_notification': True,
-        }
-        configfile = Path.joinpath(Path(self.tempdir.name), 'config.yaml')
-        yaml.dump(config, configfile.open('w'))
-
-        self.mocker = Mocker()
-        self.mocker.start()
-
-        self.bot_popen = Popen(
-            ['signal-bot', '--data-dir', self.tempdir.name, '--mocker'])
+        self.harness = BotHarness(
+            self.config, private_bus=self.private_bus).__enter__()
         # Wait for startup notification
-        self.mocker.wait_for_n_messages(n=1)
+        self.wait_for_n_messages(n=1)
 
     def tearDown(self):
-        self.bot_popen.terminate()
-        self.mocker.stop()
-        self.tempdir.cleanup()
+        self.harness.__exit__(None, None, None)
+
+    def messageSignalbot(self, sender, group_id, text, attachmentfiles):
+        self.harness.deliver(sender, group_id, text, attachmentfiles)
+
+    def wait_for_n_messages(self, n=1, timeout=10):
+        # Counts like Mocker.wait_for_n_messages()
+        self.expected = getattr(self, 'expected', 0) + n
+        self.assertTrue(self.harness.wait_for_sent(self.expected, timeout))
 
     def _assert_expected_messages(self, expect_messages):
         self.assertEqual([['Always at your service! ✔', [], ['+123']]] +
                          expect_messages,
-                         [have[1:] for have in self.mocker.fromsignalbot])
+                         [have[1:] for have in self.harness.sent])
+
+
+class HelloWorldTest(BotTestCase):
 
     def test_master(self):
-        self.mocker.messageSignalbot('+000', None, '//enable pingpong', [])
-        self.mocker.messageSignalbot('+000', None, 'ping', [])
-        self.mocker.messageSignalbot('+123', None, '//enable pingpong', [])
-        self.mocker.messageSignalbot('+123', None, 'ping', [])
-        self.mocker.messageSignalbot('+123', None, '//disable pingpong', [])
-        self.mocker.messageSignalbot('+123', None, 'ping', [])
-        self.mocker.wait_for_n_messages(n=5)
+        self.messageSignalbot('+000', None, '//enable pingpong', [])
+        self.wait_for_n_messages(n=1)
+        # Not enabled for +000, so not answered
+        self.messageSignalbot('+000', None, 'ping', [])
+        self.messageSignalbot('+123', None, '//enable pingpong', [])
+        self.wait_for_n_messages(n=1)
+        self.messageSignalbot('+123', None, 'ping', [])
+        self.wait_for_n_messages(n=1)
+        self.messageSignalbot('+123', None, '//disable pingpong', [])
+        self.wait_for_n_messages(n=1)
+        # Not answered either
+        self.messageSignalbot('+123', None, 'ping', [])
+        self.assertTrue(self.harness.wait_until_idle())
         expect_messages = [
             ['You are not my master. ❌', [], ['+000']],
             ['Plugin pingpong enabled. ✔', [], ['+123']],
@@ -54,13 +69,19 @@ class HelloWorldTest(unittest.TestCase):
         self._assert_expected_messages(expect_messages)
 
     def test_locking_basic(self):
-        self.mocker.messageSignalbot('+123', None, '//enable pingponglocktest',
-                                     [])
-        self.mocker.messageSignalbot('+123', None, 'ping', [])
-        self.mocker.messageSignalbot('+123', None, 'backup', [])
-        self.mocker.wait_for_n_messages(n=5)
-        self.mocker.messageSignalbot('+123', None, 'ping', [])
-        self.mocker.wait_for_n_messages(n=3, timeout=10)
+        self.messageSignalbot('+123', None, '//enable pingponglocktest', [])
+        self.messageSignalbot('+123', None, 'ping', [])
+        self.messageSignalbot('+123', None, 'backup', [])
+        # Both handlers sleep; backup then waits for ping to finish
+        self.harness.advance(.3, sleepers=2)
+        self.wait_for_n_messages(n=3)
+        self.harness.advance(.7, sleepers=1)
+        self.wait_for_n_messages(n=2)
+        self.harness.advance(1, sleepers=1)
+        self.wait_for_n_messages(n=1)
+        self.messageSignalbot('+123', None, 'ping', [])
+        self.harness.advance(1, sleepers=1)
+        self.wait_for_n_messages(n=2)
         expect_messages = [
             ['Plugin pingponglocktest enabled. ✔', [], ['+123']],
             ['start pong', [], ['+123']],
@@ -73,12 +94,21 @@ class HelloWorldTest(unittest.TestCase):
         self._assert_expected_messages(expect_messages)
 
     def test_locking_threeblocking(self):
-        self.mocker.messageSignalbot('+123', None, '//enable pingponglocktest',
-                                     [])
-        self.mocker.messageSignalbot('+123', None, 'backup_A', [])
-        self.mocker.messageSignalbot('+123', None, 'backup_B', [])
-        self.mocker.messageSignalbot('+123', None, 'backup_C', [])
-        self.mocker.wait_for_n_messages(n=8, timeout=10)
+        self.messageSignalbot('+123', None, '//enable pingponglocktest', [])
+        self.messageSignalbot('+123', None, 'backup_A', [])
+        self.messageSignalbot('+123', None, 'backup_B', [])
+        self.messageSignalbot('+123', None, 'backup_C', [])
+        # A waits for the lock while B and C are still sleeping, then B
+        # and C fail to get it
+        self.harness.advance(.3, sleepers=3)
+        self.wait_for_n_messages(n=2)
+        self.harness.advance(.3, sleepers=2)
+        self.wait_for_n_messages(n=2)
+        # Past .9 despite rounding
+        self.harness.advance(.4, sleepers=1)
+        self.wait_for_n_messages(n=3)
+        self.harness.advance(1, sleepers=1)
+        self.wait_for_n_messages(n=1)
         expect_messages = [
             ['Plugin pingponglocktest enabled. ✔', [], ['+123']],
             ['backup_A: Attempting to acquire exclusive lock...',
@@ -94,3 +124,31 @@ class HelloWorldTest(unittest.TestCase):
             ['backup_A: ... done sleeping / locking', [], ['+123']],
         ]
         self._assert_expected_messages(expect_messages)
+
+
+@unittest.skipIf(Gio is None, "PyGObject is not installed")
+class PrivateBusTest(HelloWorldTest):
+    """
+    The same through signalclidbusmock on a D-Bus daemon of the test's own.
+    """
+
+    private_bus = True
+
+
+class CoalesceTest(BotTestCase):
+
+    config = dict(BotTestCase.config, reply_coalesce_window=.5)
+
+    def test_coalesce(self):
+        self.messageSignalbot('+123', None, '//enable pingponglocktest', [])
+        self.messageSignalbot('+123', None, 'ping', [])
+        # The outbox waits with the first two replies while ping sleeps
+        self.harness.advance(.5, sleepers=2)
+        self.wait_for_n_messages(n=1, timeout=5)
+        self.harness.advance(.5, sleepers=1)
+        self.harness.advance(.5, sleepers=1)
+        self.wait_for_n_messages(n=1, timeout=5)
+        expect_messages = [
+            ['Plugin pingponglocktest enabled. ✔\nstart pong', [], ['+123']],
+            ['pong', [], ['+123']]]
+        self._assert_expected_messages(expect_messages)
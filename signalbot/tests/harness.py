@@ -0,0 +1,142 @@
+from os import chdir, getcwd
+from pathlib import Path
+from signalbot import Signalbot
+from signalbot.clock import VirtualClock
+from signalbot.transports import LoopbackTransport
+from tempfile import TemporaryDirectory
+import time
+import yaml
+
+
+class BotHarness(object):
+    """
+    Runs a Signalbot with the given config in the test's own process, with
+    a VirtualClock unless given another `clock`. The virtual time only moves
+    on by advance().
+
+    Messages go through `transport`, a new LoopbackTransport by default,
+    or, with `private_bus`, through signalclidbusmock on a D-Bus daemon of
+    its own, so that test processes running in parallel do not see each
+    other's messages. `prepare` is called with the data directory before
+    the bot starts, e.g. to put state in place.
+    """
+
+    def __init__(self, config, clock=None, private_bus=False,
+                 transport=None, prepare=None):
+        self.config = dict(config)
+        self.clock = VirtualClock() if clock is None else clock
+        self._private_bus = private_bus
+        self.transport = transport
+        self._prepare = prepare
+
+    def __enter__(self):
+        self._cwd = getcwd()
+        self._tempdir = TemporaryDirectory()
+
+        if self._private_bus:
+            # Only needed for D-Bus, so do not require them otherwise
+            from gi.repository import Gio
+            from signalclidbusmock import Mocker
+            self._test_bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+            self._test_bus.up()
+            address = self._test_bus.get_bus_address()
+            self.mocker = Mocker(bus=address, clock=self.clock)
+            self.mocker.start()
+            self.config['bus'] = address
+        elif self.transport is None:
+            self.transport = LoopbackTransport(clock=self.clock.time)
+
+        configfile = Path.joinpath(Path(self._tempdir.name), 'config.yaml')
+        with configfile.open('w') as f:
+            yaml.dump(self.config, f)
+
+        try:
+            if self._prepare is not None:
+                self._prepare(Path(self._tempdir.name))
+            self._start()
+        except BaseException:
+            self._cleanup()
+            raise
+        return self
+
+    def _start(self):
+        self.bot = Signalbot(data_dir=self._tempdir.name,
+                             mocker=self._private_bus,
+                             transport=self.transport, clock=self.clock)
+        self.bot.__enter__()
+
+    def restart(self, downtime=0):
+        """
+        Stop the bot and start a new one with the same data directory,
+        advancing the clock by `downtime` in between.
+        """
+        self.bot.__exit__(None, None, None)
+        self.clock.advance(downtime)
+        self._start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.bot.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._cleanup()
+
+    def _cleanup(self):
+        if self._private_bus:
+            self.mocker.stop()
+            self._test_bus.down()
+        # Signalbot leaves its (deleted) fake working directory behind
+        chdir(self._cwd)
+        self._tempdir.cleanup()
+
+    def deliver(self, sender, group_id, text, attachmentfiles=[]):
+        if self._private_bus:
+            self.mocker.messageSignalbot(sender, group_id, text,
+                                         attachmentfiles)
+        else:
+            self.transport.deliver(sender, group_id, text, attachmentfiles)
+
+    @property
+    def sent(self):
+        """
+        Everything the bot has sent so far, as
+        [time, text, attachments, recipients or group_id].
+        """
+        if self._private_bus:
+            return self.mocker.fromsignalbot
+        return self.transport.sent
+
+    def wait_for_sent(self, n, timeout=10):
+        """
+        Wait until at least n messages have been sent in total.
+        """
+        if self._private_bus:
+            return self.mocker._wait_until_n_messages(n=n, timeout=timeout)
+        return self.transport.wait_for_sent(n, timeout)
+
+    def advance(self, seconds, sleepers=0, timeout=10):
+        """
+        Advance the clock by `seconds` once `sleepers` threads besides the
+        scheduler's sleep or wait on it, e.g. plugins in PluginChat.sleep()
+        or the outbox waiting for its coalesce window to pass.
+        """
+        if not self.clock.wait_for_sleepers(sleepers + 1, timeout):
+            raise TimeoutError(
+                "Fewer than {} threads sleeping".format(sleepers))
+        self.clock.advance(seconds)
+
+    def wait_until_idle(self, timeout=10):
+        """
+        Wait until the bot has handled all messages delivered so far and
+        sent all replies, as far as they do not wait for the clock. Plugins
+        running in worker processes are not waited for.
+        """
+        bot = self.bot
+        # Upstream first, since work is handed on before it is done
+        parts = [bot._ingress, bot._workers, bot._priority_workers,
+                 bot._broadcaster, bot._outbox]
+        deadline = time.monotonic() + timeout
+        while not all(part.idle for part in parts):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(.001)
+        return True
@@ -0,0 +1,22 @@
+from hashlib import sha256
+from signalbot.plugins import PluginChat
+from signalbot.triggers import Prefix
+
+
+class BenchCPUChat(PluginChat):
+    """
+    Benchmark plugin standing in for CPU bound plugins: "bench <id> <n>"
+    hashes <n> times (holding the GIL) and replies "bench <id>".
+    """
+
+    triggers = [Prefix('bench ')]
+
+    def triagemessage(self, message):
+        _, message_id, rounds = message.text.split(' ')
+        digest = message_id.encode()
+        for _ in range(int(rounds)):
+            digest = sha256(digest).digest()
+        self.reply('bench {}'.format(message_id))
+
+
+__plugin_chat__ = BenchCPUChat
@@ -0,0 +1,20 @@
+from signalbot.plugins import PluginChat
+from signalbot.triggers import Prefix
+from time import sleep
+
+
+class BenchSleepChat(PluginChat):
+    """
+    Benchmark plugin standing in for I/O bound plugins: "bench <id> <ms>"
+    sleeps for <ms> milliseconds and replies "bench <id>".
+    """
+
+    triggers = [Prefix('bench ')]
+
+    def triagemessage(self, message):
+        _, message_id, milliseconds = message.text.split(' ')
+        sleep(int(milliseconds) / 1000)
+        self.reply('bench {}'.format(message_id))
+
+
+__plugin_chat__ = BenchSleepChat
@@ -0,0 +1,16 @@
+from signalbot.plugins import PluginChat
+
+
+class GroupTestChat(PluginChat):
+
+    def triagemessage(self, message):
+        if message.text == 'name':
+            # Waits for the bot when running in a worker process
+            self.reply(self.chat.name)
+        elif message.text == 'pin':
+            path = self.attachments.put(b'pinned', '.txt')
+            self.attachments.pin([path])
+            self.reply('pinned {}'.format(path.name))
+
+
+__plugin_chat__ = GroupTestChat
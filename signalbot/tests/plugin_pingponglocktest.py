@@ -1,5 +1,4 @@
 from signalbot.plugins import PluginChat, IsolationException
-from time import sleep
 
 
 class PingPongLockTestChat(PluginChat):
@@ -8,18 +7,18 @@ class PingPongLockTestChat(PluginChat):
 
         if message.text in ['backup_A', 'backup_B', 'backup_C']:
             if message.text == 'backup_A':
-                sleep(.3)
+                self.sleep(.3)
             elif message.text == 'backup_B':
-                sleep(.6)
+                self.sleep(.6)
             elif message.text == 'backup_C':
-                sleep(.9)
+                self.sleep(.9)
             self.reply("{}: Attempting to acquire exclusive lock...".format(
                 message.text))
             if message.text in ['backup_A', 'backup_B']:
                 with self.isolated_thread:
                     self.reply("{}: Locked - sleeping 1 sec ...".format(
                         message.text))
-                    sleep(1)
+                    self.sleep(1)
                     self.reply("{}: ... done sleeping / locking".format(
                         message.text))
             elif message.text == 'backup_C':
@@ -27,7 +26,7 @@ class PingPongLockTestChat(PluginChat):
                     with self.isolated_thread:
                         self.reply("{}: Locked - sleeping 1 sec ...".format(
                             message.text))
-                        sleep(1)
+                        self.sleep(1)
                         self.reply("{}: ... done sleeping / locking".format(
                             message.text))
                 except IsolationException:
@@ -36,16 +35,16 @@ class PingPongLockTestChat(PluginChat):
             return
 
         elif message.text == 'backup':
-            sleep(.3)
+            self.sleep(.3)
             self.reply("Acquiring lock...")
             with self.isolated_thread:
                 self.reply("Locked - sleeping 1 sec ...")
-                sleep(1)
+                self.sleep(1)
                 self.reply("... done sleeping / locking")
             return
 
         self.reply('start pong')
-        sleep(1)
+        self.sleep(1)
         self.reply('pong')
 
 
@@ -0,0 +1,41 @@
+from signalbot.plugins import PluginChat
+
+
+# importlib.reload() keeps the module's globals, so this counts the imports
+generation = globals().get('generation', 0) + 1
+# The generation failing to take over chats, to test rolling back a reload
+fail_take_over = globals().get('fail_take_over')
+
+
+class ReloadTestChat(PluginChat):
+
+    generation = generation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count = 0
+
+    def save_state(self):
+        return self.count
+
+    def restore_state(self, state):
+        if self.generation == fail_take_over:
+            raise RuntimeError('Cannot take over')
+        self.count = state
+
+    def triagemessage(self, message):
+        if message.text == 'slow':
+            self.sleep(1)
+        self.count += 1
+        self.reply('{} {} {}'.format(
+            message.text, self.generation, self.count))
+
+
+def generation_command(plugin_router, message, params):
+    message.chat.reply('generation {}'.format(generation))
+
+
+__plugin_chat__ = ReloadTestChat
+__plugin_master_commands__ = {
+    'generation': (generation_command, '//generation'),
+}
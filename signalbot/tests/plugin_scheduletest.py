@@ -0,0 +1,26 @@
+from signalbot.plugins import PluginChat
+from signalbot.triggers import Prefix
+
+
+class ScheduleTestChat(PluginChat):
+
+    triggers = [Prefix('remind '), Prefix('every '), Prefix('cancel ')]
+
+    def triagemessage(self, message):
+        command, _, param = message.text.partition(' ')
+        if command == 'remind':
+            delay, _, text = param.partition(' ')
+            self.schedule(self.remind, delay=float(delay), args=[text])
+        elif command == 'every':
+            interval, _, name = param.partition(' ')
+            self.schedule('remind', delay=float(interval),
+                          every=float(interval), args=[name], name=name)
+        elif command == 'cancel':
+            self.cancel(param)
+            self.reply('cancelled {}'.format(param))
+
+    def remind(self, text):
+        self.reply(text)
+
+
+__plugin_chat__ = ScheduleTestChat
@@ -0,0 +1,17 @@
+from signalbot.plugins import PluginChat
+import time
+
+
+class StoreTestChat(PluginChat):
+
+    def triagemessage(self, message):
+        command, _, value = message.text.partition(' ')
+        if command == 'remember':
+            # In real time, so that the bot is stopped meanwhile
+            time.sleep(.2)
+            self.store['value'] = value
+        elif command == 'recall':
+            self.reply(self.store.get('value', 'nothing'))
+
+
+__plugin_chat__ = StoreTestChat
@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+from signalbot.attachments import AttachmentStore
+from tempfile import TemporaryDirectory
+import unittest
+
+
+class AttachmentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.path = Path.joinpath(Path(self.tempdir.name), 'attachments')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_deduplicate(self):
+        store = AttachmentStore(self.path)
+        path = store.put(b'report', suffix='.txt')
+        self.assertEqual('.txt', path.suffix)
+        self.assertEqual(path, store.put(b'report', suffix='.txt'))
+
+        original = Path.joinpath(Path(self.tempdir.name), 'report.txt')
+        original.write_bytes(b'report')
+        self.assertEqual(path, store.put_file(original))
+        self.assertEqual(path, store.put_file(path))
+        self.assertEqual(1, len(list(self.path.glob('*/*'))))
+
+    def test_open(self):
+        store = AttachmentStore(self.path)
+        incoming = Path.joinpath(Path(self.tempdir.name), 'incoming')
+        incoming.write_bytes(b'0123456789')
+        view = store.open(incoming)
+        self.assertEqual(b'234', view[2:5])
+        view.close()
+
+        incoming.write_bytes(b'')
+        self.assertEqual(b'', store.open(incoming))
+
+    def test_quota(self):
+        store = AttachmentStore(self.path, quota=35, grace=0)
+        paths = []
+        for i in range(3):
+            paths.append(store.put(bytes([i]) * 10))
+            # Make sure the files are ordered by their modification time
+            os.utime(str(paths[-1]), (i, i))
+        store.pin([paths[0]])
+        paths.append(store.put(b'x' * 10))
+
+        # The oldest file is still queued, so the second oldest one goes
+        self.assertEqual([True, False, True, True],
+                         [path.exists() for path in paths])
+
+        store.unpin([paths[0]])
+        store.put(b'y' * 10)
+        self.assertFalse(paths[0].exists())
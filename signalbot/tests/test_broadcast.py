@@ -0,0 +1,47 @@
+from .harness import BotHarness
+from signalbot.transports import LoopbackTransport
+import unittest
+
+
+class FailingTransport(LoopbackTransport):
+
+    def send_message(self, text, attachments, recipients):
+        if '+666' in recipients:
+            raise ValueError('Unregistered user')
+        super().send_message(text, attachments, recipients)
+
+
+class BroadcastTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123', '+456'],
+        'startup_notification': True,
+        'broadcast_batch_size': 2,
+    }
+
+    def setUp(self):
+        self.transport = FailingTransport()
+        self.harness = BotHarness(self.config, transport=self.transport)
+
+    def test_broadcast(self):
+        with self.harness as harness:
+            bot = harness.bot
+            # One call for both masters
+            self.assertEqual(
+                [['Always at your service! ✔', [], ['+123', '+456']]],
+                [sent[1:] for sent in self.transport.sent])
+            del self.transport.sent[:]
+
+            failures = bot.broadcast(
+                'Hi', [], ['+1', '+2', '+3', '+666', b'\x01', b'\x01',
+                           '+1']).result(10)
+        self.assertEqual(['+3', '+666'], sorted(failures))
+        self.assertIsInstance(failures['+666'], ValueError)
+        self.assertCountEqual(
+            [['Hi', [], ['+1', '+2']], ['Hi', [], b'\x01']],
+            [sent[1:] for sent in self.transport.sent])
+
+    def test_nothing(self):
+        with self.harness as harness:
+            self.assertEqual(
+                {}, harness.bot.broadcast('Hi', [], []).result(10))
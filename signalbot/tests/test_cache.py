@@ -0,0 +1,127 @@
+from pathlib import Path
+from signalbot.cache import Cache, cached
+from signalbot.clock import VirtualClock
+from signalbot.plugins import PluginChat, PluginRouter
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+import unittest
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.computed = []
+
+    def _compute(self, value):
+        def compute():
+            self.computed.append(value)
+            return value * 2
+        return compute
+
+    def test_ttl_and_lru(self):
+        cache = Cache(maxsize=2, ttl=10, clock=self.clock)
+        self.assertEqual(2, cache.get(1, self._compute(1)))
+        self.assertEqual(4, cache.get(2, self._compute(2)))
+        self.assertEqual(2, cache.get(1, self._compute(1)))
+        # Evicts 2, the least recently used
+        self.assertEqual(6, cache.get(3, self._compute(3)))
+        self.assertEqual(4, cache.get(2, self._compute(2)))
+        self.assertEqual([1, 2, 3, 2], self.computed)
+
+        self.clock.advance(10)
+        self.assertEqual(4, cache.get(2, self._compute(2)))
+        self.assertEqual([1, 2, 3, 2, 2], self.computed)
+        self.assertEqual({'hits': 1, 'misses': 5, 'evictions': 3,
+                          'size': 2}, cache.stats)
+
+    def test_single_flight(self):
+        cache = Cache(clock=self.clock)
+        started, release = Event(), Event()
+        results = []
+
+        def slow():
+            started.set()
+            release.wait(5)
+            self.computed.append('slow')
+            return 'value'
+
+        def lookup():
+            results.append(cache.get('key', slow))
+
+        threads = [Thread(target=lookup) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['value'] * 5, results)
+        self.assertEqual(['slow'], self.computed)
+        self.assertEqual(4, cache.hits)
+
+    def test_exceptions_are_not_cached(self):
+        cache = Cache(clock=self.clock)
+
+        def fail():
+            raise ValueError()
+
+        self.assertRaises(ValueError, cache.get, 'key', fail)
+        self.assertEqual(2, cache.get('key', self._compute(1)))
+
+
+class FakeChat(object):
+
+    clock = VirtualClock()
+
+    def __init__(self, id):
+        self.id = id
+
+    def __str__(self):
+        return self.id
+
+
+class CachedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        computed = self.computed = []
+
+        class CachingChat(PluginChat):
+
+            @cached()
+            def shared(self, text, suffix=''):
+                computed.append(('shared', text))
+                return text.upper() + suffix
+
+            @cached(per_chat=True)
+            def own(self, text):
+                computed.append((str(self.chat), text))
+                return text.upper()
+
+            def triagemessage(self, message):
+                pass
+
+        self.router = PluginRouter(data_dir=Path(self.tempdir.name),
+                                   chat_class=CachingChat, name='caching')
+        self.chats = []
+        for chat_id in ['+1', '+2']:
+            chat = FakeChat(chat_id)
+            self.router.enable(chat)
+            self.chats.append(self.router._chats[chat_id])
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_scopes(self):
+        for chat in self.chats:
+            self.assertEqual('PING', chat.shared('ping'))
+            self.assertEqual('PING!', chat.shared('ping', suffix='!'))
+            self.assertEqual('PING', chat.own('ping'))
+            self.assertEqual('PING', chat.own('ping'))
+        self.assertEqual([('shared', 'ping'), ('shared', 'ping'),
+                          ('+1', 'ping'), ('+2', 'ping')], self.computed)
+        self.assertIs(self.router.cache('shared'),
+                      self.chats[1].cache('shared'))
+        self.assertEqual(2, self.router.cache('shared').hits)
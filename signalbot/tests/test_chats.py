@@ -0,0 +1,123 @@
+from pathlib import Path
+from signalbot.clock import VirtualClock
+from signalbot.plugins import PluginChat, PluginRouter
+from signalbot.signalbot import Chat, Chats
+from tempfile import TemporaryDirectory
+from threading import Thread
+import unittest
+
+
+class CountingChat(PluginChat):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count = 0
+
+    def save_state(self):
+        return self.count
+
+    def restore_state(self, state):
+        self.count = state
+
+    def triagemessage(self, message):
+        pass
+
+
+class ChatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.clock = VirtualClock()
+        self.router = PluginRouter(data_dir=Path(self.tempdir.name),
+                                   chat_class=CountingChat, name='counting')
+        # Chat ids with the plugin enabled, like the state database
+        self.enabled = {'+1', '+2', '+3'}
+        self.restored = []
+        self.lock_held = []
+
+    def tearDown(self):
+        self.router.close()
+        self.tempdir.cleanup()
+
+    def _chats(self, **kwargs):
+        self.chats = Chats(bot=None, restore=self._restore, clock=self.clock,
+                           **kwargs)
+        return self.chats
+
+    def _restore(self, chat_id):
+        # Whether another thread could take the lock meanwhile
+        def try_lock():
+            if self.chats._lock.acquire(timeout=1):
+                self.chats._lock.release()
+                self.lock_held.append(False)
+            else:
+                self.lock_held.append(True)
+        thread = Thread(target=try_lock)
+        thread.start()
+        thread.join()
+
+        self.restored.append(chat_id)
+        if chat_id not in self.enabled:
+            return None
+        chat = Chat(None, chat_id)
+        chat.enable_plugin('counting', self.router)
+        return chat
+
+    def _plugin_chat(self, chat_id):
+        return self.router._chats.get(chat_id)
+
+    def test_lru(self):
+        chats = self._chats(max_resident=2)
+        chats.get('+1')
+        self._plugin_chat('+1').count = 5
+        chats.get('+2')
+        chats.get('+1')
+        chats.get('+3')
+        # +2 was the least recently used
+        self.assertEqual({'+1', '+3'}, set(chats))
+        self.assertIsNone(self._plugin_chat('+2'))
+
+        # A chat without plugins is not kept
+        self.assertIsNone(chats.get('+4'))
+        self.assertEqual({'+1', '+3'}, set(chats))
+
+        chats.get('+2')
+        chats.get('+3')
+        self.assertEqual({'+2', '+3'}, set(chats))
+        # The state is saved on eviction and restored with the chat
+        self.assertEqual(5, chats.get('+1') and self._plugin_chat('+1').count)
+        self.assertEqual(['+1', '+2', '+3', '+4', '+2', '+1'], self.restored)
+        self.assertEqual([False] * 6, self.lock_held)
+
+    def test_busy(self):
+        chats = self._chats(max_resident=1)
+        chats.get('+1')
+        self._plugin_chat('+1')._busy = 1
+        chats.get('+2')
+        # +1 cannot be evicted while busy, so +2 goes next time
+        self.assertEqual({'+2'}, set(chats) - {'+1'})
+        self._plugin_chat('+1')._busy = 0
+        chats.get('+3')
+        self.assertEqual({'+3'}, set(chats))
+
+    def test_idle_timeout(self):
+        chats = self._chats(idle_timeout=10)
+        chats.get('+1')
+        self.clock.advance(5)
+        chats.get('+2')
+        self.clock.advance(6)
+        chats.get('+3')
+        self.assertEqual({'+2', '+3'}, set(chats))
+
+    def test_evicted_chat_comes_back(self):
+        chats = self._chats(max_resident=1)
+        chat = chats.get('+1')
+        self._plugin_chat('+1').count = 3
+        chats.get('+2')
+        self.assertNotIn('+1', chats)
+        # Work still on its way to the evicted instance is refused, and the
+        # chat is rebuilt for it
+        self.assertFalse(chat.run('counting', 'triagemessage', [None]))
+        chat = chats.get('+1')
+        self.assertIsNot(chat, None)
+        self.assertEqual(3, self._plugin_chat('+1').count)
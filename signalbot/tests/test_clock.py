@@ -0,0 +1,66 @@
+from signalbot.clock import VirtualClock
+from threading import Condition, Thread
+import time
+import unittest
+
+
+class VirtualClockTest(unittest.TestCase):
+
+    def test_sleep(self):
+        clock = VirtualClock(start=100.)
+        woken = []
+        thread = Thread(target=lambda: woken.append(clock.sleep(3600)))
+        thread.start()
+        self.assertTrue(clock.wait_for_sleepers(1))
+        clock.advance(3599)
+        time.sleep(.01)
+        self.assertEqual([], woken)
+        clock.advance(1)
+        thread.join()
+        self.assertEqual([None], woken)
+        self.assertEqual(3700., clock.time())
+
+    def test_sleepers_wake_in_order(self):
+        clock = VirtualClock()
+        woken = []
+
+        def sleeper(seconds):
+            clock.sleep(seconds)
+            woken.append((seconds, clock.time()))
+        threads = [Thread(target=sleeper, args=[seconds])
+                   for seconds in [3, 1, 2]]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(clock.wait_for_sleepers(3))
+        for i in range(3):
+            clock.advance(1)
+            # Before advancing again
+            while len(woken) <= i:
+                time.sleep(.001)
+        for thread in threads:
+            thread.join()
+        self.assertEqual([(1, 1.), (2, 2.), (3, 3.)], woken)
+
+    def test_no_sleepers(self):
+        clock = VirtualClock()
+        self.assertFalse(clock.wait_for_sleepers(1, timeout=.01))
+        clock.advance(5)
+        self.assertEqual(5., clock.time())
+
+    def test_advance(self):
+        clock = VirtualClock()
+        condition = Condition()
+        results = []
+
+        def waiter():
+            with condition:
+                results.append(clock.wait(condition, 5))
+        thread = Thread(target=waiter)
+        thread.start()
+        clock.advance(4)
+        time.sleep(.05)
+        self.assertEqual([], results)
+        clock.advance(1)
+        thread.join()
+        # Timed out
+        self.assertEqual([False], results)
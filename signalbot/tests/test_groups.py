@@ -0,0 +1,58 @@
+from signalbot.clock import VirtualClock
+from signalbot.groups import GroupCache
+from signalbot.signalbot import Chat
+from signalbot.tests.harness import BotHarness
+import unittest
+
+
+class GroupCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.fetched = []
+        self.names = {b'\x01': 'one', b'\x02': 'two', b'\x03': 'three'}
+        self.cache = GroupCache(fetch=self._fetch, ttl=10, clock=self.clock,
+                                batch_size=2)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def _fetch(self, group_ids):
+        self.fetched.append(group_ids)
+        return {group_id: (self.names[group_id], ['+000'])
+                for group_id in group_ids}
+
+    def test_refresh(self):
+        self.assertEqual(('one', ('+000',)), self.cache.get(b'\x01'))
+        self.assertEqual(('one', ('+000',)), self.cache.get([1]))
+        self.assertEqual([[b'\x01']], self.fetched)
+
+        # Expired entries are returned while being refreshed
+        self.names[b'\x01'] = 'renamed'
+        self.clock.advance(10)
+        self.assertEqual('one', self.cache.get(b'\x01')[0])
+        # Wait for the refresh, which runs before anything submitted later
+        self.cache._refresher.submit(lambda: None).result(5)
+        self.assertEqual('renamed', self.cache.get(b'\x01')[0])
+        self.assertEqual([[b'\x01'], [b'\x01']], self.fetched)
+
+    def test_warm_up(self):
+        self.cache.get(b'\x01')
+        self.cache.warm_up([b'\x01', b'\x02', b'\x03']).result(5)
+        self.assertEqual([[b'\x01'], [b'\x02', b'\x03']], self.fetched)
+        self.assertEqual('three', self.cache.get(b'\x03')[0])
+        self.assertEqual(2, len(self.fetched))
+
+
+class ChatTest(unittest.TestCase):
+
+    def test_name_and_members(self):
+        with BotHarness({'master': ['+123']}) as harness:
+            harness.transport.groups[b'\x01\x02'] = 'Test'
+            harness.transport.members[b'\x01\x02'] = ['+123', '+000']
+            chat = Chat(harness.bot, b'\x01\x02')
+            self.assertEqual('Test', chat.name)
+            self.assertEqual(['+123', '+000'], chat.members)
+            chat = Chat(harness.bot, '+000')
+            self.assertEqual('+000', chat.name)
+            self.assertEqual(['+000'], chat.members)
@@ -0,0 +1,150 @@
+from signalbot.plugins import FairIsolationLock, IsolationException
+from threading import Event, Lock, Thread
+import time
+import unittest
+
+
+class FairIsolationLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.events_lock = Lock()
+
+    def _log(self, event):
+        with self.events_lock:
+            self.events.append(event)
+
+    def _wait_until(self, predicate, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(.001)
+
+    def _logged(self, event):
+        self._wait_until(lambda: event in self.events)
+
+    def _waiting(self, lock, n):
+        # Threads asking for exclusive access
+        self._wait_until(lambda: len(lock._waiting) == n)
+
+    def _start(self, lock, target, *args):
+        # Like PluginChat._thread_start
+        def run():
+            with lock.threadcounter:
+                target(*args)
+        thread = Thread(target=run)
+        thread.start()
+        return thread
+
+    def _isolated(self, lock, name, release=None):
+        try:
+            with lock:
+                self._log(name + ' locked')
+                if release is not None:
+                    release.wait()
+                self._log(name + ' unlocked')
+        except IsolationException:
+            self._log(name + ' failed')
+
+    def _task(self, name, release=None):
+        self._log(name + ' started')
+        if release is not None:
+            release.wait()
+        self._log(name + ' done')
+
+    def test_waits_for_running_tasks(self):
+        lock = FairIsolationLock(timeout=5)
+        release = Event()
+        threads = [self._start(lock, self._task, 'task', release)]
+        self._logged('task started')
+        threads.append(self._start(lock, self._isolated, lock, 'A'))
+        self._waiting(lock, 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['task started', 'task done', 'A locked',
+                          'A unlocked'], self.events)
+
+    def test_fifo(self):
+        lock = FairIsolationLock(timeout=5)
+        release = Event()
+        asks = {name: Event() for name in 'ABC'}
+
+        def isolated(name):
+            asks[name].wait()
+            self._isolated(lock, name, release if name == 'A' else None)
+        # All running, so that they queue up for the lock in turn
+        threads = [self._start(lock, isolated, name) for name in 'ABC']
+        self._wait_until(lambda: lock._running == 3)
+        for n, name in enumerate('AB', 1):
+            asks[name].set()
+            self._waiting(lock, n)
+        # A gets the lock once C waits as well
+        asks['C'].set()
+        self._logged('A locked')
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['A locked', 'A unlocked', 'B locked', 'B unlocked',
+                          'C locked', 'C unlocked'], self.events)
+
+    def test_new_tasks_wait(self):
+        lock = FairIsolationLock(timeout=5)
+        release = Event()
+        threads = [self._start(lock, self._task, 'first', release)]
+        self._logged('first started')
+        threads.append(self._start(lock, self._isolated, lock, 'A'))
+        self._waiting(lock, 1)
+        # Has to wait for A although the first task is still running
+        threads.append(self._start(lock, self._task, 'second'))
+        # Give it the chance to start too early
+        time.sleep(.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['first started', 'first done', 'A locked',
+                          'A unlocked', 'second started', 'second done'],
+                         self.events)
+
+    def test_timeout(self):
+        lock = FairIsolationLock(timeout=.1)
+        release = Event()
+        threads = [self._start(lock, self._task, 'task', release)]
+        self._logged('task started')
+        threads.append(self._start(lock, self._isolated, lock, 'A'))
+        self._logged('A failed')
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['task started', 'A failed', 'task done'],
+                         self.events)
+
+    def test_timeout_while_locked(self):
+        lock = FairIsolationLock(timeout=.1)
+        release = Event()
+
+        def later():
+            self._waiting(lock, 1)
+            self._isolated(lock, 'B')
+        # Both are running when they ask for the lock, A gets it once B
+        # waits as well
+        threads = [self._start(lock, later),
+                   self._start(lock, self._isolated, lock, 'A', release)]
+        # B gives up while A still has the lock, but only fails once A is
+        # done, since A relies on no other task running
+        self._logged('A locked')
+        self._waiting(lock, 0)
+        self.assertNotIn('B failed', self.events)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['A locked', 'A unlocked', 'B failed'], self.events)
+
+    def test_not_reentrant(self):
+        lock = FairIsolationLock()
+
+        def nested():
+            with lock:
+                self._isolated(lock, 'inner')
+        self._start(lock, nested).join()
+        self.assertEqual(['inner failed'], self.events)
@@ -0,0 +1,120 @@
+from .harness import BotHarness
+from pathlib import Path
+from signalbot.kvstore import KVStore, migrate_chat_dirs
+from tempfile import TemporaryDirectory
+import sqlite3
+from threading import RLock, Thread
+import unittest
+
+
+class KVStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.path = Path.joinpath(Path(self.tempdir.name), 'store.db')
+        # Only flush when asked to
+        self.kvstore = KVStore(self.path, flush_interval=60)
+
+    def tearDown(self):
+        self.kvstore.close()
+        self.tempdir.cleanup()
+
+    def _reopen(self):
+        self.kvstore.close()
+        self.kvstore = KVStore(self.path, flush_interval=60)
+
+    def test_chats(self):
+        direct = self.kvstore.chat('+123')
+        group = self.kvstore.chat(b'\x01\x02')
+        direct['count'] = 1
+        group['count'] = {'a': [1, 2]}
+        del direct['count']
+        direct['name'] = 'direct'
+        self.assertNotIn('count', direct)
+        self.assertEqual({'a': [1, 2]}, group['count'])
+        self._reopen()
+
+        direct = self.kvstore.chat('+123')
+        group = self.kvstore.chat(b'\x01\x02')
+        self.assertEqual([('name', 'direct')], direct.items())
+        self.assertEqual(['count'], group.keys())
+        self.assertEqual(None, direct.get('count'))
+        with self.assertRaises(KeyError):
+            direct['count']
+
+    def _committed(self):
+        db = sqlite3.connect(str(self.path))
+        try:
+            return db.execute('SELECT chat, key FROM kv').fetchall()
+        finally:
+            db.close()
+
+    def test_write_behind(self):
+        store = self.kvstore.chat('+123')
+        store['key'] = 'value'
+        self.assertEqual([], self._committed())
+        self.kvstore.flush()
+        self.assertEqual([('+123', 'key')], self._committed())
+
+    def test_copies(self):
+        store = self.kvstore.chat('+123')
+        value = [1]
+        store['list'] = value
+        value.append(2)
+        self.assertEqual([1], store['list'])
+
+    def test_transaction(self):
+        lock = RLock()
+        store = self.kvstore.chat('+123', lock)
+        store['a'] = 1
+
+        with store.transaction() as transaction:
+            locked = []
+            thread = Thread(target=lambda: locked.append(lock.acquire(False)))
+            thread.start()
+            thread.join()
+            self.assertEqual([False], locked)
+            transaction['a'] = transaction['a'] + 1
+            transaction['b'] = 1
+            # Not applied yet
+            self.assertNotIn('b', store)
+            self.assertEqual(['a', 'b'], transaction.keys())
+        self.assertEqual([('a', 2), ('b', 1)], store.items())
+
+        with self.assertRaises(ValueError):
+            with store.transaction() as transaction:
+                transaction['a'] = 3
+                del transaction['b']
+                raise ValueError()
+        self.assertEqual([('a', 2), ('b', 1)], store.items())
+
+    def test_migrate(self):
+        chats_dir = Path.joinpath(Path(self.tempdir.name), 'chats')
+        for name in ['+123', str((1, 2))]:
+            chat_dir = Path.joinpath(chats_dir, name, 'sub')
+            Path.mkdir(chat_dir, parents=True)
+            Path.joinpath(chat_dir, 'file').write_bytes(name.encode())
+
+        self.assertEqual(2, migrate_chat_dirs(self.kvstore, chats_dir,
+                                              remove=True))
+        self.assertEqual(b'+123', self.kvstore.chat('+123')['sub/file'])
+        self.assertEqual(b'(1, 2)',
+                         self.kvstore.chat(b'\x01\x02')['sub/file'])
+        self.assertEqual([], list(chats_dir.iterdir()))
+
+
+class BotStoreTest(unittest.TestCase):
+
+    def test_written_while_stopping(self):
+        config = {
+            'master': ['+123'],
+            'testing_plugins': ['storetest'],
+            'enabled': {'+000': ['storetest']},
+        }
+        with BotHarness(config) as harness:
+            harness.deliver('+000', None, 'remember this')
+            # Handlers still running finish before the stores are closed
+            harness.restart()
+            harness.deliver('+000', None, 'recall')
+            self.assertTrue(harness.wait_for_sent(1))
+        self.assertEqual('this', harness.sent[0][1])
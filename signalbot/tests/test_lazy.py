@@ -0,0 +1,69 @@
+from signalbot.tests.harness import BotHarness
+import unittest
+
+
+class LazyPluginTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123'],
+        'plugins': ['pingpong'],
+        'lazy_plugins': True,
+        # Migrated into the state database at startup
+        'enabled': {'+000': ['pingpong']},
+    }
+
+    def _startup_report(self, harness):
+        n = len(harness.sent)
+        harness.deliver('+123', None, '//startup')
+        self.assertTrue(harness.wait_for_sent(n + 1))
+        return harness.sent[n][1]
+
+    def test_load_on_first_match(self):
+        with BotHarness(self.config) as harness:
+            plugin_router = harness.bot._plugin_routers['pingpong']
+            self.assertIsNone(plugin_router.loaded)
+            report = self._startup_report(harness)
+            self.assertNotIn('import pingpong', report)
+            self.assertNotIn('After startup', report)
+
+            # Chats without the plugin do not load it
+            harness.deliver('+456', None, 'ping')
+            harness.deliver('+000', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(2))
+            self.assertEqual(['+000'], harness.sent[1][3])
+            self.assertEqual('pong', harness.sent[1][1])
+            self.assertIsNotNone(plugin_router.loaded)
+
+            report = self._startup_report(harness)
+            total, later = report.split('After startup:\n')
+            self.assertIn('total:', total)
+            self.assertIn('import pingpong:', later)
+
+    def test_load_on_enable(self):
+        config = dict(self.config, enabled={})
+        with BotHarness(config) as harness:
+            plugin_router = harness.bot._plugin_routers['pingpong']
+            harness.deliver('+123', None, '//enable pingpong')
+            self.assertTrue(harness.wait_for_sent(1))
+            self.assertIsNotNone(plugin_router.loaded)
+
+    def test_load_during_master_command(self):
+        # Plugins register their master commands when loaded, with the
+        # chat's lock held, so that must not wait for master commands
+        config = dict(self.config, testing_plugins=['reloadtest'],
+                      enabled={'+000': ['reloadtest']})
+        with BotHarness(config) as harness:
+            with harness.bot._master_lock:
+                harness.deliver('+000', None, 'hello')
+                self.assertTrue(harness.wait_for_sent(1))
+            harness.deliver('+123', None, '//generation')
+            self.assertTrue(harness.wait_for_sent(2))
+        self.assertTrue(harness.sent[1][1].startswith('generation '))
+
+    def test_eager(self):
+        config = dict(self.config, lazy_plugins=False)
+        with BotHarness(config) as harness:
+            report = self._startup_report(harness)
+        self.assertLess(report.index('import pingpong:'),
+                        report.index('total:'))
+        self.assertNotIn('After startup', report)
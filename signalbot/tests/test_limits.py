@@ -0,0 +1,271 @@
+from pathlib import Path
+from signalbot.ingress import Ingress
+from signalbot.plugins import PluginChat, PluginRouter, SHED
+from signalbot.signalbot import Message
+from signalbot.workers import WorkerPool
+from tempfile import TemporaryDirectory
+from threading import current_thread, Event, Lock, Thread
+from time import sleep
+import unittest
+
+
+class FakeChat(object):
+
+    def __init__(self, id, workers):
+        self.id = id
+        self._workers = workers
+
+    def __str__(self):
+        return self.id
+
+    def submit(self, fn, *args):
+        return self._workers.submit(fn, *args)
+
+    submit_priority = submit
+
+
+def _message(plugin_chat, text):
+    return Message(0, plugin_chat.chat, '+0', text, [])
+
+
+class LimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.workers = WorkerPool(threads=8, queue_size=0)
+        self.release = Event()
+        self.handled = []
+        self.lock = Lock()
+
+    def tearDown(self):
+        self.release.set()
+        self.workers.shutdown(wait=True)
+        self.tempdir.cleanup()
+
+    def _router(self, overflow='drop_oldest'):
+        test = self
+
+        class BlockingChat(PluginChat):
+            max_in_flight = 1
+            max_queued = 2
+
+            def triagemessage(self, message):
+                test.release.wait()
+                with test.lock:
+                    test.handled.append((str(self.chat), message.text))
+
+        self.router = PluginRouter(data_dir=Path(self.tempdir.name),
+                                   chat_class=BlockingChat, name='limits')
+        BlockingChat.overflow = self.overflow = overflow
+
+    def _chat(self, chat_id):
+        chat = FakeChat(chat_id, self.workers)
+        self.router.enable(chat)
+        return self.router._chats[chat_id]
+
+    def _run(self, plugin_chat, messages):
+        shed = SHED.value(plugin='limits', policy=self.overflow)
+        futures = [plugin_chat.start_processing(_message(plugin_chat, text))
+                   for text in messages]
+        self.release.set()
+        for future in futures:
+            if not future.cancelled():
+                future.result(timeout=5)
+        return (SHED.value(plugin='limits', policy=self.overflow) -
+                shed, [future.cancelled() for future in futures])
+
+    def test_drop_oldest(self):
+        self._router()
+        shed, cancelled = self._run(self._chat('+1'), [1, 2, 3, 4, 5])
+        self.assertEqual(2, shed)
+        self.assertEqual([False, True, True, False, False], cancelled)
+        self.assertEqual([('+1', 1), ('+1', 4), ('+1', 5)], self.handled)
+
+    def test_drop_newest(self):
+        self._router('drop_newest')
+        shed, cancelled = self._run(self._chat('+1'), [1, 2, 3, 4, 5])
+        self.assertEqual(2, shed)
+        self.assertEqual([('+1', 1), ('+1', 2), ('+1', 3)], self.handled)
+
+    def test_latest_only(self):
+        self._router('latest_only')
+        shed, cancelled = self._run(self._chat('+1'), [1, 2, 3, 4, 5])
+        self.assertEqual(3, shed)
+        self.assertEqual([('+1', 1), ('+1', 5)], self.handled)
+
+    def test_plugin_limit_is_fair(self):
+        self._router()
+        self.router.limiter.max_in_flight = 1
+        busy, other = self._chat('+1'), self._chat('+2')
+        futures = [busy.start_processing(_message(busy, 1)),
+                   busy.start_processing(_message(busy, 2)),
+                   other.start_processing(_message(other, 1))]
+        self.assertTrue(busy.busy and other.busy)
+        self.release.set()
+        for future in futures:
+            future.result(timeout=5)
+        # The other chat's message does not wait for all of the busy chat's
+        self.assertEqual([('+1', 1), ('+2', 1), ('+1', 2)], self.handled)
+        self.assertFalse(busy.busy or other.busy)
+
+    def test_full_pool(self):
+        # Handing out held back tasks from a worker thread must not wait
+        # for room in the queue that only that thread would make
+        self.workers.shutdown(wait=True)
+        self.workers = WorkerPool(threads=1, queue_size=1)
+        self._router()
+        plugin_chats = [self._chat('+1'), self._chat('+2')]
+        for plugin_chat in plugin_chats:
+            plugin_chat.max_queued = 0
+        # The first chat's task runs, the second one's fills the queue and
+        # the rest are held back
+        futures = [plugin_chat.start_processing(_message(plugin_chat, i))
+                   for i in range(20) for plugin_chat in plugin_chats]
+        self.release.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(40, len(self.handled))
+
+    def _isolation_holds_back(self, isolation_timeout):
+        # Tasks of a chat whose isolation lock is taken must not occupy the
+        # worker threads the other chats need
+        self.workers.shutdown(wait=True)
+        self.workers = WorkerPool(threads=2, queue_size=0)
+        test = self
+        locked = Event()
+
+        class IsolatingChat(PluginChat):
+
+            def triagemessage(self, message):
+                if message.text == 'lock':
+                    with self.isolated_thread:
+                        locked.set()
+                        test.release.wait()
+                with test.lock:
+                    test.handled.append((str(self.chat), message.text))
+
+        IsolatingChat.isolation_timeout = isolation_timeout
+        self.router = PluginRouter(data_dir=Path(self.tempdir.name),
+                                   chat_class=IsolatingChat, name='limits')
+        isolated, other = self._chat('+1'), self._chat('+2')
+        futures = [isolated.start_processing(_message(isolated, 'lock'))]
+        self.assertTrue(locked.wait(5))
+        futures += [isolated.start_processing(_message(isolated, i))
+                    for i in range(4)]
+        other.start_processing(_message(other, 'ping')).result(timeout=5)
+        self.assertEqual([('+2', 'ping')], self.handled)
+
+        self.release.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertCountEqual(
+            [('+1', 'lock')] + [('+1', i) for i in range(4)],
+            self.handled[1:])
+
+    def test_isolation_holds_back(self):
+        self._isolation_holds_back(0)
+
+    def test_fair_isolation_holds_back(self):
+        self._isolation_holds_back(5)
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_bounded(self):
+        workers = WorkerPool(threads=1, queue_size=1)
+        release = Event()
+        started = Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+        workers.submit(block)
+        started.wait(5)
+        # Fills the queue, so that the next submit has to wait
+        workers.submit(int)
+        submitted = Event()
+        Thread(target=lambda: (workers.submit(int), submitted.set())).start()
+        self.assertFalse(submitted.wait(.1))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        workers.shutdown(wait=True)
+
+
+class IngressTest(unittest.TestCase):
+
+    def _assert_ordered(self, priority=None):
+        handled = {}
+        threads = set()
+        lock = Lock()
+
+        def handler(key, n):
+            # Let items of other keys, i.e. of other dispatchers, overtake
+            if n % 3 == 0:
+                sleep(.001)
+            with lock:
+                handled.setdefault(key, []).append(n)
+                threads.add(current_thread())
+
+        ingress = Ingress(handler, key=lambda key, n: key, threads=4,
+                          priority=priority)
+        ingress.start()
+        keys = ['+{}'.format(i) for i in range(20)]
+        for n in range(30):
+            for key in keys:
+                ingress.put(key, n)
+        ingress.shutdown(wait=True)
+        self.assertEqual({key: list(range(30)) for key in keys}, handled)
+        self.assertGreater(len(threads), 1)
+
+    def test_sharded_order(self):
+        self._assert_ordered()
+
+    def test_sharded_order_with_priority(self):
+        self._assert_ordered(priority=lambda key, n: n % 5 == 4)
+
+    def test_shards_in_parallel(self):
+        waited = []
+
+        def handler(key, event):
+            if key == 'a':
+                waited.append(event.wait(5))
+            else:
+                event.set()
+
+        ingress = Ingress(handler, key=lambda key, event: key, threads=4)
+        # A key of another dispatcher than a's
+        other = next(key for key in map(str, range(100))
+                     if ingress._shard(key) is not ingress._shard('a'))
+        event = Event()
+        ingress.start()
+        ingress.put('a', event)
+        # Not held up by a, which waits for it
+        ingress.put(other, event)
+        ingress.shutdown(wait=True)
+        self.assertEqual([True], waited)
+
+
+class IngressPriorityTest(unittest.TestCase):
+
+    def test_priority_lane(self):
+        release = Event()
+        handled = []
+
+        def handler(key, text):
+            if text == 'slow':
+                release.wait(5)
+            handled.append((key, text))
+            if text == '//master':
+                release.set()
+
+        ingress = Ingress(handler, key=lambda key, text: key,
+                          priority=lambda key, text: text.startswith('//'))
+        ingress.start()
+        ingress.put('a', 'slow')
+        # Follows the slow message of its chat
+        ingress.put('a', '//after slow')
+        # Overtakes the slow message of the other chat
+        ingress.put('b', '//master')
+        ingress.shutdown(wait=True)
+        self.assertEqual([('b', '//master'), ('a', 'slow'),
+                          ('a', '//after slow')], handled)
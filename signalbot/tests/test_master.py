@@ -0,0 +1,86 @@
+from base64 import b64encode
+from .harness import BotHarness
+from pathlib import Path
+from signalbot.state import EnabledStore
+import unittest
+
+
+class BulkMasterCommandTest(unittest.TestCase):
+
+    groups = [b'\x01', b'\x02', b'\x03']
+
+    config = {
+        'master': ['+123'],
+        'plugins': ['pingpong'],
+        'testing_plugins': ['reloadtest'],
+    }
+
+    def _prepare(self, data_dir):
+        # Chats the bot knows of, from a plugin that has been removed
+        state = EnabledStore(Path.joinpath(data_dir, 'state.db'))
+        state.enable_many([(group_id, 'retired')
+                           for group_id in self.groups] +
+                          [('+491', 'retired'), ('+492', 'retired'),
+                           ('+331', 'retired')])
+        state.close()
+
+    def setUp(self):
+        self.harness = BotHarness(self.config, prepare=self._prepare)
+
+    def _command(self, text, n):
+        self.harness.deliver('+123', None, text)
+        self.assertTrue(self.harness.wait_for_sent(n))
+        return self.harness.sent[n - 1][1]
+
+    def _pongs(self):
+        return sorted(
+            str(sent[3]) for sent in self.harness.sent if sent[1] == 'pong')
+
+    def test_enable_disable(self):
+        with self.harness:
+            bot = self.harness.bot
+            self.assertEqual(
+                'Plugin pingpong enabled in 3 of 3 chats. ✔',
+                self._command('//enable pingpong --chats all-groups', 1))
+            self.assertEqual(
+                'Plugin pingpong enabled in 3 of 4 chats. ✔',
+                self._command(
+                    '//enable pingpong --chats +49*,{},+777'.format(
+                        b64encode(b'\x01').decode()), 2))
+            self.assertEqual(
+                sorted(self.groups + [b'+491', b'+492', b'+777']),
+                sorted(chat_id if isinstance(chat_id, bytes)
+                       else chat_id.encode()
+                       for chat_id in bot._state.chats('pingpong')))
+
+            for group_id in self.groups:
+                self.harness.deliver('+000', group_id, 'ping')
+            self.harness.deliver('+331', None, 'ping')
+            self.harness.deliver('+777', None, 'ping')
+            self.assertTrue(self.harness.wait_for_sent(6))
+
+            self.assertEqual(
+                'Plugin pingpong disabled in 6 of 7 chats. ✔',
+                self._command('//disable pingpong --chats all', 7))
+            self.assertEqual([], bot._state.chats('pingpong'))
+            self.assertEqual(
+                "--chats needs a value ❌",
+                self._command('//disable pingpong --chats', 8))
+            self.assertEqual(
+                "Unknown chats in --chats: {}, not-base64 ❌".format(
+                    b64encode(b'\x09').decode()),
+                self._command(
+                    '//enable pingpong --chats +777,{},not-base64'.format(
+                        b64encode(b'\x09').decode()), 9))
+            self.assertEqual([], bot._state.chats('pingpong'))
+        self.assertEqual(
+            sorted([str(chat_id) for chat_id in self.groups] +
+                   ["['+777']"]), self._pongs())
+
+    def test_plugin_command(self):
+        with self.harness:
+            self.assertTrue(
+                self._command('//generation', 1).startswith('generation '))
+            self.assertIn('//generation\n', self._command('//help', 2))
+            self.assertEqual('Invalid command. ❌',
+                             self._command('//nonsense', 3))
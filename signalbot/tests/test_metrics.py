@@ -0,0 +1,87 @@
+from pathlib import Path
+import socket
+from signalbot.metrics import Counter, Gauge, Histogram, MetricsExporter, \
+    Registry
+from signalbot.tests.harness import BotHarness
+from tempfile import TemporaryDirectory
+import unittest
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        counter = Counter('test_total', 'Test counter', ['plugin'],
+                          registry=self.registry)
+        counter.inc(plugin='a')
+        counter.inc(2, plugin='a')
+        counter.inc(plugin='b"\n')
+        gauge = Gauge('test_depth', 'Test gauge', registry=self.registry,
+                      function=lambda: 7)
+        self.assertEqual(3, counter.value(plugin='a'))
+        with self.assertRaises(ValueError):
+            counter.inc(chat='+123')
+        self.assertEqual(
+            '# HELP test_total Test counter\n'
+            '# TYPE test_total counter\n'
+            'test_total{plugin="a"} 3\n'
+            'test_total{plugin="b\\"\\n"} 1\n'
+            '# HELP test_depth Test gauge\n'
+            '# TYPE test_depth gauge\n'
+            'test_depth 7\n', self.registry.render())
+
+        gauge.set_function(None)
+        gauge.set(3)
+        gauge.dec()
+        self.assertIn('test_depth 2\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test histogram',
+                              registry=self.registry, buckets=(.1, 1.))
+        for value in [.05, .1, .5, 2.]:
+            histogram.observe(value)
+        self.assertEqual((4, 2.65), histogram.summary())
+        self.assertEqual(
+            ['test_seconds_bucket{le="0.1"} 2',
+             'test_seconds_bucket{le="1.0"} 3',
+             'test_seconds_bucket{le="+Inf"} 4',
+             'test_seconds_count 4',
+             'test_seconds_sum 2.65'], histogram.samples())
+
+    def test_exporter(self):
+        Counter('test_total', 'Test counter',
+                registry=self.registry).inc()
+        with TemporaryDirectory() as tempdir:
+            file = Path.joinpath(Path(tempdir), 'metrics.prom')
+            path = Path.joinpath(Path(tempdir), 'metrics.sock')
+            exporter = MetricsExporter(self.registry, file=file,
+                                       socket=path, interval=60)
+            try:
+                with socket.socket(socket.AF_UNIX) as client:
+                    client.connect(str(path))
+                    served = client.makefile('rb').read().decode()
+            finally:
+                exporter.shutdown()
+            self.assertEqual(self.registry.render(), served)
+            # Written on shutdown at the latest
+            self.assertEqual(self.registry.render(), file.read_text())
+            self.assertFalse(path.exists())
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_stats(self):
+        config = {'master': ['+123'], 'plugins': ['pingpong']}
+        with BotHarness(config) as harness:
+            harness.deliver('+123', None, '//enable pingpong')
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(2))
+            harness.deliver('+123', None, '//stats')
+            self.assertTrue(harness.wait_for_sent(3))
+        stats = harness.sent[2][1]
+        self.assertIn('# TYPE signalbot_messages_total counter\n', stats)
+        self.assertIn('signalbot_messages_total{outcome="routed"}', stats)
+        self.assertIn(
+            'signalbot_handler_seconds_count{plugin="pingpong"}', stats)
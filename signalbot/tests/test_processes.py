@@ -0,0 +1,130 @@
+from .harness import BotHarness
+from pathlib import Path
+from signalbot.attachments import AttachmentStore
+from signalbot.plugins import PluginRouter
+from signalbot.processes import ProcessPluginRouter
+from queue import Queue
+from signalbot.signalbot import Chat, Message
+from signalbot.tests.plugin_reloadtest import ReloadTestChat
+from tempfile import TemporaryDirectory
+import unittest
+
+
+class ProcessPluginTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123'],
+        'plugins': ['pingpong'],
+        'testing_plugins': ['pingponglocktest'],
+        'plugin_processes': {'pingpong': 2, 'pingponglocktest': 1},
+    }
+
+    def _sent(self, harness, recipient):
+        return [sent[1] for sent in harness.sent if sent[3] == recipient]
+
+    def test_pingpong(self):
+        group_id = b'\x01\x02'
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable pingpong')
+            harness.deliver('+123', group_id, '//enable pingpong')
+            for _ in range(3):
+                harness.deliver('+123', None, 'ping')
+                harness.deliver('+000', group_id, 'ping')
+            harness.deliver('+123', None, '//disable pingpong')
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(9, timeout=30))
+        # The bot's own replies may overtake those from worker processes
+        self.assertCountEqual(
+            ['Plugin pingpong enabled. ✔', 'pong', 'pong', 'pong',
+             'Plugin pingpong disabled. ✔'], self._sent(harness, ['+123']))
+        self.assertEqual(
+            ['Plugin pingpong enabled. ✔', 'pong', 'pong', 'pong'],
+            self._sent(harness, group_id))
+
+    def test_locking(self):
+        # Worker processes sleep in real time
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable pingponglocktest')
+            harness.deliver('+123', None, 'ping')
+            harness.deliver('+123', None, 'backup')
+            self.assertTrue(harness.wait_for_sent(6, timeout=30))
+        self.assertEqual(
+            ['Plugin pingponglocktest enabled. ✔',
+             'start pong',
+             'Acquiring lock...',
+             'pong',
+             'Locked - sleeping 1 sec ...',
+             '... done sleeping / locking'], self._sent(harness, ['+123']))
+
+    def test_wait_for_bot(self):
+        # With a single worker thread that waits for the group's name, the
+        # queue fills up while the response is on its way
+        config = dict(self.config, testing_plugins=['grouptest'],
+                      plugin_processes={'grouptest': 1},
+                      worker_threads=1, worker_queue_size=1)
+        group_id = b'\x01'
+        with BotHarness(config) as harness:
+            harness.transport.groups[group_id] = 'Group'
+            harness.deliver('+123', group_id, '//enable grouptest')
+            for _ in range(5):
+                harness.deliver('+000', group_id, 'name')
+            self.assertTrue(harness.wait_for_sent(6, timeout=30))
+        self.assertEqual(['Plugin grouptest enabled. ✔'] + ['Group'] * 5,
+                         [sent[1] for sent in harness.sent])
+
+    def test_attachment_pins(self):
+        config = dict(self.config, testing_plugins=['grouptest'],
+                      plugin_processes={'grouptest': 1})
+        with BotHarness(config) as harness:
+            harness.deliver('+123', None, '//enable grouptest')
+            harness.deliver('+123', None, 'pin')
+            self.assertTrue(harness.wait_for_sent(2, timeout=30))
+            # Pinned in the bot's store, which is the one evicting files
+            self.assertEqual(
+                ['pinned ' + path.name
+                 for path in harness.bot.attachments._pins],
+                [sent[1] for sent in harness.sent[1:]])
+
+
+class EvictedStatesTest(unittest.TestCase):
+
+    def test_processes_changed(self):
+        chats = [Chat(None, '+{}'.format(i)) for i in range(10)] + \
+            [Chat(None, bytes([1, i])) for i in range(5)]
+        with TemporaryDirectory() as data_dir:
+            data_dir = Path(data_dir)
+            attachments = AttachmentStore(Path.joinpath(data_dir, 'files'))
+
+            router = PluginRouter(data_dir, ReloadTestChat)
+            for count, chat in enumerate(chats):
+                router.enable(chat)
+                router._chats[chat.id].count = count
+                router.evict(chat)
+            router.close()
+
+            # Each time, the chats' states have to be found in the files of
+            # the processes they now belong to
+            replies = Queue()
+            for processes in [2, 3, 1]:
+                router = ProcessPluginRouter(
+                    '.tests.plugin_reloadtest', data_dir, 'reloadtest',
+                    call_bot=lambda method, text, *args: replies.put(text),
+                    attachments=attachments, processes=processes)
+                try:
+                    for chat in chats:
+                        router.enable(chat)
+                        router.triagemessage(
+                            Message(0, chat, '+0', 'count', []))
+                    for _ in chats:
+                        replies.get(timeout=30)
+                    for chat in chats:
+                        router.evict(chat)
+                finally:
+                    router.close()
+
+            router = PluginRouter(data_dir, ReloadTestChat)
+            for chat in chats:
+                router.enable(chat)
+            self.assertEqual(list(range(3, len(chats) + 3)),
+                             [router._chats[chat.id].count for chat in chats])
+            router.close()
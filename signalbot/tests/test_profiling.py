@@ -0,0 +1,100 @@
+from pathlib import Path
+from signalbot.profiling import Profiler
+from signalbot.tests.harness import BotHarness
+from tempfile import TemporaryDirectory
+from time import sleep
+import unittest
+
+
+def _slow_handler(seconds):
+    sleep(seconds)
+    return 'done'
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.output_dir = Path.joinpath(Path(self.tempdir.name), 'profiles')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _files(self, pattern):
+        if not self.output_dir.exists():
+            return []
+        return sorted(self.output_dir.glob(pattern))
+
+    def test_sample(self):
+        profiler = Profiler(self.output_dir, sample_rate=1,
+                            slow_threshold=60)
+        try:
+            self.assertEqual('done',
+                             profiler.run(_slow_handler, [0], 'chat/1'))
+        finally:
+            profiler.stop()
+        files = self._files('*.prof')
+        self.assertEqual(1, len(files))
+        self.assertTrue(files[0].name.endswith('-chat_1.prof'))
+        self.assertEqual([], self._files('*-slow.txt'))
+
+    def test_slow_handler(self):
+        profiler = Profiler(self.output_dir, sample_rate=0,
+                            slow_threshold=.05)
+        try:
+            profiler.run(_slow_handler, [.5], '+123')
+        finally:
+            profiler.stop()
+        self.assertEqual([], self._files('*.prof'))
+        files = self._files('*-slow.txt')
+        self.assertEqual(1, len(files))
+        report = files[0].read_text()
+        self.assertTrue(report.startswith('Handler took 0.5'))
+        # Captured by the watchdog while the handler was still running
+        self.assertIn('Stack after 0.050s', report)
+        self.assertIn('_slow_handler', report)
+
+    def test_exceptions(self):
+        profiler = Profiler(self.output_dir, sample_rate=1,
+                            slow_threshold=60)
+        try:
+            with self.assertRaises(TypeError):
+                profiler.run(_slow_handler, [None], 'chat')
+        finally:
+            profiler.stop()
+        self.assertEqual(1, len(self._files('*.prof')))
+        self.assertEqual({}, profiler._running)
+
+
+class ProfileCommandTest(unittest.TestCase):
+
+    def test_profile(self):
+        config = {'master': ['+123'], 'plugins': ['pingpong'],
+                  'profile_sample_rate': 1}
+        with BotHarness(config) as harness:
+            plugin_router = harness.bot._plugin_routers['pingpong']
+            harness.deliver('+123', None, '//enable pingpong')
+            harness.deliver('+123', None, '//profile pingpong on')
+            self.assertTrue(harness.wait_for_sent(2))
+            profiler = plugin_router.profiler
+            self.assertIsNotNone(profiler)
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(3))
+            # The profile is written once the handler has replied
+            self.assertTrue(harness.wait_until_idle())
+            harness.deliver('+123', None, '//profile pingpong off')
+            harness.deliver('+123', None, '//profile pingpong')
+            harness.deliver('+123', None, '//profile unknown on')
+            self.assertTrue(harness.wait_for_sent(6))
+            self.assertIsNone(plugin_router.profiler)
+            self.assertTrue(profiler._stop.is_set())
+            profiles = list(Path.joinpath(
+                plugin_router.data_dir, 'profiles').glob('*.prof'))
+        self.assertEqual(1, len(profiles))
+        self.assertEqual(
+            ['Plugin pingpong enabled. ✔',
+             'Stopped profiling plugin pingpong. ✔',
+             'Usage: //profile plugin on|off ❌',
+             'Plugin unknown not loaded ❌'],
+            [sent[1] for sent in harness.sent
+             if not sent[1].startswith(('Profiling', 'pong'))])
@@ -0,0 +1,94 @@
+from . import plugin_reloadtest
+from .harness import BotHarness
+import unittest
+
+
+class ReloadTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123'],
+        'testing_plugins': ['reloadtest', 'pingponglocktest'],
+    }
+
+    def _sent(self, harness, recipient):
+        return [sent[1] for sent in harness.sent if sent[3] == recipient]
+
+    def _reload(self, config, virtual_sleep=True):
+        with BotHarness(config) as harness:
+            harness.deliver('+123', None, '//enable reloadtest')
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(2))
+            harness.deliver('+123', None, 'slow')
+            harness.deliver('+123', None, '//reload reloadtest')
+            # Held back until the new router has taken over
+            harness.deliver('+123', None, 'ping')
+            if virtual_sleep:
+                harness.advance(1, sleepers=1)
+            self.assertTrue(harness.wait_for_sent(5))
+        return self._sent(harness, ['+123'])
+
+    def test_reload(self):
+        sent = self._reload(self.config)
+        generation = int(sent[1].split()[1])
+        self.assertEqual(
+            ['Plugin reloadtest enabled. ✔',
+             'ping {} 1'.format(generation),
+             'slow {} 2'.format(generation),
+             'Plugin reloadtest reloaded. ✔',
+             'ping {} 3'.format(generation + 1)], sent)
+
+    def test_reload_process_plugin(self):
+        # Worker processes import the plugin afresh
+        self.assertEqual(
+            ['Plugin reloadtest enabled. ✔',
+             'ping 1 1',
+             'slow 1 2',
+             'Plugin reloadtest reloaded. ✔',
+             'ping 1 3'],
+            self._reload(dict(self.config,
+                              plugin_processes={'reloadtest': 1}),
+                         virtual_sleep=False))
+
+    def test_roll_back(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable reloadtest')
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(2))
+            plugin_reloadtest.fail_take_over = \
+                plugin_reloadtest.generation + 1
+            self.addCleanup(setattr, plugin_reloadtest, 'fail_take_over',
+                            None)
+            harness.deliver('+123', None, '//reload reloadtest')
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(4))
+        sent = self._sent(harness, ['+123'])
+        generation = int(sent[1].split()[1])
+        # The old version carries on where it left off
+        self.assertEqual(
+            "Handing plugin reloadtest's chats over failed, keeping the old "
+            "version: Cannot take over ❌", sent[2])
+        self.assertEqual('ping {} 2'.format(generation), sent[3])
+
+    def test_other_plugins_unaffected(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable reloadtest')
+            harness.deliver('+123', None, '//enable pingponglocktest')
+            self.assertTrue(harness.wait_for_sent(2))
+            harness.deliver('+123', None, 'slow')
+            harness.deliver('+123', None, '//reload reloadtest')
+            # pingponglocktest handles this while reloadtest is drained
+            harness.deliver('+123', None, 'backup')
+            # Both plugins sleep on 'slow', pingponglocktest on 'backup'
+            harness.advance(.3, sleepers=3)
+            self.assertTrue(harness.wait_for_sent(4))
+            self.assertIn('Acquiring lock...', self._sent(harness, ['+123']))
+            self.assertNotIn('Plugin reloadtest reloaded. ✔',
+                             self._sent(harness, ['+123']))
+            harness.advance(.7, sleepers=2)
+            harness.advance(1, sleepers=1)
+            self.assertTrue(harness.wait_for_sent(10))
+        sent = self._sent(harness, ['+123'])
+        self.assertLess(sent.index('Acquiring lock...'),
+                        sent.index('Plugin reloadtest reloaded. ✔'))
+        generation = plugin_reloadtest.generation
+        self.assertIn('backup {} 2'.format(generation), sent)
@@ -0,0 +1,111 @@
+from .harness import BotHarness
+import random
+from signalbot.scheduler import TimingWheel
+import time
+import unittest
+
+
+class TimingWheelTest(unittest.TestCase):
+
+    def test_due(self):
+        wheel = TimingWheel(now=10, slots=4, levels=3)
+        due = {}
+        for i in range(500):
+            # Including ticks beyond the reach of the wheels and the past
+            due[i] = random.randint(0, 200)
+            wheel.add(i, due[i], i)
+        for i in range(0, 500, 7):
+            wheel.remove(i)
+            del due[i]
+        self.assertEqual(len(due), len(wheel))
+
+        fired = {}
+        for _ in range(200):
+            for i in wheel.advance():
+                fired[i] = wheel.now
+        self.assertEqual({i: max(tick, 11) for i, tick in due.items()},
+                         fired)
+        self.assertEqual(0, len(wheel))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123'],
+        'testing_plugins': ['scheduletest'],
+        # Exact in binary, so that virtual times fall on ticks exactly
+        'scheduler_tick': .25,
+    }
+
+    def _texts(self, harness):
+        return [sent[1] for sent in harness.sent]
+
+    def _wait_for_jobs(self, harness, n, timeout=10):
+        # Jobs of plugins in worker processes are added via the bot, so the
+        # bot is not idle until then
+        deadline = time.monotonic() + timeout
+        while len(harness.bot._scheduler) != n:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(.001)
+
+    def test_one_shot(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable scheduletest')
+            harness.deliver('+123', None, 'remind 1 later')
+            harness.deliver('+123', None, 'remind .5 sooner')
+            self._wait_for_jobs(harness, 2)
+            harness.advance(.5)
+            self.assertTrue(harness.wait_for_sent(2))
+            harness.advance(.5)
+            self.assertTrue(harness.wait_for_sent(3))
+        self.assertEqual(['Plugin scheduletest enabled. ✔', 'sooner',
+                          'later'], self._texts(harness))
+
+    def test_recurring(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable scheduletest')
+            harness.deliver('+123', None, 'every .5 tick')
+            self._wait_for_jobs(harness, 1)
+            for n in range(2, 5):
+                harness.advance(.5)
+                self.assertTrue(harness.wait_for_sent(n))
+            harness.deliver('+123', None, 'cancel tick')
+            self.assertTrue(harness.wait_for_sent(5))
+            self._wait_for_jobs(harness, 0)
+            harness.advance(1)
+            self.assertTrue(harness.wait_until_idle())
+        self.assertEqual(['Plugin scheduletest enabled. ✔', 'tick', 'tick',
+                          'tick', 'cancelled tick'], self._texts(harness))
+
+    def test_restart(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable scheduletest')
+            harness.deliver('+123', None, 'remind .5 still there')
+            self._wait_for_jobs(harness, 1)
+            # Due while the bot is not running
+            harness.restart(downtime=1)
+            # Run on the first tick after starting
+            harness.advance(.25)
+            self.assertTrue(harness.wait_for_sent(2))
+        self.assertEqual(['Plugin scheduletest enabled. ✔', 'still there'],
+                         self._texts(harness))
+
+    def test_disable(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable scheduletest')
+            harness.deliver('+123', None, 'remind .5 gone')
+            self._wait_for_jobs(harness, 1)
+            harness.deliver('+123', None, '//disable scheduletest')
+            self.assertTrue(harness.wait_for_sent(2))
+            self._wait_for_jobs(harness, 0)
+            harness.advance(1)
+            self.assertTrue(harness.wait_until_idle())
+        self.assertEqual(['Plugin scheduletest enabled. ✔',
+                          'Plugin scheduletest disabled. ✔'],
+                         self._texts(harness))
+
+
+class ProcessSchedulerTest(SchedulerTest):
+
+    config = dict(SchedulerTest.config,
+                  plugin_processes={'scheduletest': 1})
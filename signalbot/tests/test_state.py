@@ -0,0 +1,107 @@
+from os import chdir, getcwd
+from pathlib import Path
+from signalbot import Signalbot
+from signalbot.state import EnabledStore
+from signalbot.transports import LoopbackTransport
+from tempfile import TemporaryDirectory
+import unittest
+import yaml
+
+
+class EnabledStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.path = Path.joinpath(Path(self.tempdir.name), 'state.db')
+        self.store = EnabledStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tempdir.cleanup()
+
+    def test_migrate(self):
+        enabled = {
+            '+123': ['pingpong', 'echo'],
+            # Group ids as formerly stored in config.yaml
+            (1, 2): ['pingpong'],
+        }
+        self.store.migrate(enabled)
+        # Importing again changes nothing
+        self.store.migrate(enabled)
+        self.assertEqual(['+123', b'\x01\x02'], self.store.chats('pingpong'))
+        self.assertEqual(['pingpong', 'echo'], self.store.plugins('+123'))
+        self.assertEqual(['pingpong'], self.store.plugins(b'\x01\x02'))
+
+    def test_group_id_types(self):
+        # Lists of ints as handed over by D-Bus, tuples and bytes are the
+        # same chat
+        self.assertTrue(self.store.enable([1, 2], 'pingpong'))
+        self.assertFalse(self.store.enable((1, 2), 'pingpong'))
+        self.assertTrue(self.store.is_enabled(b'\x01\x02', 'pingpong'))
+        self.assertFalse(self.store.is_enabled('+123', 'pingpong'))
+        self.assertTrue(self.store.disable(b'\x01\x02', 'pingpong'))
+        self.assertFalse(self.store.disable([1, 2], 'pingpong'))
+        self.assertEqual([], self.store.all_chats())
+
+    def test_persistence(self):
+        self.store.enable('+123', 'pingpong')
+        self.store.enable_many([('+123', 'echo'), (b'\x01', 'echo')])
+        self.store.disable_many([('+123', 'pingpong')])
+        self.store.close()
+        self.store = EnabledStore(self.path)
+        self.assertEqual(['+123', b'\x01'], self.store.chats('echo'))
+        self.assertEqual([], self.store.chats('pingpong'))
+
+
+class ConfigMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = getcwd()
+        self.tempdir = TemporaryDirectory()
+        self.configfile = Path.joinpath(Path(self.tempdir.name),
+                                        'config.yaml')
+        config = {
+            'master': ['+123'],
+            'plugins': ['pingpong'],
+            'enabled': {'+000': ['pingpong'], (1, 2): ['pingpong']},
+        }
+        with self.configfile.open('w') as f:
+            yaml.dump(config, f)
+
+    def tearDown(self):
+        # Signalbot leaves its (deleted) fake working directory behind
+        chdir(self.cwd)
+        self.tempdir.cleanup()
+
+    def _run(self, replies, *messages):
+        transport = LoopbackTransport()
+        with Signalbot(data_dir=self.tempdir.name, transport=transport):
+            for sender, group_id, text in messages:
+                transport.deliver(sender, group_id, text)
+            self.assertTrue(transport.wait_for_sent(replies, 10))
+        return [sent[1] for sent in transport.sent]
+
+    def test_restart(self):
+        self.assertEqual(['pong', 'pong'], self._run(
+            2, ('+000', None, 'ping'), ('+456', b'\x01\x02', 'ping')))
+        # Only what the file had, without the defaults
+        with self.configfile.open() as f:
+            self.assertEqual({'master': ['+123'], 'plugins': ['pingpong']},
+                             yaml.load(f, Loader=yaml.FullLoader))
+
+        self.assertEqual(['Plugin pingpong disabled. ✔'], self._run(
+            1, ('+123', b'\x01\x02', '//disable pingpong')))
+        # Still disabled after a restart, and not migrated again
+        self.assertCountEqual(
+            ['pong', 'Plugin pingpong enabled. ✔'], self._run(
+                2, ('+000', None, 'ping'), ('+456', b'\x01\x02', 'ping'),
+                ('+123', None, '//enable pingpong')))
+
+    def test_relative_data_dir(self):
+        data_dir = Path(self.tempdir.name)
+        chdir(str(data_dir.parent))
+        transport = LoopbackTransport()
+        with Signalbot(data_dir=data_dir.name, transport=transport):
+            transport.deliver('+000', None, 'ping')
+            self.assertTrue(transport.wait_for_sent(1, 10))
+        self.assertTrue(Path.joinpath(data_dir, 'state.db').exists())
@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+from signalbot.tests.harness import BotHarness
+from signalbot.tracing import Tracer, TRACER
+from tempfile import TemporaryDirectory
+from time import sleep
+import unittest
+
+
+class TracerTest(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        tracer = Tracer(capacity=2)
+        with tracer.trace(tracer.new_trace()) as trace_id:
+            for name in ['a', 'b', 'c']:
+                with tracer.span(name, n=1):
+                    pass
+        self.assertIsNone(tracer.current())
+        self.assertEqual(['b', 'c'], [span[0] for span in tracer.spans()])
+        self.assertEqual({trace_id}, {span[1] for span in tracer.spans()})
+
+        tracer.capacity = 0
+        tracer.add('d', 0, 1)
+        self.assertEqual([], tracer.spans())
+
+    def test_export(self):
+        tracer = Tracer()
+        tracer.add('span', 1., 1.5, trace_id=7, plugin='test')
+        with TemporaryDirectory() as tempdir:
+            path = Path.joinpath(Path(tempdir), 'trace.json')
+            self.assertEqual(1, tracer.export(path))
+            events = json.load(path.open())['traceEvents']
+        self.assertEqual(
+            {'name': 'span', 'ph': 'X', 'ts': 1e6, 'dur': 5e5,
+             'args': {'trace': 7, 'plugin': 'test'}},
+            {key: events[0][key] for key in
+             ['name', 'ph', 'ts', 'dur', 'args']})
+        self.assertEqual('thread_name', events[1]['name'])
+
+
+class MessageTraceTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123'],
+        'plugins': ['pingpong'],
+    }
+
+    def _spans(self, trace_id):
+        return [span[0] for span in TRACER.spans() if span[1] == trace_id]
+
+    def test_pingpong(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable pingpong')
+            self.assertTrue(harness.wait_for_sent(1))
+            TRACER.clear()
+            harness.deliver('+123', None, 'ping')
+            self.assertTrue(harness.wait_for_sent(2))
+
+            trace_ids = {span[1] for span in TRACER.spans()
+                         if span[0] == 'triage'}
+            self.assertEqual(1, len(trace_ids))
+            trace_id = trace_ids.pop()
+            # Recorded once the outbox is done with the reply
+            for _ in range(100):
+                if 'reply' in self._spans(trace_id):
+                    break
+                sleep(.01)
+            self.assertCountEqual(
+                ['ingress wait', 'triage', 'queued', 'threadcounter',
+                 'triagemessage', 'reply'], self._spans(trace_id))
+
+            harness.deliver('+123', None, '//trace')
+            self.assertTrue(harness.wait_for_sent(3))
+        self.assertRegex(harness.sent[2][1], r'^Wrote \d+ spans to .*\.json')
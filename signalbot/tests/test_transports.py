@@ -0,0 +1,159 @@
+from base64 import b64encode
+from .harness import BotHarness
+import json
+from pathlib import Path
+import socket
+from signalbot.transports import JsonRpcError, JsonRpcTransport
+from tempfile import TemporaryDirectory
+from threading import Thread
+import unittest
+
+
+class LoopbackTest(unittest.TestCase):
+
+    config = {
+        'master': ['+123'],
+        'plugins': ['pingpong'],
+        'startup_notification': True,
+    }
+
+    def test_pingpong(self):
+        with BotHarness(self.config) as harness:
+            harness.deliver('+123', None, '//enable pingpong')
+            harness.deliver('+123', None, 'ping')
+            harness.deliver('+000', b'\x01\x02', 'ping')
+            self.assertTrue(harness.wait_for_sent(3))
+        self.assertEqual(
+            [['Always at your service! ✔', [], ['+123']],
+             ['Plugin pingpong enabled. ✔', [], ['+123']],
+             ['pong', [], ['+123']]],
+            [sent[1:] for sent in harness.sent])
+
+
+class JsonRpcTest(unittest.TestCase):
+    """
+    Talks to a minimal stand-in for `signal-cli daemon --socket`.
+    """
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.path = str(Path.joinpath(Path(self.tempdir.name), 'socket'))
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(1)
+        self.requests = []
+        self.thread = Thread(daemon=True, target=self._serve)
+        self.thread.start()
+
+        self.received = []
+        self.transport = JsonRpcTransport(
+            self.path, attachment_dir=self.tempdir.name, timeout=10)
+        self.transport.on_message = \
+            lambda *args: self.received.append(list(args))
+        self.transport.connect()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.close()
+        self.thread.join()
+        self.tempdir.cleanup()
+
+    def _serve(self):
+        self.connection, _ = self.server.accept()
+        with self.connection, self.connection.makefile('rb') as lines:
+            for line in lines:
+                request = json.loads(line)
+                self.requests.append(request)
+                if request['method'] == 'hang':
+                    # Never answered
+                    continue
+                elif request['method'] == 'hangup':
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                elif request['method'] == 'send':
+                    response = {'result': {'timestamp': 1}}
+                elif request['method'] == 'listGroups':
+                    groups = [
+                        {'id': b64encode(b'\x01\x02').decode(),
+                         'name': 'Test',
+                         'members': [{'number': '+000'}, {'number': '+111'}]},
+                        {'id': b64encode(b'\x03').decode(), 'name': 'Other',
+                         'members': ['+222']}]
+                    if 'groupId' in request['params']:
+                        groups = [group for group in groups if group['id'] ==
+                                  request['params']['groupId']]
+                    response = {'result': groups}
+                else:
+                    response = {'error': {'code': -32601,
+                                          'message': 'Method not found'}}
+                response.update({'jsonrpc': '2.0', 'id': request['id']})
+                self._write(response)
+
+    def _write(self, data):
+        self.connection.sendall(json.dumps(data).encode() + b'\n')
+
+    def test_send(self):
+        self.transport.send_message('Hi', [], ['+000'])
+        self.transport.send_group_message('Hi all', ['/a'], b'\x01\x02')
+        self.assertEqual('Test', self.transport.get_group_name(b'\x01\x02'))
+        self.assertEqual(
+            [{'recipient': ['+000'], 'message': 'Hi', 'attachments': []},
+             {'groupId': b64encode(b'\x01\x02').decode(), 'message': 'Hi all',
+              'attachments': ['/a']},
+             {'groupId': b64encode(b'\x01\x02').decode()}],
+            [request['params'] for request in self.requests])
+
+    def test_get_groups(self):
+        self.assertEqual(['+000', '+111'],
+                         self.transport.get_group_members(b'\x01\x02'))
+        self.assertEqual(
+            {b'\x03': ('Other', ['+222']), b'\x04': ('', [])},
+            self.transport.get_groups([b'\x03', b'\x04']))
+        # All groups at once
+        self.assertEqual({}, self.requests[-1]['params'])
+
+    def test_timeout(self):
+        self.transport._timeout = .1
+        with self.assertRaises(TimeoutError):
+            self.transport.call('hang', {})
+        self.assertEqual({}, self.transport._pending)
+
+    def test_connection_lost(self):
+        with self.assertRaises(ConnectionError):
+            self.transport.call('hangup', {})
+        # Noticed right away rather than after a timeout
+        self.transport._closed.wait(5)
+        self.assertTrue(self.transport._closed.is_set())
+        with self.assertRaises(ConnectionError):
+            self.transport.call('send', {})
+        self.assertEqual({}, self.transport._pending)
+
+    def test_error(self):
+        with self.assertRaises(JsonRpcError):
+            self.transport.call('unknown', {})
+
+    def test_receive(self):
+        # Wait for the connection to be accepted
+        self.transport.call('send', {})
+        envelope = {
+            'source': '+000',
+            'sourceNumber': '+000',
+            'timestamp': 1,
+            'dataMessage': {
+                'timestamp': 2,
+                'message': 'ping',
+                'groupInfo': {'groupId': b64encode(b'\x01').decode()},
+                'attachments': [{'id': 'abc'}],
+            },
+        }
+        self._write({'jsonrpc': '2.0', 'method': 'receive',
+                     'params': {'envelope': envelope}})
+        # Receipts are ignored
+        self._write({'jsonrpc': '2.0', 'method': 'receive',
+                     'params': {'envelope': {'source': '+000'}}})
+        # Responses are handled in order, so this one comes in afterwards
+        self.transport.call('send', {})
+        self.assertEqual(
+            [[2, '+000', b'\x01', 'ping',
+              [str(Path.joinpath(Path(self.tempdir.name), 'abc'))]]],
+            self.received)
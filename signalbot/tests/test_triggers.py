@@ -0,0 +1,78 @@
+import re
+from signalbot.triggers import Exact, HasAttachments, Prefix, Regex, \
+    TriggerIndex
+import unittest
+
+
+class FakeMessage(object):
+
+    def __init__(self, text, attachmentfiles=[]):
+        self.text = text
+        self.attachmentfiles = attachmentfiles
+
+
+class TriggerIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TriggerIndex()
+
+    def _match(self, text, attachmentfiles=[]):
+        return self.index.match(FakeMessage(text, attachmentfiles))
+
+    def test_exact_and_prefix(self):
+        self.index.add('ping', [Exact('ping')])
+        self.index.add('weather', [Prefix('!weather'), Prefix('!w ')])
+        self.index.add('bang', [Prefix('!')])
+        self.assertEqual({'ping'}, self._match('ping'))
+        self.assertEqual(set(), self._match('ping!'))
+        self.assertEqual({'weather', 'bang'}, self._match('!weather Berlin'))
+        self.assertEqual({'weather', 'bang'}, self._match('!w Berlin'))
+        self.assertEqual({'bang'}, self._match('!wx'))
+        self.assertEqual({'bang'}, self._match('!'))
+        self.assertEqual(set(), self._match(''))
+
+    def test_regex_flags(self):
+        self.index.add('shout', [Regex('hello', re.IGNORECASE)])
+        self.index.add('ascii', [Regex(r'^\w+$', re.ASCII), Regex('zzz')])
+        self.index.add('words', [Regex(r'^\w+$')])
+        # Each pattern keeps its flags in the combined pattern
+        self.assertEqual({'shout', 'ascii', 'words'}, self._match('HELLO'))
+        self.assertEqual({'words'}, self._match('héllo'))
+        self.assertEqual(set(), self._match('hi there'))
+
+    def test_multiple_regexes(self):
+        self.index.add('numbers', [Regex(r'^\d+$'), Regex(r'^#\d+')])
+        self.index.add('hashtags', [Regex(r'#[a-z]+')])
+        self.assertEqual({'numbers'}, self._match('42'))
+        self.assertEqual({'numbers'}, self._match('#42 is done'))
+        self.assertEqual({'hashtags'}, self._match('so #fun'))
+        self.assertEqual(set(), self._match('nothing'))
+
+    def test_global_inline_flags(self):
+        # Cannot be combined into one pattern, so tried one by one
+        self.index.add('a', [Regex('(?i)abc')])
+        self.index.add('b', [Regex('xyz')])
+        self.assertEqual({'a'}, self._match('ABC'))
+        self.assertEqual({'b'}, self._match('xyz'))
+
+    def test_backreferences(self):
+        self.index.add('x', [Regex(r'(x)\1')])
+        self.index.add('y', [Regex(r'(y)\1'), Regex(r'(?P<z>z)(?P=z)')])
+        self.assertEqual({'x'}, self._match('xx'))
+        self.assertEqual({'y'}, self._match('yy'))
+        self.assertEqual({'y'}, self._match('zz'))
+        self.assertEqual(set(), self._match('xy'))
+
+    def test_attachments_and_no_triggers(self):
+        self.index.add('images', [HasAttachments()])
+        self.index.add('everything')
+        self.assertEqual({'everything'}, self._match('hi'))
+        self.assertEqual({'images', 'everything'},
+                         self._match('hi', ['/tmp/a.jpg']))
+
+        self.index.remove('everything')
+        self.assertEqual(set(), self._match('hi'))
+
+    def test_unknown_trigger(self):
+        with self.assertRaises(TypeError):
+            self.index.add('broken', ['ping'])
@@ -0,0 +1,122 @@
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+import json
+from os import getpid
+from threading import current_thread, local, Lock
+from time import monotonic
+
+
+class Tracer(object):
+    """
+    Records spans, i.e. named intervals of work, in a ring buffer of the
+    last `capacity` spans; a capacity of 0 switches recording off.
+
+    Each incoming message gets a trace id, which is the current trace of
+    the threads working on it (see trace()) and is carried along by the
+    Message, so that all spans caused by the message can be told apart
+    from those of other messages. export() writes the spans in Chrome's
+    trace event format, to be viewed e.g. in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, capacity=10000):
+        self._ids = count(1)
+        self._local = local()
+        self._lock = Lock()
+        self.capacity = capacity
+
+    @property
+    def capacity(self):
+        return self._spans.maxlen
+
+    @capacity.setter
+    def capacity(self, capacity):
+        with self._lock:
+            spans = getattr(self, '_spans', [])
+            self._spans = deque(spans, maxlen=capacity)
+
+    def new_trace(self):
+        return next(self._ids)
+
+    def current(self):
+        """
+        The trace id of the current thread, None outside of traces.
+        """
+        return getattr(self._local, 'trace_id', None)
+
+    @contextmanager
+    def trace(self, trace_id):
+        """
+        Make `trace_id` the current trace of the thread meanwhile.
+        """
+        previous = self.current()
+        self._local.trace_id = trace_id
+        try:
+            yield trace_id
+        finally:
+            self._local.trace_id = previous
+
+    def add(self, name, start, end, trace_id=None, **args):
+        """
+        Record a span from `start` to `end` (as by time.monotonic()) of the
+        given trace, the current one by default.
+        """
+        if not self._spans.maxlen:
+            return
+        if trace_id is None:
+            trace_id = self.current()
+        thread = current_thread()
+        self._spans.append((name, trace_id, start, end, thread.ident,
+                            thread.name, args))
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Record the time spent in the block as a span of the current trace.
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, start, monotonic(), **args)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def chrome_trace(self):
+        """
+        The spans recorded so far as a Chrome trace event dict, with a row
+        per thread.
+        """
+        pid = getpid()
+        events = []
+        threads = {}
+        for name, trace_id, start, end, tid, thread, args in self.spans():
+            threads[tid] = thread
+            args = dict(args, trace=trace_id)
+            events.append({
+                'name': name, 'cat': 'signalbot', 'ph': 'X',
+                'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                'pid': pid, 'tid': tid, 'args': args})
+        for tid, thread in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': tid, 'args': {'name': thread}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        """
+        Write chrome_trace() to `path` as JSON; returns the number of spans.
+        """
+        trace = self.chrome_trace()
+        with open(str(path), 'w') as f:
+            json.dump(trace, f, default=str)
+        return sum(1 for event in trace['traceEvents'] if event['ph'] == 'X')
+
+
+# Shared by all of the bot's components, like metrics.REGISTRY
+TRACER = Tracer()
@@ -0,0 +1,336 @@
+from abc import ABC, abstractmethod
+from base64 import b64decode, b64encode
+from concurrent.futures import Future
+from itertools import count
+import json
+from pathlib import Path
+import socket
+from threading import Condition, Event, Lock, Thread
+import time
+from traceback import print_exc
+
+
+class Transport(ABC):
+    """
+    Connection to signal-cli (or something pretending to be it).
+
+    Incoming messages are passed to `on_message` as
+        on_message(timestamp, sender, group_id, text, attachmentfiles)
+    where group_id is empty for direct messages. The callback has to return
+    quickly since it is called from the transport's receiving thread.
+    """
+
+    def __init__(self):
+        self.on_message = None
+        self._closed = Event()
+
+    def _receive(self, timestamp, sender, group_id, text, attachmentfiles):
+        if self.on_message is not None:
+            self.on_message(timestamp, sender, group_id, text,
+                            attachmentfiles)
+
+    def connect(self):
+        """
+        Start receiving messages.
+        """
+        self._closed.clear()
+
+    def close(self):
+        self._closed.set()
+
+    def wait(self):
+        """
+        Block until the transport has been closed.
+        """
+        self._closed.wait()
+
+    @abstractmethod
+    def send_message(self, text, attachments, recipients):
+        pass
+
+    @abstractmethod
+    def send_group_message(self, text, attachments, group_id):
+        pass
+
+    @abstractmethod
+    def get_group_name(self, group_id):
+        pass
+
+    @abstractmethod
+    def get_group_members(self, group_id):
+        pass
+
+    def get_groups(self, group_ids):
+        """
+        Names and members of many groups as {group_id: (name, members)};
+        transports that can look them up at once override this.
+        """
+        return {group_id: (self.get_group_name(group_id),
+                           self.get_group_members(group_id))
+                for group_id in group_ids}
+
+
+class DBusTransport(Transport):
+    """
+    signal-cli's D-Bus interface, or the interface of signalclidbusmock if
+    `mocker` is set. `bus` is 'session', 'system' or the address of a bus.
+    """
+
+    def __init__(self, bus=None, mocker=False):
+        super().__init__()
+        self._bus_name = bus
+        self._mocker = mocker
+
+    def connect(self):
+        # Only needed for this transport, so do not require them otherwise
+        from gi.repository import GLib
+        from pydbus import connect, SessionBus, SystemBus
+
+        super().connect()
+        if self._bus_name == 'session' or self._bus_name is None:
+            self._bus = SessionBus()
+        elif self._bus_name == 'system':
+            self._bus = SystemBus()
+        else:
+            self._bus = connect(self._bus_name)
+
+        if self._mocker:
+            self._signal = self._bus.get('org.signalbot.signalclidbusmock')
+        else:
+            self._signal = self._bus.get('org.asamk.Signal')
+        self._signal.onMessageReceived = self._receive
+
+        self._loop = GLib.MainLoop()
+        self._thread = Thread(daemon=True, target=self._loop.run)
+        self._thread.start()
+
+    def close(self):
+        self._loop.quit()
+        self._thread.join()
+        self._signal.onMessageReceived = None
+        super().close()
+
+    def send_message(self, text, attachments, recipients):
+        self._signal.sendMessage(text, attachments, recipients)
+
+    def send_group_message(self, text, attachments, group_id):
+        self._signal.sendGroupMessage(text, attachments, list(group_id))
+
+    def get_group_name(self, group_id):
+        return self._signal.getGroupName(list(group_id))
+
+    def get_group_members(self, group_id):
+        return list(self._signal.getGroupMembers(list(group_id)))
+
+
+class LoopbackTransport(Transport):
+    """
+    In-process stand-in for signal-cli, e.g. for tests and benchmarks.
+
+    deliver() hands a message to the bot directly, without serialization,
+    while everything the bot sends is recorded in `sent` as
+    [time, text, attachments, recipients or group_id] like signalclidbusmock
+    does.
+    """
+
+    def __init__(self, groups=None, members=None, clock=time.time):
+        super().__init__()
+        # Group id -> name and -> list of members
+        self.groups = {} if groups is None else groups
+        self.members = {} if members is None else members
+        self.sent = []
+        self._clock = clock
+        self._cv = Condition()
+
+    def deliver(self, sender, group_id, text, attachmentfiles=[],
+                timestamp=None):
+        if timestamp is None:
+            timestamp = int(self._clock() * 1000)
+        self._receive(timestamp, sender, group_id or b'', text,
+                      attachmentfiles)
+
+    def _record(self, item):
+        with self._cv:
+            self.sent.append([self._clock()] + item)
+            self._cv.notify_all()
+
+    def wait_for_sent(self, n, timeout=None):
+        """
+        Wait until at least n messages have been sent in total.
+        """
+        with self._cv:
+            return self._cv.wait_for(lambda: len(self.sent) >= n, timeout)
+
+    def send_message(self, text, attachments, recipients):
+        self._record([text, list(attachments), list(recipients)])
+
+    def send_group_message(self, text, attachments, group_id):
+        self._record([text, list(attachments), bytes(group_id)])
+
+    def get_group_name(self, group_id):
+        return self.groups.get(bytes(group_id), '')
+
+    def get_group_members(self, group_id):
+        return list(self.members.get(bytes(group_id), []))
+
+
+class JsonRpcError(Exception):
+
+    def __init__(self, error):
+        super().__init__(error.get('message', 'JSON-RPC error'))
+        self.code = error.get('code')
+        self.data = error.get('data')
+
+
+class JsonRpcTransport(Transport):
+    """
+    Newline-delimited JSON-RPC 2.0 over a Unix socket, as spoken by
+    `signal-cli daemon --socket`.
+
+    Incoming messages arrive as "receive" notifications; attachments are
+    referred to by id and are looked up in `attachment_dir`.
+    """
+
+    def __init__(self, path, attachment_dir=None, timeout=30):
+        super().__init__()
+        self._path = str(path)
+        if attachment_dir is None:
+            attachment_dir = Path.joinpath(
+                Path.home(), '.local', 'share', 'signal-cli', 'attachments')
+        self._attachment_dir = Path(attachment_dir)
+        self._timeout = timeout
+
+        self._ids = count(1)
+        # Request id -> Future for the response and whether the connection
+        # is up, protected by _lock
+        self._pending = {}
+        self._connected = False
+        self._lock = Lock()
+        self._send_lock = Lock()
+
+    def connect(self):
+        super().connect()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(self._path)
+        with self._lock:
+            self._connected = True
+        self._reader = Thread(daemon=True, target=self._read)
+        self._reader.start()
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._reader.join()
+        super().close()
+
+    def _read(self):
+        try:
+            with self._socket.makefile('rb') as lines:
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        self._handle(json.loads(line))
+                    except Exception:
+                        # A malformed or unexpected line must not stop
+                        # receiving
+                        print_exc()
+        except OSError:
+            # E.g. the connection has been reset
+            print_exc()
+        finally:
+            # Connection closed; nobody is going to answer pending requests
+            with self._lock:
+                self._connected = False
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError("Connection closed"))
+            # Lets wait() return, whoever closed the connection
+            self._closed.set()
+
+    def _handle(self, data):
+        if 'id' in data and 'method' not in data:
+            with self._lock:
+                future = self._pending.pop(data['id'], None)
+            if future is None:
+                return
+            if 'error' in data:
+                future.set_exception(JsonRpcError(data['error']))
+            else:
+                future.set_result(data.get('result'))
+        elif data.get('method') == 'receive':
+            self._handle_envelope(data['params']['envelope'])
+
+    def _handle_envelope(self, envelope):
+        data_message = envelope.get('dataMessage')
+        # Receipts, typing notifications etc. are of no interest
+        if data_message is None:
+            return
+        group_info = data_message.get('groupInfo')
+        group_id = b64decode(group_info['groupId']) if group_info else b''
+        attachmentfiles = [
+            str(Path.joinpath(self._attachment_dir, attachment['id']))
+            for attachment in data_message.get('attachments', [])]
+        self._receive(
+            data_message.get('timestamp', envelope.get('timestamp')),
+            envelope.get('sourceNumber') or envelope.get('source'),
+            group_id, data_message.get('message') or '', attachmentfiles)
+
+    def call(self, method, params):
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            if not self._connected:
+                raise ConnectionError("Connection closed")
+            self._pending[request_id] = future
+        request = {'jsonrpc': '2.0', 'method': method, 'params': params,
+                   'id': request_id}
+        line = json.dumps(request).encode() + b'\n'
+        try:
+            with self._send_lock:
+                self._socket.sendall(line)
+            return future.result(self._timeout)
+        finally:
+            # Gone already unless sending failed or the call timed out
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def send_message(self, text, attachments, recipients):
+        self.call('send', {'recipient': list(recipients), 'message': text,
+                           'attachments': list(attachments)})
+
+    def send_group_message(self, text, attachments, group_id):
+        self.call('send', {'groupId': b64encode(bytes(group_id)).decode(),
+                           'message': text, 'attachments': list(attachments)})
+
+    def _group(self, group_id):
+        encoded = b64encode(bytes(group_id)).decode()
+        for group in self.call('listGroups', {'groupId': encoded}) or []:
+            if group.get('id') == encoded:
+                return group
+        return {}
+
+    def get_group_name(self, group_id):
+        return self._group(group_id).get('name') or ''
+
+    def get_group_members(self, group_id):
+        return _members(self._group(group_id))
+
+    def get_groups(self, group_ids):
+        # All groups in one call
+        groups = {b64decode(group['id']): group
+                  for group in self.call('listGroups', {}) or []
+                  if 'id' in group}
+        return {group_id: (groups.get(bytes(group_id), {}).get('name') or '',
+                           _members(groups.get(bytes(group_id), {})))
+                for group_id in group_ids}
+
+
+def _members(group):
+    # Newer versions of signal-cli list members as objects
+    return [member.get('number') or member.get('uuid')
+            if isinstance(member, dict) else member
+            for member in group.get('members') or []]
@@ -0,0 +1,172 @@
+import re
+
+
+class Trigger(object):
+    """
+    Base class of the triggers a PluginChat subclass can declare in its
+    `triggers` attribute. A message is only handed to the plugin if at least
+    one of its triggers matches.
+    """
+    pass
+
+
+class Exact(Trigger):
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Prefix(Trigger):
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+
+class Regex(Trigger):
+    """
+    Matches if the pattern is found anywhere in the text, i.e. re.search
+    semantics; anchor the pattern if needed.
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.regex = re.compile(pattern, flags)
+
+
+class HasAttachments(Trigger):
+    pass
+
+
+# Flags that can be expressed as a scoped inline group, e.g. (?i:...), so
+# that each pattern keeps its own flags in a combined pattern
+_INLINE_FLAGS = [(re.ASCII, 'a'), (re.IGNORECASE, 'i'), (re.MULTILINE, 'm'),
+                 (re.DOTALL, 's'), (re.VERBOSE, 'x')]
+
+
+def _scoped(regex):
+    flags = ''.join(letter for flag, letter in _INLINE_FLAGS
+                    if regex.flags & flag)
+    if flags:
+        return '(?{}:{})'.format(flags, regex.pattern)
+    return '(?:{})'.format(regex.pattern)
+
+
+def _combine(regexes):
+    if len(regexes) == 1:
+        return regexes[0]
+    if any(regex.groups for regex in regexes):
+        # Groups would be renumbered, which breaks backreferences like \1
+        return None
+    try:
+        return re.compile('|'.join(_scoped(regex) for regex in regexes))
+    except re.error:
+        # E.g. global inline flags like "(?i)" are not allowed inside a
+        # group; fall back to trying the patterns one by one
+        return None
+
+
+class _CompiledTriggers(object):
+
+    def __init__(self, plugin_triggers):
+        always = set()
+        self._exact = {}
+        # Prefix trie; each node is a dict mapping characters to child nodes
+        # and None to the plugins whose prefix ends at that node
+        self._trie = {}
+        regexes = {}
+        attachments = set()
+
+        for plugin, triggers in plugin_triggers.items():
+            if triggers is None:
+                always.add(plugin)
+                continue
+            for trigger in triggers:
+                if isinstance(trigger, Exact):
+                    self._exact.setdefault(trigger.text, set()).add(plugin)
+                elif isinstance(trigger, Prefix):
+                    node = self._trie
+                    for char in trigger.prefix:
+                        node = node.setdefault(char, {})
+                    node.setdefault(None, set()).add(plugin)
+                elif isinstance(trigger, Regex):
+                    regexes.setdefault(plugin, []).append(trigger.regex)
+                elif isinstance(trigger, HasAttachments):
+                    attachments.add(plugin)
+                else:
+                    raise TypeError("Unknown trigger {!r} of plugin {}".format(
+                        trigger, plugin))
+
+        self._always = frozenset(always)
+        self._attachments = frozenset(attachments)
+
+        # One combined pattern per plugin, plus one for all plugins that
+        # rules out most non-matching messages with a single search
+        self._regexes = []
+        for plugin, plugin_regexes in regexes.items():
+            self._regexes.append(
+                (plugin, plugin_regexes, _combine(plugin_regexes)))
+        self._any_regex = _combine(
+            [regex for plugin_regexes in regexes.values()
+             for regex in plugin_regexes]) if regexes else None
+
+    def match(self, message):
+        text = message.text
+        plugins = set(self._always)
+
+        if text in self._exact:
+            plugins |= self._exact[text]
+
+        node = self._trie
+        for char in text:
+            if None in node:
+                plugins |= node[None]
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if None in node:
+                plugins |= node[None]
+
+        if self._regexes and (self._any_regex is None or
+                              self._any_regex.search(text)):
+            for plugin, plugin_regexes, combined in self._regexes:
+                if plugin in plugins:
+                    continue
+                if combined is not None:
+                    if combined.search(text):
+                        plugins.add(plugin)
+                elif any(regex.search(text) for regex in plugin_regexes):
+                    plugins.add(plugin)
+
+        if message.attachmentfiles:
+            plugins |= self._attachments
+
+        return plugins
+
+
+class TriggerIndex(object):
+    """
+    Matches messages against the triggers of all registered plugins at
+    once. Plugins registered without triggers match every message.
+    """
+
+    def __init__(self):
+        self._plugin_triggers = {}
+        self._compiled = _CompiledTriggers({})
+
+    def add(self, plugin, triggers=None):
+        self._plugin_triggers[plugin] = \
+            None if triggers is None else list(triggers)
+        self._compiled = _CompiledTriggers(self._plugin_triggers)
+
+    def remove(self, plugin):
+        if plugin in self._plugin_triggers:
+            del self._plugin_triggers[plugin]
+            self._compiled = _CompiledTriggers(self._plugin_triggers)
+
+    def match(self, message):
+        """
+        Return the set of plugins that want to process the message.
+        """
+        # Recompiling replaces _compiled as a whole, so this is safe to call
+        # concurrently with add() and remove()
+        return self._compiled.match(message)
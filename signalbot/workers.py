@@ -0,0 +1,97 @@
+from concurrent.futures import Future
+from queue import Queue
+from threading import get_ident, Semaphore, Thread
+from traceback import print_exception
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads sharing one bounded FIFO queue.
+
+    Tasks are started in the order they were submitted, so messages of the
+    same chat still start processing in the order they arrived while tasks
+    of different chats run in parallel. Tasks of the same chat may still run
+    concurrently (as they did with one thread per message), which keeps
+    IsolationLock/ChatThreadcounter working as before.
+    """
+
+    def __init__(self, threads=16, queue_size=1000):
+        if threads < 1:
+            raise ValueError("A worker pool needs at least one thread")
+
+        # A queue_size of 0 means unbounded; when bounded, submit() blocks
+        # until there is room in the queue again. Except in the pool's own
+        # threads: a task that submits a follow-up task once it is done, like
+        # PluginChat handing out held back tasks, would otherwise wait for
+        # itself when the queue is full
+        self._queue = Queue()
+        self._room = Semaphore(queue_size) if queue_size else None
+        self._busy = 0
+        self._threads = []
+        for _ in range(threads):
+            t = Thread(daemon=True, target=self._work)
+            t.start()
+            self._threads.append(t)
+        self._idents = {t.ident for t in self._threads}
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, counted = item
+            if counted:
+                self._room.release()
+            if not future.set_running_or_notify_cancel():
+                self._queue.task_done()
+                continue
+            # Only an estimate, but good enough for metrics
+            self._busy += 1
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                # Nobody might ever look at the future, so report the error
+                # just like an uncaught exception in a plain Thread would be
+                print_exception(type(e), e, e.__traceback__)
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
+
+    @property
+    def busy(self):
+        """
+        Number of workers currently running a task.
+        """
+        return self._busy
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    @property
+    def idle(self):
+        """
+        Whether all tasks submitted so far are done, including the done
+        callbacks of their futures.
+        """
+        return not self._queue.unfinished_tasks
+
+    def submit(self, fn, *args):
+        future = Future()
+        counted = self._room is not None and get_ident() not in self._idents
+        if counted:
+            self._room.acquire()
+        self._queue.put((future, fn, args, counted))
+        return future
+
+    def shutdown(self, wait=False):
+        # One sentinel per worker; tasks queued before the sentinels are
+        # still processed
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
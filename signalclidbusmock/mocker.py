@@ -1,15 +1,27 @@
 from .signalclidbusmock import SignalCLIDBusMock
 from gi.repository import GLib
-from pydbus import SessionBus
+from pydbus import connect, SessionBus
 from threading import Thread
 import time
 
 
 class Mocker(object):
+    """
+    Publishes a SignalCLIDBusMock on the session bus or, if given, on the
+    bus at address `bus`, e.g. a private bus per test process. Timestamps
+    are taken from `clock`, e.g. a signalbot.clock.VirtualClock.
+    """
+
+    def __init__(self, bus=None, clock=None):
+        self._bus_address = bus
+        self._clock = time if clock is None else clock
 
     def start(self):
-        self._bus = SessionBus()
-        self._mock = SignalCLIDBusMock()
+        if self._bus_address is None:
+            self._bus = SessionBus()
+        else:
+            self._bus = connect(self._bus_address)
+        self._mock = SignalCLIDBusMock(clock=self._clock)
         self._mockerservice = self._bus.publish(
             "org.signalbot.signalclidbusmock",
             self._mock)
@@ -20,17 +32,19 @@ class Mocker(object):
         self._wait_until = 0
 
     def messageSignalbot(self, sender, group_id, text, attachmentfiles):
-        self._mock.MessageReceived(int(time.time()),
-                                   sender, group_id, text, attachmentfiles)
-        self.tosignalbot.append([int(time.time()),
-                                 sender, group_id, text, attachmentfiles])
+        now = int(self._clock.time())
+        self._mock.MessageReceived(now, sender, group_id, text,
+                                   attachmentfiles)
+        self.tosignalbot.append([now, sender, group_id, text,
+                                 attachmentfiles])
 
     def _wait_until_n_messages(self, n=1, timeout=1):
         return self._mock.wait_until_n_messages(n=n, timeout=timeout)
 
     def wait_for_n_messages(self, n=1, timeout=1):
         self._wait_until += n
-        self._wait_until_n_messages(n=self._wait_until, timeout=timeout)
+        return self._wait_until_n_messages(n=self._wait_until,
+                                           timeout=timeout)
 
     @property
     def fromsignalbot(self):
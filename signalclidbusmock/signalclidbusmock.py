@@ -21,6 +21,10 @@ class SignalCLIDBusMock(object):
                 <arg type="ay" direction="in" name="group_id" />
                 <arg type="s" direction="out" />
             </method>
+            <method name="getGroupMembers">
+                <arg type="ay" direction="in" name="group_id" />
+                <arg type="as" direction="out" />
+            </method>
             <signal name="MessageReceived">
                 <arg type="x" direction="out" />
                 <arg type="s" direction="out" />
@@ -32,36 +36,40 @@ class SignalCLIDBusMock(object):
     </node>
     """
 
-    def __init__(self):
+    def __init__(self, clock=None):
+        # Anything with a time() method, e.g. a signalbot.clock.Clock
+        self._clock = time if clock is None else clock
         self._cv = Condition()
         self._sentmessages = []
         self._groups = {(0, 1, 2): 'test group'}
+        self._members = {(0, 1, 2): ['+123', '+456']}
 
     def wait_until_n_messages(self, n=1, timeout=1):
+        # Real time, whatever the clock; returns as soon as the messages are
+        # there
         with self._cv:
-            time_start = time.time()
-            while len(self._sentmessages) < n:
-                self._cv.wait(timeout=timeout)
-                if timeout is not None and time.time() - time_start > timeout:
-                    return False
-        return True
+            return self._cv.wait_for(lambda: len(self._sentmessages) >= n,
+                                     timeout)
 
     def sendMessage(self, message, attachmentfiles, recipients):
         if len(recipients) > 1 and all([len(k) == 1 for k in recipients]):
             raise TypeError('conform with signal-cli 0.6.0 and wrap single '
                             'recipient into list like so [\'+123\']')
         with self._cv:
-            self._sentmessages.append([time.time(),
+            self._sentmessages.append([self._clock.time(),
                                        message, attachmentfiles, recipients])
             self._cv.notify_all()
 
     def sendGroupMessage(self, message, attachmentfiles, group_id):
         with self._cv:
-            self._sentmessages.append([time.time(),
+            self._sentmessages.append([self._clock.time(),
                                        message, attachmentfiles, group_id])
             self._cv.notify_all()
 
     def getGroupName(self, group_id):
         return self._groups.get(tuple(group_id), '')
 
+    def getGroupMembers(self, group_id):
+        return self._members.get(tuple(group_id), [])
+
     MessageReceived = signal()